@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biomed_iot.settings')
+# Read by settings.SERVED_BY_ASGI, which enables the async views
+os.environ['BIOMED_IOT_SERVED_BY_ASGI'] = 'true'
 
 application = get_asgi_application()
@@ -75,12 +75,16 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'users.context_processors.default_title',  # Custom context processsor
+                'users.context_processors.provisioning_status',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'biomed_iot.wsgi.application'
+ASGI_APPLICATION = 'biomed_iot.asgi.application'
+# Set by asgi.py: the app is served by an ASGI server, so the async views (e.g. users.views.adevices) are routed
+SERVED_BY_ASGI = os.environ.get('BIOMED_IOT_SERVED_BY_ASGI') == 'true'
 
 
 # Database
@@ -90,6 +94,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock when they start and wait up to 20 s for it, so concurrent
+        # writers (provisioning threads, worker, web requests) wait instead of failing with 'database is locked'
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
     },
     # 'default': {
     #     'ENGINE': 'django.db.backends.postgresql',
@@ -101,6 +108,16 @@ DATABASES = {
     # }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Shared by all gunicorn workers, so e.g. invalidating the InfluxDB schema cache after a delete reaches every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 AUTHENTICATION_BACKENDS = [  # first successful auth backend will authenticate the user
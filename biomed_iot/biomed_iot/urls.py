@@ -31,7 +31,7 @@ urlpatterns = [
     # path('o/', include('oauth2_provider.urls', namespace='oauth2_provider')),
     # path('auth/callback/', views.oauth_callback, name='oauth_callback'),
 
-    path('devices/', user_views.devices, name='devices'),
+    path('devices/', user_views.adevices if settings.SERVED_BY_ASGI else user_views.devices, name='devices'),
     path('message-and-topic-structure/', user_views.message_and_topic_structure, name='message-and-topic-structure'),
     path('code-examples/', user_views.code_examples, name='code-examples'),
     path('setup-gateway/', user_views.setup_gateway, name='setup-gateway'),
@@ -97,6 +97,8 @@ urlpatterns = [
 
     # path('set_timezone/', user_views.set_timezone, name='set_timezone'),
 
+    path('metrics/', user_views.metrics, name='metrics'),
+
     path('', include('core.urls')),
 
     path("ajax/tags/", user_views.ajax_get_tags, name="ajax_get_tags"),
@@ -1,8 +1,29 @@
 from core.admin_site import admin_site
-from django.contrib import admin
+from django.contrib import admin, messages
 from .models import CustomUser, Profile, NodeRedUserData, MqttClient, MqttMetaData, InfluxUserData
+from .models import ProvisioningStatus, ProvisioningJob, DeprovisioningSaga
+from .services.deprovisioning import deprovision_users, run_sagas
 
 
+class CustomUserAdmin(admin.ModelAdmin):
+    actions = ['delete_with_resources']
+
+    @admin.action(description='Delete selected users and their MQTT, InfluxDB, Grafana and Node-RED resources')
+    def delete_with_resources(self, request, queryset):
+        # Tears down several users at once, the pre_delete signal then skips the users with a completed saga
+        results = deprovision_users(list(queryset))
+        failed = [user_id for user_id, success in results.items() if not success]
+        count = queryset.count()
+        queryset.delete()
+        self.message_user(request, f'{count} user(s) deleted.')
+        if failed:
+            self.message_user(
+                request,
+                f'The resources of {len(failed)} user(s) could not be removed completely, '
+                f'retry them under Deprovisioning sagas.',
+                level=messages.WARNING,
+            )
+
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'image')
 
@@ -18,10 +39,36 @@ class MqttMetaDataAdmin(admin.ModelAdmin):
 class InfluxUserDataAdmin(admin.ModelAdmin):
     list_display = ('user', 'bucket_name', 'bucket_id', 'bucket_token', 'bucket_token_id')
 
+class ProvisioningStatusAdmin(admin.ModelAdmin):
+    list_display = ('user', 'state', 'mqtt_done', 'influx_done', 'grafana_done', 'attempts', 'updated_at')
+    list_filter = ('state',)
+
+class ProvisioningJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'attempts', 'run_after', 'locked_by', 'last_error')
+    list_filter = ('status',)
+
+class DeprovisioningSagaAdmin(admin.ModelAdmin):
+    list_display = (
+        'username', 'user_id', 'state', 'mqtt_done', 'influx_done', 'grafana_done', 'nodered_done', 'attempts',
+        'updated_at',
+    )
+    list_filter = ('state',)
+    search_fields = ('username',)
+    actions = ['retry']
+
+    @admin.action(description='Retry the failed steps of the selected sagas')
+    def retry(self, request, queryset):
+        results = run_sagas(queryset.exclude(state=DeprovisioningSaga.DONE))
+        succeeded = sum(results.values())
+        self.message_user(request, f'{succeeded} of {len(results)} saga(s) completed.')
+
 # use custom admin_site instead of admin.site
-admin_site.register(CustomUser)
+admin_site.register(CustomUser, CustomUserAdmin)
 admin_site.register(Profile, ProfileAdmin)
 admin_site.register(NodeRedUserData, NodeRedUserDataAdmin)
 admin_site.register(MqttClient, MqttClientAdmin)
 admin_site.register(MqttMetaData, MqttMetaDataAdmin)
 admin_site.register(InfluxUserData, InfluxUserDataAdmin)
+admin_site.register(ProvisioningStatus, ProvisioningStatusAdmin)
+admin_site.register(ProvisioningJob, ProvisioningJobAdmin)
+admin_site.register(DeprovisioningSaga, DeprovisioningSagaAdmin)
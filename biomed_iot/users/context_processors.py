@@ -1,5 +1,19 @@
+from .models import ProvisioningStatus
+
+
 def default_title(request):
 	return {
 		'title': 'Biomed IoT',  # Default title for every page
 		'thin_navbar': False,
 	}
+
+
+def provisioning_status(request):
+	"""Adds the provisioning state of the user's resources while it is not done (see users.services.provisioning)."""
+	user = getattr(request, 'user', None)
+	if user is None or not user.is_authenticated:
+		return {}
+	state = ProvisioningStatus.objects.filter(user=user).values_list('state', flat=True).first()
+	if state is None or state == ProvisioningStatus.DONE:
+		return {}
+	return {'provisioning_state': state}
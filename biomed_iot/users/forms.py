@@ -1,4 +1,6 @@
 import re
+import csv
+import io
 from django import forms
 from datetime import datetime, timedelta
 from django.utils import timezone
@@ -47,6 +49,43 @@ class MqttClientForm(forms.Form):
     textname = forms.CharField(label='Device Name', max_length=30, required=True)
     same_topic = forms.BooleanField(label='in-out', required=False)
 
+
+class MqttClientCSVUploadForm(forms.Form):
+    """
+    CSV with one device per row: device name (max. 30 characters) and optionally 'inout' in a second column.
+    A header row starting with 'name' or 'textname' is skipped. cleaned_data['devices'] is a list of
+    (textname, inout) tuples.
+    """
+    MAX_ROWS = 1000
+
+    csv_file = forms.FileField(label='CSV File', required=True)
+
+    def clean_csv_file(self):
+        csv_file = self.cleaned_data['csv_file']
+        try:
+            content = csv_file.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError('The file must be UTF-8 encoded text.')
+
+        devices = []
+        for line_number, row in enumerate(csv.reader(io.StringIO(content)), start=1):
+            if not row or not row[0].strip():
+                continue
+            textname = row[0].strip()
+            if line_number == 1 and textname.lower() in ('name', 'textname'):
+                continue
+            if len(textname) > 30:
+                raise forms.ValidationError(f'Line {line_number}: device name longer than 30 characters.')
+            inout = len(row) > 1 and row[1].strip().lower() in ('inout', 'true', '1', 'yes')
+            devices.append((textname, inout))
+
+        if not devices:
+            raise forms.ValidationError('The file contains no devices.')
+        if len(devices) > self.MAX_ROWS:
+            raise forms.ValidationError(f'At most {self.MAX_ROWS} devices per upload.')
+        self.cleaned_data['devices'] = devices
+        return csv_file
+
 class SelectDataForm(forms.Form):
     measurement = forms.ChoiceField(label="Select Measurement", required=True)
     start_time = forms.DateTimeField(
@@ -71,6 +110,11 @@ class SelectDataForm(forms.Form):
         widget=forms.SelectMultiple,
         help_text="Select one or more (key=value).",
     )
+    wide = forms.BooleanField(
+        label="Wide format (download only)",
+        required=False,
+        help_text="One row per timestamp with a column for each field, instead of one row per field and timestamp.",
+    )
 
     def __init__(self, measurements_choices, *args, **kwargs):
         user = kwargs.pop("user")            # pass request.user into the form
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from users.services.orphan_audit import audit_orphans, cleanup_orphans, BACKENDS, DEFAULT_CLEANUP_PARALLEL
+
+
+class Command(BaseCommand):
+    help = (
+        'Lists the Node-RED containers and volumes, nginx location blocks, InfluxDB buckets and tokens, Grafana '
+        'orgs and users and Mosquitto clients and roles that belong to no Django user, and optionally removes them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', action='append', choices=BACKENDS,
+            help='Only audit this backend (can be given several times, default: all).',
+        )
+        parser.add_argument('--cleanup', action='store_true', help='Remove the orphans that were found.')
+        parser.add_argument(
+            '--parallel', type=int, default=DEFAULT_CLEANUP_PARALLEL,
+            help=f'Orphans removed at the same time (default: {DEFAULT_CLEANUP_PARALLEL}).',
+        )
+
+    def handle(self, *args, **options):
+        if options['parallel'] < 1:
+            raise CommandError('--parallel must be at least 1.')
+        report = audit_orphans(tuple(options['backend'] or BACKENDS))
+
+        for orphan in report.orphans:
+            details = ', '.join(f'{key}={value}' for key, value in orphan['details'].items())
+            line = f"{orphan['backend']:8} {orphan['kind']:12} {orphan['name']} ({orphan['id']})"
+            self.stdout.write(f'{line}  {details}' if details else line)
+        for kind, count in sorted(report.counts().items()):
+            self.stdout.write(f'{kind}: {count}')
+        for backend, error in report.errors.items():
+            self.stdout.write(self.style.ERROR(f'{backend}: inventory failed: {error}'))
+
+        if not report.orphans:
+            self.stdout.write(self.style.SUCCESS('No orphans found.'))
+        elif not options['cleanup']:
+            self.stdout.write(f'{len(report.orphans)} orphan(s) found, run with --cleanup to remove them.')
+        else:
+            failed = cleanup_orphans(report, parallel=options['parallel'])
+            for orphan, error in failed:
+                self.stdout.write(self.style.ERROR(f"Could not remove {orphan['kind']} {orphan['name']}: {error}"))
+            if failed:
+                raise CommandError(f'{len(failed)} of {len(report.orphans)} orphan(s) could not be removed.')
+            self.stdout.write(self.style.SUCCESS(f'{len(report.orphans)} orphan(s) removed.'))
+        if report.errors:
+            raise CommandError(f"Audit incomplete: {', '.join(report.errors)}")
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from users.services.user_import import (
+    read_user_csv,
+    ImportProgress,
+    UserImport,
+    DEFAULT_CONCURRENCY,
+    BULK_USERS_PER_BATCH,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the users of a CSV file (columns: username, email and optionally password, first_name, '
+        'last_name) and provisions their MQTT, InfluxDB and Grafana resources in bulk.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='CSV file with a header row.')
+        parser.add_argument(
+            '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+            help=f'Threads for password hashing, InfluxDB and Grafana requests (default: {DEFAULT_CONCURRENCY}).',
+        )
+        parser.add_argument(
+            '--users-per-batch', type=int, default=BULK_USERS_PER_BATCH,
+            help=f'Users whose MQTT resources are created per DSP round trip (default: {BULK_USERS_PER_BATCH}).',
+        )
+        parser.add_argument(
+            '--progress-file',
+            help='File that records finished steps so an interrupted import can be resumed '
+            '(default: <csv_file>.progress).',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['users_per_batch'] < 1:
+            raise CommandError('--concurrency and --users-per-batch must be at least 1.')
+        try:
+            rows = read_user_csv(options['csv_file'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Cannot read {options["csv_file"]}: {e}')
+
+        progress = ImportProgress(options['progress_file'] or f"{options['csv_file']}.progress")
+        report = UserImport(
+            rows, progress, concurrency=options['concurrency'], users_per_batch=options['users_per_batch']
+        ).run()
+
+        self.stdout.write(
+            f"{report['rows']} rows: {report['created']} created, {report['resumed']} resumed, "
+            f"{len(report['skipped'])} skipped (already existing)"
+        )
+        for stage, seconds in report['timings'].items():
+            self.stdout.write(f'  {stage}: {seconds:.2f}s')
+        self.stdout.write(f"Throughput: {report['users_per_second']} users/s")
+        if options['verbosity'] > 1:
+            for username in report['skipped']:
+                self.stdout.write(f'  skipped {username}')
+        for username, steps in report['failed'].items():
+            self.stdout.write(self.style.WARNING(f"  {username}: {', '.join(steps)} failed (queued for retry)"))
+        if report['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"{len(report['failed'])} user(s) not fully provisioned, the provisioning worker retries them. "
+                f'Running the import again with the same progress file resumes it as well.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{report['provisioned']} user(s) provisioned."))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from users.services.provisioning import claim_next_job, run_job, requeue_stale_jobs, worker_id
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued provisioning jobs (MQTT, InfluxDB and Grafana resources of new users).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run all due jobs, then exit.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0, help='Seconds to wait when no job is due (default: 2).'
+        )
+
+    def handle(self, *args, **options):
+        locked_by = worker_id()
+        self.stdout.write(f'Provisioning worker {locked_by} started')
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f'Requeued {requeued} stale job(s)')
+            job = claim_next_job(locked_by)
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+            success = run_job(job)
+            self.stdout.write(f"Job {job.pk} for {job.user}: {'done' if success else job.status}")
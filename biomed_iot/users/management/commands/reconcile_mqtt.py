@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from users.services.mosquitto_reconcile import reconcile_mqtt, APPLY_BATCH_SIZE
+from users.services.dynsec_snapshot import DynSecSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the MqttMetaData and MqttClient rows with the clients and roles of the Mosquitto Dynamic '
+        'Security Plugin and fixes missing, orphaned and mismatched entries at the broker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the differences.')
+        parser.add_argument(
+            '--keep-orphans', action='store_true', help='Do not delete broker clients and roles without a row.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=APPLY_BATCH_SIZE, help='Maximum number of DSP commands per payload.'
+        )
+        parser.add_argument(
+            '--from-file', nargs='?', const=DynSecSnapshot.DEFAULT_PATH, metavar='PATH',
+            help='Read the broker state from the configuration file of the plugin instead of asking the broker '
+                 f'(default {DynSecSnapshot.DEFAULT_PATH}). Implies --dry-run.',
+        )
+
+    def handle(self, *args, **options):
+        if options['from_file']:
+            options['dry_run'] = True
+        try:
+            diff, failed = reconcile_mqtt(
+                apply=not options['dry_run'],
+                delete_orphans=not options['keep_orphans'],
+                batch_size=options['batch_size'],
+                snapshot_path=options['from_file'],
+            )
+        except Exception as e:
+            raise CommandError(f'Reconcile failed: {e}')
+
+        for name, count in diff.counts().items():
+            self.stdout.write(f'{name}: {count}')
+        if options['verbosity'] > 1:
+            self._write_details(diff)
+
+        if diff.is_empty():
+            self.stdout.write(self.style.SUCCESS('Broker and database are in sync.'))
+        elif options['dry_run']:
+            self.stdout.write('Dry run, nothing changed.')
+        elif failed:
+            raise CommandError(f'{len(failed)} DSP command(s) failed, see the log for details.')
+        else:
+            self.stdout.write(self.style.SUCCESS('All differences fixed.'))
+
+    def _write_details(self, diff):
+        for rolename, _ in diff.missing_roles + diff.mismatched_roles:
+            self.stdout.write(f'  role {rolename}')
+        for rolename in diff.orphaned_roles:
+            self.stdout.write(f'  orphaned role {rolename}')
+        for mqtt_client in diff.missing_clients:
+            self.stdout.write(f'  missing client {mqtt_client.username} (user {mqtt_client.user_id})')
+        for mqtt_client, changes in diff.mismatched_clients:
+            self.stdout.write(f'  mismatched client {mqtt_client.username}: {", ".join(changes)}')
+        for username in diff.orphaned_clients:
+            self.stdout.write(f'  orphaned client {username}')
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_mqttmetadata_inout_role_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mqttmetadata',
+            name='device_role_created',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='mqttmetadata',
+            name='inout_role_created',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='mqttmetadata',
+            name='nodered_role_created',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_provisioning_job_and_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='provisioningstatus',
+            name='step_timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -1,24 +1,19 @@
-import secrets
-import random
-import string
 import logging
 from PIL import Image
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _  # for automatic translation in case if it is implemented later
 from django.conf import settings
+from django.utils import timezone
+from .services.identifier_allocator import (
+    generate_random_readable_string,
+    allocate_unique_identifier,
+    allocate_unique_identifiers,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def generate_random_readable_string(length, secure=True):
-    allowed_chars = ''.join(c for c in string.ascii_letters + string.digits if c not in "OIl01")
-    if secure:
-        return ''.join(secrets.choice(allowed_chars) for _ in range(length))
-    else:
-        return ''.join(random.choice(allowed_chars) for _ in range(length))
-
-
 class CustomUserManager(BaseUserManager):
 
     def create_user(self, username, email, password=None, **extra_fields):
@@ -98,16 +93,7 @@ class NodeRedUserData(models.Model):
 
     @staticmethod
     def generate_unique_container_name():
-        logger.debug('Generate unique container name function started')
-        max_attempts = 1000
-        for attempt in range(max_attempts):
-            logger.debug(f'Attempt {attempt+1} to generate unique container name')
-            new_name = generate_random_readable_string(length = 20, secure=True)
-            if not NodeRedUserData.objects.filter(container_name=new_name).exists():
-                logger.debug(f'Unique container name generated: {new_name}')
-                return new_name
-        logger.error('Failed to generate a unique container name after maximum attempts')
-        return None
+        return allocate_unique_identifier(NodeRedUserData, 'container_name', length=20)
 
     @staticmethod
     def generate_credentials():
@@ -122,22 +108,51 @@ class MqttMetaData(models.Model):
     nodered_role_name = models.CharField(max_length=20, unique=True)
     device_role_name = models.CharField(max_length=20, unique=True)
     inout_role_name = models.CharField(max_length=20, unique=True)
+    # Whether the role is known to exist at the broker (saves the createRole round trip per new client)
+    nodered_role_created = models.BooleanField(default=False)
+    device_role_created = models.BooleanField(default=False)
+    inout_role_created = models.BooleanField(default=False)
 
     def __str__(self):
         return self.user_topic_id
 
+    def role_created_field(self, rolename):
+        """
+        Returns the name of the *_role_created field of the given role name (None if it is not a role of this row).
+        """
+        for role_type in ('nodered', 'device', 'inout'):
+            if getattr(self, f'{role_type}_role_name') == rolename:
+                return f'{role_type}_role_created'
+        return None
+
+    def is_role_created(self, rolename):
+        field = self.role_created_field(rolename)
+        return bool(field and getattr(self, field))
+
+    @staticmethod
+    def _with_role_names(user_topic_id):
+        # The role names are derived from the topic id, so they are unique if the topic id is
+        return (
+            user_topic_id,
+            'nodered-' + user_topic_id,
+            'device-' + user_topic_id,
+            'inout-' + user_topic_id,
+        )
+
     @staticmethod
     def generate_unique_mqtt_metadata():
-        max_attempts = 1000
-        for attempt in range(max_attempts):
-            new_user_topic_id = generate_random_readable_string(length = 12, secure=True)
-            new_nodered_role_name = 'nodered-' + new_user_topic_id
-            new_device_role_name = 'device-' + new_user_topic_id
-            new_inout_role_name = 'inout-' + new_user_topic_id
-            if not MqttMetaData.objects.filter(user_topic_id=new_user_topic_id).exists():
-                return new_user_topic_id, new_nodered_role_name, new_device_role_name, new_inout_role_name
-        logger.error('Failed to generate unique MQTT metadata after maximum attempts')
-        return None, None, None, None
+        new_user_topic_id = allocate_unique_identifier(MqttMetaData, 'user_topic_id', length=12)
+        if new_user_topic_id is None:
+            return None, None, None, None
+        return MqttMetaData._with_role_names(new_user_topic_id)
+
+    @staticmethod
+    def generate_unique_mqtt_metadata_bulk(count):
+        """Like generate_unique_mqtt_metadata() for 'count' users (None if the topic ids could not be allocated)."""
+        user_topic_ids = allocate_unique_identifiers(MqttMetaData, 'user_topic_id', count=count, length=12)
+        if user_topic_ids is None:
+            return None
+        return [MqttMetaData._with_role_names(user_topic_id) for user_topic_id in user_topic_ids]
 
 
 class MqttClient(models.Model):
@@ -152,13 +167,12 @@ class MqttClient(models.Model):
 
     @staticmethod
     def generate_unique_username():
-        max_attempts = 1000
-        for attempt in range(max_attempts):
-            new_name = generate_random_readable_string(length = 20, secure=True)
-            if not MqttClient.objects.filter(username=new_name).exists():
-                return new_name
-        logger.error('Failed to generate unique MQTT client username after maximum attempts')
-        return None
+        return allocate_unique_identifier(MqttClient, 'username', length=20)
+
+    @staticmethod
+    def generate_unique_usernames(count):
+        """Like generate_unique_username() for 'count' usernames (None if they could not be allocated)."""
+        return allocate_unique_identifiers(MqttClient, 'username', count=count, length=20)
 
     @staticmethod
     def generate_password():
@@ -178,10 +192,79 @@ class InfluxUserData(models.Model):
 
     @staticmethod
     def generate_unique_bucket_name():
-        max_attempts = 1000
-        for attempt in range(max_attempts):
-            new_name = generate_random_readable_string(length = 20, secure=True)
-            if not InfluxUserData.objects.filter(bucket_name=new_name).exists():
-                return new_name
-        logger.error('Failed to generate unique bucket name after maximum attempts')
-        return None
+        return allocate_unique_identifier(InfluxUserData, 'bucket_name', length=20)
+
+
+class ProvisioningStatus(models.Model):
+    """Progress of the creation of a user's MQTT, InfluxDB and Grafana resources (shown to the user)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True)
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    mqtt_done = models.BooleanField(default=False)
+    influx_done = models.BooleanField(default=False)
+    grafana_done = models.BooleanField(default=False)
+    step_timings = models.JSONField(default=dict, blank=True)  # step name -> seconds of its last run
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user} ({self.state})'
+
+
+class ProvisioningJob(models.Model):
+    """Queue entry for the provisioning worker (manage.py provisioning_worker)."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATES, default=PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user} ({self.status}, attempt {self.attempts})'
+
+
+class DeprovisioningSaga(models.Model):
+    """
+    Teardown of a deleted user's MQTT, InfluxDB, Grafana and Node-RED resources with the state of each step.
+    The identifiers of the resources are copied to 'snapshot' before the user is deleted, so failed steps can
+    be retried afterwards. user_id is no foreign key for the same reason.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user_id = models.IntegerField(db_index=True)
+    username = models.CharField(max_length=150)
+    snapshot = models.JSONField(default=dict)
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING, db_index=True)
+    mqtt_done = models.BooleanField(default=False)
+    influx_done = models.BooleanField(default=False)
+    grafana_done = models.BooleanField(default=False)
+    nodered_done = models.BooleanField(default=False)
+    step_timings = models.JSONField(default=dict, blank=True)  # step name -> seconds of its last run
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.username} ({self.state})'
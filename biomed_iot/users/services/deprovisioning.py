@@ -0,0 +1,166 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections
+import users.models
+from .mosquitto_utils import delete_dynsec_clients_and_roles
+from .influx_utils import InfluxUserManager
+from .grafana_utils import GrafanaUserManager
+from .nodered_utils import NoderedContainer, del_nodered_nginx_conf
+from .provisioning import ProvisioningOrchestrator
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Users torn down at the same time by deprovision_users() (each of them runs its steps concurrently as well)
+DEPROVISION_MAX_PARALLEL_USERS = 4
+
+
+def snapshot_user_resources(user):
+    """Copies the identifiers of the user's backend resources, which the steps need after the user was deleted."""
+    metadata = users.models.MqttMetaData.objects.filter(user=user).first()
+    influx_user_data = users.models.InfluxUserData.objects.filter(user=user).first()
+    nodered_user_data = users.models.NodeRedUserData.objects.filter(user=user).first()
+    return {
+        'username': user.username,
+        'email': user.email,
+        'mqtt': {
+            'clients': list(users.models.MqttClient.objects.filter(user=user).values_list('username', flat=True)),
+            'roles': (
+                [metadata.nodered_role_name, metadata.device_role_name, metadata.inout_role_name] if metadata else []
+            ),
+        },
+        'influx': {
+            'bucket_id': influx_user_data.bucket_id,
+            'bucket_token_id': influx_user_data.bucket_token_id,
+        } if influx_user_data else None,
+        'nodered': {
+            'container_name': nodered_user_data.container_name,
+            'container_port': nodered_user_data.container_port,
+        } if nodered_user_data else None,
+    }
+
+
+def deprovision_mqtt(snapshot):
+    report = delete_dynsec_clients_and_roles(snapshot['mqtt']['clients'], snapshot['mqtt']['roles'])
+    return not report['failed_clients'] and not report['failed_roles']
+
+
+def deprovision_influx(snapshot):
+    if not snapshot['influx']:
+        return True
+    manager = InfluxUserManager(user=None)
+    return manager.delete_bucket_and_token(snapshot['influx']['bucket_id'], snapshot['influx']['bucket_token_id'])
+
+
+def deprovision_grafana(snapshot):
+    # Unsaved instance: the Grafana user and org are looked up by username
+    user = users.models.CustomUser(username=snapshot['username'], email=snapshot['email'])
+    return GrafanaUserManager(user).delete_user()
+
+
+def deprovision_nodered(snapshot):
+    if not snapshot['nodered']:
+        return True
+    nodered_user_data = users.models.NodeRedUserData(**snapshot['nodered'])
+    container = NoderedContainer(nodered_user_data)
+    container.delete_container()
+    if container.get_existing_container() is not None:
+        return False
+    # The volume can only be removed once the container is gone
+    volume_removed = container.delete_volume()
+    nginx_conf_removed = del_nodered_nginx_conf(nodered_user_data)
+    return volume_removed and nginx_conf_removed
+
+
+# (name, function, DeprovisioningSaga flag, names of the steps it depends on); the backends are independent
+DEPROVISIONING_STEPS = [
+    ('mqtt', deprovision_mqtt, 'mqtt_done', ()),
+    ('influx', deprovision_influx, 'influx_done', ()),
+    ('grafana', deprovision_grafana, 'grafana_done', ()),
+    ('nodered', deprovision_nodered, 'nodered_done', ()),
+]
+
+
+class DeprovisioningOrchestrator(ProvisioningOrchestrator):
+    """Runs the DEPROVISIONING_STEPS of a saga concurrently. The steps get the saga's snapshot."""
+
+    label = 'Deprovisioning'
+
+    def __init__(self, steps=None, max_workers=None):
+        steps = DEPROVISIONING_STEPS if steps is None else steps
+        # All steps are independent, so by default each gets its own thread
+        super().__init__(steps, max_workers=len(steps) if max_workers is None else max_workers)
+
+    def _thread_subject(self, saga):
+        return saga.snapshot
+
+
+def start_saga(user):
+    """
+    Returns the unfinished saga of the user with a fresh snapshot, or a new one.
+    Returns None if a completed saga exists, i.e. the resources are already gone.
+    """
+    Saga = users.models.DeprovisioningSaga
+    sagas = Saga.objects.filter(user_id=user.pk).order_by('-created_at')
+    if sagas.filter(state=Saga.DONE).exists():
+        return None
+    saga = sagas.first() or Saga(user_id=user.pk)
+    saga.username = user.username
+    saga.snapshot = snapshot_user_resources(user)
+    saga.save()
+    return saga
+
+
+def run_saga(saga):
+    """Runs the steps of the saga that are not done yet and records the result. Returns True if all are done."""
+    Saga = users.models.DeprovisioningSaga
+    saga.state = Saga.RUNNING
+    saga.attempts += 1
+    saga.save(update_fields=['state', 'attempts', 'updated_at'])
+    try:
+        DeprovisioningOrchestrator().run(saga, saga)
+    except Exception as e:
+        saga.state, saga.last_error = Saga.FAILED, str(e)
+        logger.error(f'Deprovisioning of {saga.username} (user id {saga.user_id}) failed: {e}')
+    else:
+        saga.state, saga.last_error = Saga.DONE, ''
+    saga.save(update_fields=['state', 'last_error', 'updated_at'])
+    return saga.state == Saga.DONE
+
+
+def deprovision_user(user):
+    """Tears down the backend resources of a user that is about to be deleted. Returns True on success."""
+    saga = start_saga(user)
+    return True if saga is None else run_saga(saga)
+
+
+def run_sagas(sagas, max_parallel=DEPROVISION_MAX_PARALLEL_USERS):
+    """Runs many sagas with at most 'max_parallel' at a time. Returns {saga id: success}."""
+
+    def run(saga):
+        try:
+            return run_saga(saga)
+        finally:
+            # The thread opened its own database connection, which Django only closes for request threads
+            connections.close_all()
+
+    sagas = list(sagas)
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='deprovisioning') as executor:
+        return dict(zip([saga.pk for saga in sagas], executor.map(run, sagas)))
+
+
+def deprovision_users(user_list, max_parallel=DEPROVISION_MAX_PARALLEL_USERS):
+    """
+    Tears down the backend resources of many users before they are deleted in bulk.
+    Returns {user id: success}; users with a completed saga count as successful.
+    """
+    results = {}
+    sagas = []
+    for user in user_list:
+        saga = start_saga(user)
+        if saga is None:
+            results[user.pk] = True
+        else:
+            sagas.append(saga)
+    saga_results = run_sagas(sagas, max_parallel=max_parallel)
+    results.update({saga.user_id: saga_results[saga.pk] for saga in sagas})
+    return results
@@ -0,0 +1,169 @@
+import os
+import json
+import threading
+from collections import namedtuple
+
+
+# Everything parsed from one version of the file. Replaced as a whole, never changed in place.
+SnapshotState = namedtuple('SnapshotState', [
+	'default_acl_access',
+	'anonymous_group',
+	'clients',  # username -> client (without password, salt and iterations)
+	'groups',  # groupname -> group
+	'roles',  # rolename -> role
+	'client_roles_index',  # username -> [rolename] (direct roles, by priority)
+	'role_clients_index',  # rolename -> [username] (direct roles)
+	'group_members_index',  # groupname -> [username]
+	'role_acls_index',  # rolename -> [acl]
+	'topic_roles_index',  # ACL topic pattern -> [rolename]
+])
+
+EMPTY_STATE = SnapshotState({}, None, {}, {}, {}, {}, {}, {}, {}, {})
+
+
+class DynSecSnapshot:
+	"""
+	Read-only, indexed view of the file the Mosquitto Dynamic Security Plugin persists its whole
+	configuration to (plugin_opt_config_file in the mosquitto config).
+
+	The file is parsed once and indexed by username (-> roles), rolename (-> ACLs) and ACL topic pattern
+	(-> roles), so audits and listings over many clients need no MQTT traffic. Every public method first
+	checks the modification time of the file and only parses it again if it changed.
+	Password hashes and salts are not kept. Each parse builds a new SnapshotState that replaces the old one
+	in a single assignment, so a query always works on one consistent version of the file.
+
+	Note: The file is written by the broker (by default with mode 700 for the mosquitto user),
+	so the reading process needs read access to it.
+
+	Example usage:
+	    snapshot = DynSecSnapshot()
+	    snapshot.client_roles('aB3dE5gH7jK9mN1pQ2rS')    # ['device-abc123def456']
+	    snapshot.roles_for_topic('in/abc123def456/#')    # ['nodered-abc123def456', 'device-abc123def456']
+	"""
+
+	DEFAULT_PATH = '/var/lib/mosquitto/dynamic-security.json'
+
+	def __init__(self, path=DEFAULT_PATH):
+		self.path = path
+		self._lock = threading.Lock()
+		self._mtime_ns = None
+		self.state = EMPTY_STATE
+
+	def reload(self, force=False):
+		"""
+		Parses the file again if its mtime changed since the last load (or if 'force' is set).
+
+		:return: True if the file was (re)parsed.
+		"""
+		mtime_ns = os.stat(self.path).st_mtime_ns
+		with self._lock:
+			if not force and mtime_ns == self._mtime_ns:
+				return False
+			with open(self.path, 'r') as f:
+				data = json.load(f)
+			self.state = self._build_state(data)
+			self._mtime_ns = mtime_ns
+			return True
+
+	def current(self):
+		"""
+		Returns the SnapshotState of the current file content (reloaded first if the file changed).
+		"""
+		self.reload()
+		return self.state
+
+	def _build_state(self, data):
+		clients, groups, roles = {}, {}, {}
+		client_roles_index, role_clients_index, group_members_index = {}, {}, {}
+		role_acls_index, topic_roles_index = {}, {}
+
+		for client in data.get('clients', []):
+			client = {key: value for key, value in client.items() if key not in ('password', 'salt', 'iterations')}
+			username = client['username']
+			clients[username] = client
+			client_roles_index[username] = self._rolenames(client.get('roles', []))
+			for rolename in client_roles_index[username]:
+				role_clients_index.setdefault(rolename, []).append(username)
+			for group in client.get('groups', []):
+				group_members_index.setdefault(group['groupname'], []).append(username)
+
+		for group in data.get('groups', []):
+			groups[group['groupname']] = group
+			group_members_index.setdefault(group['groupname'], [])
+
+		for role in data.get('roles', []):
+			rolename = role['rolename']
+			roles[rolename] = role
+			role_acls_index[rolename] = role.get('acls', [])
+			for acl in role.get('acls', []):
+				rolenames = topic_roles_index.setdefault(acl['topic'], [])
+				if rolename not in rolenames:
+					rolenames.append(rolename)
+
+		return SnapshotState(
+			default_acl_access=data.get('defaultACLAccess', {}),
+			anonymous_group=data.get('anonymousGroup'),
+			clients=clients,
+			groups=groups,
+			roles=roles,
+			client_roles_index=client_roles_index,
+			role_clients_index=role_clients_index,
+			group_members_index=group_members_index,
+			role_acls_index=role_acls_index,
+			topic_roles_index=topic_roles_index,
+		)
+
+	@staticmethod
+	def _rolenames(role_refs):
+		# Higher priority first, as the broker evaluates them
+		return [ref['rolename'] for ref in sorted(role_refs, key=lambda ref: -ref.get('priority', -1))]
+
+	"""
+    Query functions (each reloads the file first if it changed)
+    """
+
+	def get_client(self, username):
+		return self.current().clients.get(username)
+
+	def get_role(self, rolename):
+		return self.current().roles.get(rolename)
+
+	def get_group(self, groupname):
+		return self.current().groups.get(groupname)
+
+	def usernames(self):
+		return list(self.current().clients)
+
+	def rolenames(self):
+		return list(self.current().roles)
+
+	def client_roles(self, username, include_groups=True):
+		"""
+		Returns the rolenames of a client, including the roles it gets through its groups if 'include_groups' is set.
+		Unknown clients have no roles.
+		"""
+		state = self.current()
+		rolenames = list(state.client_roles_index.get(username, []))
+		if include_groups:
+			for group_ref in state.clients.get(username, {}).get('groups', []):
+				group = state.groups.get(group_ref['groupname'], {})
+				rolenames += [name for name in self._rolenames(group.get('roles', [])) if name not in rolenames]
+		return rolenames
+
+	def role_acls(self, rolename):
+		return self.current().role_acls_index.get(rolename, [])
+
+	def roles_for_topic(self, topic_pattern):
+		"""
+		Returns the rolenames with at least one ACL on exactly this topic pattern (e.g. 'in/abc123/#').
+		"""
+		return self.current().topic_roles_index.get(topic_pattern, [])
+
+	def clients_with_role(self, rolename):
+		"""
+		Returns the usernames that have the role directly (group roles are not resolved here).
+		"""
+		return self.current().role_clients_index.get(rolename, [])
+
+	def group_members(self, groupname):
+		return self.current().group_members_index.get(groupname, [])
@@ -1,38 +1,104 @@
-import json
 import requests
 import logging
+from urllib.parse import quote
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from biomed_iot.config_loader import config
 
 logger = logging.getLogger(__name__)
 
+# Grafana's default organization, which holds the admin account
+GRAFANA_MAIN_ORG_ID = 1
+# Seconds to wait for a Grafana API response
+GRAFANA_TIMEOUT_SECONDS = 30
+# Keep-alive connections kept open to Grafana (per process)
+GRAFANA_POOL_SIZE = 16
+
+
+class GrafanaClient:
+    """
+    Grafana HTTP API client with admin credentials over one keep-alive connection pool.
+
+    Calls that act inside an organization pass 'org_id', which is sent as X-Grafana-Org-Id header. The active
+    org of the admin account (/api/user/using/{id}) is never switched, so one client can be used by many
+    threads at the same time. The admin is a member of every org it creates, which the header requires.
+    """
+
+    def __init__(
+        self, host, port, username, password, timeout=GRAFANA_TIMEOUT_SECONDS, pool_size=GRAFANA_POOL_SIZE
+    ):
+        self.base_url = f'http://{host}:{port}'
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers.update({'content-type': 'application/json'})
+        # Requests are authenticated with basic auth only, a session cookie would be shared by all threads
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, org_id=None, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if org_id is not None:
+            headers['X-Grafana-Org-Id'] = str(org_id)
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, f'{self.base_url}{path}', headers=headers, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def find_id(self, path, **kwargs):
+        """Returns the 'id' of a lookup (e.g. /api/orgs/name/x), None for 404. Other errors raise RuntimeError."""
+        response = self.get(path, **kwargs)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RuntimeError(f"Grafana lookup {path} failed: {response.status_code} {response.text}")
+        return response.json().get('id')
+
+    def close(self):
+        self.session.close()
+
+
+# One client (and connection pool) per process, shared by all managers
+grafana_client = GrafanaClient(
+    config.grafana.GRAFANA_HOST,
+    config.grafana.GRAFANA_PORT,
+    config.grafana.GRAFANA_ADMIN_USERNAME,
+    config.grafana.GRAFANA_ADMIN_PASSWORD,
+)
+
 
 class GrafanaUserManager:
-    def __init__(self, user):
+    def __init__(self, user, client=None):
         self.username = user.username
         self.user_pword = user.password
         self.user_email = user.email
-        self.influx_token = user.influxuserdata.bucket_token
-        self.influx_bucket_name = user.influxuserdata.bucket_name
+        # Only needed for the datasources, deletions also work for users without InfluxDB resources
+        influx_user_data = getattr(user, 'influxuserdata', None)
+        self.influx_token = influx_user_data.bucket_token if influx_user_data else None
+        self.influx_bucket_name = influx_user_data.bucket_name if influx_user_data else None
         self.influx_org_name = config.influxdb.INFLUX_ORG_NAME
         self.influx_host = config.influxdb.INFLUX_HOST
         self.influx_port = config.influxdb.INFLUX_PORT
-        self.hostname = config.grafana.GRAFANA_HOST
-        self.port = config.grafana.GRAFANA_PORT
-        self.admin_username = config.grafana.GRAFANA_ADMIN_USERNAME
-        self.admin_password = config.grafana.GRAFANA_ADMIN_PASSWORD
         # All Grafana API calls are made with admin credentials.
-        self.grafana_origin = f"http://{self.admin_username}:{self.admin_password}@{self.hostname}:{self.port}"
+        self.client = client or grafana_client
 
     def _make_org(self):
-        payload = {"name": self.username}
-        url = f"{self.grafana_origin}/api/orgs"
-        headers = {'content-type': 'application/json'}
-        return requests.post(url, data=json.dumps(payload), headers=headers)
+        return self.client.post('/api/orgs', json={"name": self.username})
 
     def _get_org_id(self):
-        url = f"{self.grafana_origin}/api/orgs/name/{self.username}"
-        headers = {'content-type': 'application/json'}
-        r = requests.get(url, headers=headers)
+        r = self.client.get(f'/api/orgs/name/{quote(self.username, safe="")}')
         try:
             content = r.json()
             return content.get("id")
@@ -40,36 +106,22 @@ class GrafanaUserManager:
             logger.error(f"Error parsing organization ID: {e}")
         return None
 
-    def _switch_org(self, orgid):
-        url = f"{self.grafana_origin}/api/user/using/{orgid}"
-        headers = {'content-type': 'application/json'}
-        return requests.post(url, headers=headers)
-
-    def _switch_org_main(self):
-        # Switch to the default admin organization (org id 1)
-        url = f"{self.grafana_origin}/api/user/using/1"
-        headers = {'content-type': 'application/json'}
-        return requests.post(url, headers=headers)
-
-    def _make_user(self):
+    def _make_user(self, orgid):
+        # Created directly in the user's org (instead of the main org), so it needs no org switch or removal
         payload = {
             "name": self.username,
             "email": self.user_email,
             "login": self.username,
-            "password": self.user_pword
+            "password": self.user_pword,
+            "OrgId": orgid,
         }
-        headers = {'content-type': 'application/json'}
-        url = f"{self.grafana_origin}/api/admin/users"
-        return requests.post(url, data=json.dumps(payload), headers=headers)
-
-    def _add_user_to_org(self, orgid):
-        # Adds the custom user to their own organization.
-        payload = {"role": "Editor", "loginOrEmail": self.username}
-        url = f"{self.grafana_origin}/api/orgs/{orgid}/users"
-        headers = {'content-type': 'application/json'}
-        return requests.post(url, data=json.dumps(payload), headers=headers)
-
-    def _add_data_sources(self):
+        return self.client.post('/api/admin/users', json=payload)
+
+    def _set_user_role(self, orgid, userid):
+        # New users get the auto-assigned role (Viewer by default) in their org
+        return self.client.patch(f'/api/orgs/{orgid}/users/{userid}', json={"role": "Editor"})
+
+    def _add_data_sources(self, orgid):
         common_secure_json_data = {
             "httpHeaderValue1": f"Token {self.influx_token}",
             "token": self.influx_token
@@ -103,27 +155,12 @@ class GrafanaUserManager:
             "version": 1,
             "readOnly": False
         }
-        headers = {'content-type': 'application/json'}
-        url = f"{self.grafana_origin}/api/datasources"
-        response1 = requests.post(url, data=json.dumps(influxql_payload), headers=headers)
-        response2 = requests.post(url, data=json.dumps(flux_payload), headers=headers)
+        response1 = self.client.post('/api/datasources', org_id=orgid, json=influxql_payload)
+        response2 = self.client.post('/api/datasources', org_id=orgid, json=flux_payload)
         return response1, response2
 
-    def _switch_user_org(self, userid, orgid):
-        url = f"{self.grafana_origin}/api/users/{userid}/using/{orgid}"
-        headers = {'content-type': 'application/json'}
-        return requests.post(url, headers=headers)
-
-    def _remove_user_from_main_org(self, userid):
-        # Removes the custom user from the default organization (org id 1)
-        url = f"{self.grafana_origin}/api/orgs/1/users/{userid}"
-        headers = {'content-type': 'application/json'}
-        return requests.delete(url, headers=headers)
-
     def _get_user_id(self):
-        url = f"{self.grafana_origin}/api/users/lookup?loginOrEmail={self.username}"
-        headers = {'content-type': 'application/json'}
-        response = requests.get(url, headers=headers)
+        response = self.client.get('/api/users/lookup', params={'loginOrEmail': self.username})
         if response.status_code == 200:
             try:
                 content = response.json()
@@ -135,90 +172,66 @@ class GrafanaUserManager:
         return None
 
     def _del_user(self, userid):
-        headers = {'content-type': 'application/json'}
-        url = f"{self.grafana_origin}/api/admin/users/{userid}"
-        return requests.delete(url, headers=headers)
+        return self.client.delete(f'/api/admin/users/{userid}')
 
     def _del_org(self, orgid):
-        headers = {'content-type': 'application/json'}
-        url = f"{self.grafana_origin}/api/orgs/{orgid}"
-        return requests.delete(url, headers=headers)
+        return self.client.delete(f'/api/orgs/{orgid}')
 
     def create_user(self):
+        # Resources of an earlier, interrupted attempt (409/412: already exists) are reused, so it can be retried.
         # Create the custom organization for the user.
         org_resp = self._make_org()
-        if org_resp.status_code not in [200, 204]:
+        if org_resp.status_code not in [200, 204, 409]:
             logger.error(f"Failed to create org: {org_resp.status_code} {org_resp.text}")
             return False
 
-        orgid = self._get_org_id()
+        orgid = (org_resp.status_code != 409 and org_resp.json().get("orgId")) or self._get_org_id()
         if not orgid:
             logger.error("Organization ID not retrieved after org creation.")
             return False
 
-        # Switch to the newly created organization.
-        switch_resp = self._switch_org(orgid)
-        if switch_resp.status_code not in [200, 204]:
-            logger.error(f"Failed to switch to user org: {switch_resp.status_code} {switch_resp.text}")
-            return False
-
-        # Create the custom user account.
-        user_resp = self._make_user()
-        if user_resp.status_code not in [200, 204]:
+        # Create the custom user account as member of that organization.
+        user_resp = self._make_user(orgid)
+        if user_resp.status_code not in [200, 204, 409, 412]:
             logger.error(f"Failed to create user: {user_resp.status_code} {user_resp.text}")
             return False
 
-        # Add the user to their own organization.
-        add_resp = self._add_user_to_org(orgid)
-        if add_resp.status_code not in [200, 204]:
-            logger.error(f"Failed to add user to org: {add_resp.status_code} {add_resp.text}")
+        userid = (user_resp.status_code in [200, 204] and user_resp.json().get("id")) or self._get_user_id()
+        if not userid:
+            logger.error("User ID not retrieved after creation.")
             return False
 
-        # Add data sources for the user.
-        self._add_data_sources()
-
-        userid = self._get_user_id()
-        if userid:
-            # Switch the user's context to the custom organization.
-            self._switch_user_org(userid, orgid)
-            # Remove the custom user from the main org (org id 1).
-            self._remove_user_from_main_org(userid)
-            return True
-        else:
-            logger.error("User ID not retrieved after creation.")
+        role_resp = self._set_user_role(orgid, userid)
+        if role_resp.status_code not in [200, 204]:
+            logger.error(f"Failed to set the user's org role: {role_resp.status_code} {role_resp.text}")
             return False
 
-    def delete_user(self):
-        try:
-            userid = self._get_user_id()
-            if userid is None:
-                logger.error("Grafana delete_user: _get_user_id returned None")
+        # Add data sources for the user (in the user's org, selected by header).
+        for response in self._add_data_sources(orgid):
+            if response.status_code not in [200, 204, 409]:
+                logger.error(f"Failed to add data source: {response.status_code} {response.text}")
                 return False
+        return True
 
-            orgid = self._get_org_id()
-            if orgid is None:
-                logger.error("Grafana delete_user: _get_org_id returned None")
-                return False
+    def delete_user(self):
+        # A user or org that does not exist (anymore) counts as deleted, so a partial deletion can be repeated.
+        try:
+            userid = self.client.find_id('/api/users/lookup', params={'loginOrEmail': self.username})
+            orgid = self.client.find_id(f'/api/orgs/name/{quote(self.username, safe="")}')
 
             # Delete the custom user from Grafana.
-            r1 = self._del_user(userid)
-            if r1.status_code not in [200, 204]:
-                logger.error(f"Failed to delete Grafana user: status code {r1.status_code} {r1.text}")
-                return False
-
-            # IMPORTANT:
-            # The default admin user cannot be removed from an organization when using its own credentials.
-            # Therefore, before deleting the org, switch the active org to the main org (org id 1).
-            r_switch = self._switch_org_main()
-            if r_switch.status_code not in [200, 204]:
-                logger.error(f"Failed to switch to main org: status code {r_switch.status_code} {r_switch.text}")
-                return False
+            if userid is not None:
+                r1 = self._del_user(userid)
+                if r1.status_code not in [200, 204, 404]:
+                    logger.error(f"Failed to delete Grafana user: status code {r1.status_code} {r1.text}")
+                    return False
 
             # Now delete the user's custom organization.
-            r2 = self._del_org(orgid)
-            if r2.status_code not in [200, 204]:
-                logger.error(f"Failed to delete Grafana org: status code {r2.status_code} {r2.text}")
-                return False
+            if orgid is not None:
+                r2 = self._del_org(orgid)
+                if r2.status_code not in [200, 204, 404]:
+                    logger.error(f"Failed to delete Grafana org: status code {r2.status_code} {r2.text}")
+                    return False
 
             return True
         except Exception as e:
@@ -0,0 +1,79 @@
+import secrets
+import random
+import string
+import logging
+from django.db import IntegrityError, transaction
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for the values in one '__in' lookup (stays below the SQLite variable limit)
+IN_QUERY_CHUNK_SIZE = 500
+# Candidates checked per round when only a few identifiers are needed (e.g. a single one)
+MIN_CANDIDATES_PER_ROUND = 8
+
+
+def generate_random_readable_string(length, secure=True):
+    allowed_chars = ''.join(c for c in string.ascii_letters + string.digits if c not in "OIl01")
+    if secure:
+        return ''.join(secrets.choice(allowed_chars) for _ in range(length))
+    else:
+        return ''.join(random.choice(allowed_chars) for _ in range(length))
+
+
+def allocate_unique_identifiers(model, field, count=1, length=20, prefix='', max_rounds=10):
+    """
+    Returns 'count' random identifiers ('prefix' + 'length' readable characters) that are not yet used in
+    'field' of 'model', or None if that did not succeed within 'max_rounds' rounds.
+
+    Each round generates a batch of candidates (the missing ones, at least MIN_CANDIDATES_PER_ROUND) and checks
+    them with one '__in' query (per chunk of IN_QUERY_CHUNK_SIZE), instead of one exists() query per candidate,
+    so a collision rarely costs another round. The result is only free at the time of the check, so inserts
+    still rely on the unique constraint (see create_with_unique_retry()).
+    """
+    allocated = []
+    allocated_set = set()
+    for _ in range(max_rounds):
+        missing = count - len(allocated)
+        if missing <= 0:
+            break
+        batch_size = max(missing, MIN_CANDIDATES_PER_ROUND)
+        candidates = list({prefix + generate_random_readable_string(length) for _ in range(batch_size)} - allocated_set)
+        taken = set()
+        for start in range(0, len(candidates), IN_QUERY_CHUNK_SIZE):
+            chunk = candidates[start:start + IN_QUERY_CHUNK_SIZE]
+            taken.update(model.objects.filter(**{f'{field}__in': chunk}).values_list(field, flat=True))
+        for candidate in candidates:
+            if candidate not in taken and len(allocated) < count:
+                allocated.append(candidate)
+                allocated_set.add(candidate)
+    if len(allocated) < count:
+        logger.error(f'Failed to allocate {count} unique values for {model.__name__}.{field}')
+        return None
+    return allocated
+
+
+def allocate_unique_identifier(model, field, length=20, prefix='', max_rounds=10):
+    """
+    Single-value version of allocate_unique_identifiers() (also checks a batch of candidates per round).
+    Returns None if no free value was found.
+    """
+    identifiers = allocate_unique_identifiers(
+        model, field, count=1, length=length, prefix=prefix, max_rounds=max_rounds
+    )
+    return identifiers[0] if identifiers else None
+
+
+def create_with_unique_retry(create, attempts=3):
+    """
+    Calls create() (which allocates its identifiers and inserts the row) in a savepoint and calls it again
+    if the insert violated a unique constraint, e.g. because another process took the same identifier
+    between allocation and insert. Re-raises the IntegrityError of the last attempt.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return create()
+        except IntegrityError as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f'Unique constraint violated on insert, retrying with new identifiers: {e}')
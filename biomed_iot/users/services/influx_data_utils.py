@@ -5,14 +5,42 @@ High-level data operations (read / delete / export) for a single user bucket/mea
 from __future__ import annotations
 
 import csv
+import functools
+import hashlib
 import io
-import requests
+import logging
+import time
 from datetime import datetime
+from itertools import chain
+from operator import itemgetter
+from django.core.cache import cache
 from django.utils import timezone
 from typing import Iterator, Dict, Any, Tuple, List
 from influxdb_client import InfluxDBClient
 from influxdb_client.client.flux_table import FluxTable
 from biomed_iot.config_loader import config
+from .influx_pool import influx_pool, InfluxSession
+
+logger = logging.getLogger(__name__)
+
+# Seconds the measurement and tag listings of a bucket are cached, e.g. SCHEMA_CACHE_TTL_SECONDS = "60" in the
+# [influxdb] section. Data written by devices shows up in the listings after this time at the latest.
+_schema_cache_ttl = getattr(config.influxdb, 'SCHEMA_CACHE_TTL_SECONDS', None)
+SCHEMA_CACHE_TTL_SECONDS = int(_schema_cache_ttl) if _schema_cache_ttl else 60
+# CSV export: rows formatted per batch, bytes handed to the response per chunk
+EXPORT_BATCH_ROWS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def _schema_cached(method):
+    """
+    Cache a schema listing of InfluxDataManager (see InfluxDataManager._cached).
+    The uncached listing stays available as method.__wrapped__.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        return self._cached(method.__name__, functools.partial(method, self), *args)
+    return wrapper
 
 
 def to_rfc3339(value) -> str:
@@ -39,12 +67,29 @@ class InfluxDataManager:
 
     # ─────────────────────────── Private helpers ────────────────────────────
     def _client(self) -> InfluxDBClient:
-        return InfluxDBClient(
-            url=self.url,
-            token=self.token,
-            org=self.org_id,
-            timeout=300_000  # e.g. 5 minutes = 300_000 ms
-        )
+        # pooled per bucket token and shared across requests – never close it
+        return influx_pool.client(self.token)
+
+    def _session(self) -> InfluxSession:
+        return influx_pool.session(self.token)
+
+    # Schema cache: the list_* results are stored in the Django cache per
+    # bucket, under a generation that invalidate_schema_cache() replaces.
+    def _schema_generation(self) -> str:
+        return cache.get_or_set(f"influx-schema:{self.bucket}:generation", lambda: str(time.time_ns()), None)
+
+    def _cached(self, name: str, fetch, *args):
+        digest = hashlib.md5("\x00".join(args).encode("utf-8")).hexdigest()
+        key = f"influx-schema:{self.bucket}:{self._schema_generation()}:{name}:{digest}"
+        value = cache.get(key)
+        if value is None:
+            value = fetch(*args)
+            cache.set(key, value, SCHEMA_CACHE_TTL_SECONDS)
+        return value
+
+    def invalidate_schema_cache(self) -> None:
+        """Drop the cached listings of this bucket (the old entries expire unused)."""
+        cache.set(f"influx-schema:{self.bucket}:generation", str(time.time_ns()), None)
 
     # services/influx_data_utils.py  (replace the helper)
 
@@ -76,62 +121,111 @@ class InfluxDataManager:
 
         return flat_rows
 
-    def _row_generator(self, record_stream: Iterator[Any]) -> Iterator[bytes]:
+    @staticmethod
+    def _long_layout(first_record) -> List[Tuple[str, str]]:
+        """
+        Column layout of the long export, as (header label, record key) pairs:
+        time, field, value and the tag columns of the first record, sorted by name.
+        """
+        core = {"time": "_time", "field": "_field", "value": "_value"}
+        tags = [
+            key for key in first_record.values
+            if key not in ("result", "table") and not key.startswith("_")
+        ]
+        return [
+            (name if name in core else f"{name} (tag)", core.get(name, name))
+            for name in sorted(list(core) + tags)
+        ]
+
+    @staticmethod
+    def _wide_layout(tag_keys: List[str], field_keys: List[str]) -> List[Tuple[str, str]]:
+        """Column layout of the wide (pivoted) export: time, the tags, then one column per field."""
+        return (
+            [("time", "_time")]
+            + [(f"{key} (tag)", key) for key in sorted(tag_keys)]
+            + [(key, key) for key in sorted(field_keys)]
+        )
+
+    def _row_generator(
+        self,
+        record_stream: Iterator[Any],
+        columns: List[Tuple[str, str]] | None = None,
+    ) -> Iterator[bytes]:
         """
-        Take an iterator of FluxRecord, flatten each to a dict,
-        write CSV header on first row, then yield each row as UTF-8 bytes.
+        Take an iterator of FluxRecord and yield the CSV export as UTF-8 chunks
+        of about EXPORT_CHUNK_BYTES, starting with the Excel separator hint and
+        the header. Raises ValueError if there are no records at all.
+
+        Without 'columns' the layout comes from the first record (see
+        _long_layout). Columns a record lacks stay empty, columns it has in
+        addition are left out (with a warning per table if 'columns' is given).
+        Timestamps are converted to the current time zone once per second of
+        data (rows of the same second only get their microseconds appended).
         """
+        records = iter(record_stream)
+        first_record = next(records, None)
+        if first_record is None:
+            raise ValueError("No matching points")
+
+        check_columns = columns is not None
+        columns = columns or self._long_layout(first_record)
+        record_keys = [key for _, key in columns]
+        time_index = record_keys.index("_time")
+        # itemgetter with a single key returns the value itself, not a 1-tuple
+        pick = itemgetter(*record_keys) if len(record_keys) > 1 else (lambda values, key=record_keys[0]: (values[key],))
+
         buffer = io.StringIO()
-        csv_writer: csv.DictWriter | None = None
-        header_fields: list[str] | None = None
+        csv_writer = csv.writer(buffer)
+        # write Excel separator hint and the header row
+        buffer.write("sep=,\n")
+        csv_writer.writerow([label for label, _ in columns])
 
         # pick once outside the loop – respects TIME_ZONE or per-request activate()
         local_tz = timezone.get_current_timezone()
-
-        for record in record_stream:
-            # convert time from UTC → project/user zone
-            local_time = timezone.localtime(record.get_time(), local_tz)
-            # flatten a single FluxRecord to a simple dict
-            row: Dict[str, Any] = {
-                "time":      local_time.isoformat(),
-                "field":     record["_field"],
-                "value":     record["_value"],
-            }
-            for key, value in record.values.items():
-                if key in {"result", "table"} or key.startswith("_"):
-                    continue
-                row[key] = value
-
-            # initialize writer & header on first row
-            if header_fields is None:
-                header_fields = sorted(row.keys())
-                csv_writer = csv.DictWriter(buffer, fieldnames=header_fields)
-                # build a mapping of field → header label, adding " (tag)" for non-core fields
-                header_labels = {
-                    key: key if key in ("time", "field", "value")
-                         else f"{key} (tag)"
-                    for key in header_fields
-                }
-                # write Excel separator hint
-                buffer.write("sep=,\n")
-                # write custom header rows
-                csv_writer.writerow(header_labels)
-                yield buffer.getvalue().encode("utf-8")
-                buffer.seek(0)
-                buffer.truncate(0)
-
-            # write the current row and yield bytes
-            csv_writer.writerow(row)
-            yield buffer.getvalue().encode("utf-8")
-            buffer.seek(0)
-            buffer.truncate(0)
-
-        # no records at all?
-        if header_fields is None:
-            raise ValueError("No matching points")
+        second_key, second_prefix, second_suffix = None, "", ""
+        known_keys = set(record_keys) | {"result", "table"}
+        checked_table = None
+
+        rows: List[List[Any]] = []
+        for record in chain([first_record], records):
+            values = record.values
+            if check_columns and record.table != checked_table:
+                checked_table = record.table
+                missing_keys = {key for key in values.keys() - known_keys if not key.startswith("_")}
+                if missing_keys:
+                    logger.warning(f"CSV export of {self.bucket} leaves out the columns {sorted(missing_keys)}")
+            try:
+                row = list(pick(values))
+            except KeyError:
+                row = [values.get(key) for key in record_keys]
+
+            # convert time from UTC → project/user zone, formatted like isoformat()
+            utc_time = row[time_index]
+            key = int(utc_time.timestamp())
+            if key != second_key:
+                local = timezone.localtime(utc_time, local_tz).replace(microsecond=0).isoformat()
+                second_key, second_prefix, second_suffix = key, local[:19], local[19:]
+            microsecond = utc_time.microsecond
+            row[time_index] = (
+                f"{second_prefix}.{microsecond:06d}{second_suffix}" if microsecond
+                else second_prefix + second_suffix
+            )
+            rows.append(row)
+
+            if len(rows) == EXPORT_BATCH_ROWS:
+                csv_writer.writerows(rows)
+                rows.clear()
+                if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate(0)
+
+        csv_writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
 
 
     # ─────────────────────────── Public API ─────────────────────────────────
+    @_schema_cached
     def list_measurements(self) -> List[str]:
         """Return all distinct measurement names in this bucket."""
 
@@ -143,8 +237,7 @@ start: -inf
 )
 '''
 
-        with self._client() as client:
-            tables = client.query_api().query(flux_query)
+        tables = self._client().query_api().query(flux_query)
 
         measurements: List[str] = []
         for table in tables:
@@ -191,14 +284,9 @@ start: -inf
             "predicate": predicate,
         }
         endpoint = f"{self.url}/api/v2/delete?org={self.org_id}&bucket={self.bucket}"
-        response = requests.post(
-            endpoint,
-            headers={
-                "Authorization": f"Token {self.token}",
-                "Content-Type":  "application/json",
-            },
-            json=delete_payload,
-        )
+        response = self._session().post(endpoint, json=delete_payload)
+        # the deletion may have removed measurements or tag values – also after an error response
+        self.invalidate_schema_cache()
 
         return response.status_code == 204
 
@@ -208,9 +296,14 @@ start: -inf
         tags: Dict[str, str],
         start_iso: str,
         stop_iso: str,
+        wide: bool = False,
         ) -> Tuple[Iterator[bytes], str]:
         """
         Stream query results as CSV lines. Returns (csv_byte_iterator, filename).
+
+        The default (long) format has one row per field and timestamp. With
+        wide=True the fields are pivoted into columns, so each timestamp of a
+        series (tag combination) is one row: time, the tags, then the fields.
         """
         # build Flux filter predicate
         filter_clauses = [
@@ -225,15 +318,26 @@ from(bucket:"{self.bucket}")
   |> range(start:{start_iso}, stop:{stop_iso})
   |> filter(fn:(r) => {full_predicate})
 """
+        columns = None
+        if wide:
+            flux += """  |> pivot(rowKey:["_time"], columnKey:["_field"], valueColumn:"_value")
+  |> drop(columns:["_start", "_stop", "_measurement"])
+"""
+            # uncached: tags or fields written since the listings were cached would be left out of the export
+            columns = self._wide_layout(
+                InfluxDataManager.list_tag_keys.__wrapped__(self, measurement),
+                InfluxDataManager.list_field_keys.__wrapped__(self, measurement),
+            )
 
-        client = self._client()
-        record_stream = client.query_api().query_stream(flux)
+        record_stream = self._client().query_api().query_stream(flux)
 
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f"measurement_{measurement}_{timestamp}.csv"
+        suffix = "_wide" if wide else ""
+        filename = f"measurement_{measurement}{suffix}_{timestamp}.csv"
 
-        return self._row_generator(record_stream), filename
+        return self._row_generator(record_stream, columns), filename
 
+    @_schema_cached
     def list_tag_keys(self, measurement: str) -> list[str]:
         """
         Return all tag _keys_ for this measurement, across all time,
@@ -258,6 +362,7 @@ schema.tagKeys(
             if not row["_value"].startswith("_")
         ]
 
+    @_schema_cached
     def list_tag_values(self, measurement: str, tag_key: str) -> list[str]:
         """
         Return all tag _values_ for one tag key in this measurement, across all time.
@@ -279,12 +384,43 @@ schema.tagValues(
 
 
 
+    @_schema_cached
+    def list_field_keys(self, measurement: str) -> list[str]:
+        """
+        Return all field keys of this measurement, across all time.
+        """
+        flux = f'''
+import "influxdata/influxdb/schema"
+
+schema.fieldKeys(
+  bucket: "{self.bucket}",
+  predicate: (r) => r._measurement == "{measurement}",
+  start: 1970-01-01T00:00:00Z,
+  stop: now()
+)
+'''
+        tables = self._client().query_api().query(flux)
+        return [row["_value"] for table in tables for row in table]
+
+    @_schema_cached
     def list_tag_pairs(self, measurement: str) -> list[str]:
         """
-        Return all key=value strings for this measurement.
+        Return all key=value strings for this measurement, sorted by key and value.
+
+        One query instead of schema.tagKeys + one schema.tagValues per key:
+        last() keeps a single row per series, and every series row carries
+        all of its tag columns, so the distinct pairs are collected here.
         """
-        pairs: list[str] = []
-        for key in self.list_tag_keys(measurement):
-            for val in self.list_tag_values(measurement, key):
-                pairs.append(f"{key}={val}")
-        return pairs
+        flux = f'''
+from(bucket: "{self.bucket}")
+  |> range(start: 1970-01-01T00:00:00Z)
+  |> filter(fn: (r) => r._measurement == "{measurement}")
+  |> last()
+'''
+        pairs: set[tuple[str, str]] = set()
+        for record in self._client().query_api().query_stream(flux):
+            for key, value in record.values.items():
+                if key in {"result", "table"} or key.startswith("_") or value is None:
+                    continue
+                pairs.add((key, value))
+        return [f"{key}={value}" for key, value in sorted(pairs)]
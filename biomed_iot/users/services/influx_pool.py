@@ -0,0 +1,106 @@
+import atexit
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from influxdb_client import InfluxDBClient
+from biomed_iot.config_loader import config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tokens (users) whose client and session are kept open per process, the least recently used one is closed first
+INFLUX_POOL_MAX_TOKENS = 32
+# Keep-alive connections per token (client and session each)
+INFLUX_POOL_CONNECTIONS = 8
+# Timeouts in milliseconds: connecting, and waiting for data (long for the streamed CSV exports)
+INFLUX_CONNECT_TIMEOUT_MS = 5_000
+INFLUX_READ_TIMEOUT_MS = 300_000
+
+
+class InfluxSession(requests.Session):
+    """requests.Session for the InfluxDB HTTP API that sends the token and has a default timeout."""
+
+    def __init__(self, url, token, pool_size=INFLUX_POOL_CONNECTIONS):
+        super().__init__()
+        self.url = url
+        self.headers.update({'Authorization': f'Token {token}'})
+        self.timeout = (INFLUX_CONNECT_TIMEOUT_MS / 1000, INFLUX_READ_TIMEOUT_MS / 1000)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class InfluxClientPool:
+    """
+    InfluxDBClient and InfluxSession per token, shared by all threads of the process.
+
+    Both keep their connections open between calls. At most 'max_tokens' tokens are kept; when another one is
+    needed the least recently used client and session are closed. Requests that are still running on them (e.g. a
+    streamed export) finish normally, their connections are just not reused afterwards.
+    """
+
+    def __init__(self, url, org_id, max_tokens=INFLUX_POOL_MAX_TOKENS, pool_size=INFLUX_POOL_CONNECTIONS):
+        self.url = url
+        self.org_id = org_id
+        self.max_tokens = max_tokens
+        self.pool_size = pool_size
+        self._entries = OrderedDict()  # token -> (client, session)
+        self._lock = threading.Lock()
+
+    def _entry(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                self._entries.move_to_end(token)
+                return entry
+            entry = (
+                InfluxDBClient(
+                    url=self.url,
+                    token=token,
+                    org=self.org_id,
+                    timeout=(INFLUX_CONNECT_TIMEOUT_MS, INFLUX_READ_TIMEOUT_MS),
+                    connection_pool_maxsize=self.pool_size,
+                ),
+                InfluxSession(self.url, token, pool_size=self.pool_size),
+            )
+            self._entries[token] = entry
+            evicted = []
+            while len(self._entries) > self.max_tokens:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for client, session in evicted:
+            self._close(client, session)
+        return entry
+
+    def client(self, token) -> InfluxDBClient:
+        """Returns the pooled InfluxDBClient for the token. Do not close it (or use it in a 'with' block)."""
+        return self._entry(token)[0]
+
+    def session(self, token) -> InfluxSession:
+        """Returns the pooled InfluxSession for the token, for the endpoints the client library does not cover."""
+        return self._entry(token)[1]
+
+    @staticmethod
+    def _close(client, session):
+        try:
+            client.close()
+            session.close()
+        except Exception as e:
+            logger.warning(f'Closing a pooled InfluxDB client failed: {e}')
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for client, session in entries:
+            self._close(client, session)
+
+
+influx_pool = InfluxClientPool(
+    f'http://{config.influxdb.INFLUX_HOST}:{config.influxdb.INFLUX_PORT}', config.influxdb.INFLUX_ORG_ID
+)
+atexit.register(influx_pool.close_all)
@@ -1,10 +1,10 @@
 import json
-import requests  # For HTTP requests to the v1 compatibility endpoint
 import logging
 import users.models as user_models
 from biomed_iot.config_loader import config
 from influxdb_client import InfluxDBClient, Point
 from influxdb_client.client.write_api import SYNCHRONOUS
+from .influx_pool import influx_pool
 
 
 logger = logging.getLogger(__name__)
@@ -21,12 +21,14 @@ class InfluxUserManager:
         user: Django user instance associated with InfluxDB resources.
     """
 
-    def __init__(self, user):
+    def __init__(self, user, client=None, session=None):
         """
         Initializes InfluxUserManager with user and InfluxDB configuration.
 
         Parameters:
             user: The Django user instance.
+            client: Optional InfluxDBClient with the all-access token (default: the pooled one).
+            session: Optional requests.Session for the authorization endpoint (default: the pooled one).
         """
         self.user = user
         self.org_id = config.influxdb.INFLUX_ORG_ID
@@ -34,7 +36,8 @@ class InfluxUserManager:
         self.port = config.influxdb.INFLUX_PORT
         self.url = f'http://{self.host}:{self.port}'
         self.auth_url = f'{self.url}/api/v2/authorizations'
-        self.client = InfluxDBClient(url=self.url, token=INFLUX_ALL_ACCESS_TOKEN, org=self.org_id)
+        self.client = client or influx_pool.client(INFLUX_ALL_ACCESS_TOKEN)
+        self.http = session or influx_pool.session(INFLUX_ALL_ACCESS_TOKEN)
 
     def _create_bucket(self):
         """
@@ -73,7 +76,7 @@ class InfluxUserManager:
             ],
         }
 
-        response = requests.post(self.auth_url, headers=headers, data=json.dumps(payload))
+        response = self.http.post(self.auth_url, headers=headers, data=json.dumps(payload))
         if response.status_code in [200, 201]:
             response_json = response.json()
             return (response_json.get('token'), response_json.get('id'))
@@ -81,9 +84,10 @@ class InfluxUserManager:
             raise Exception(f'Failed to create token: {response.text}')
 
     def _write_initial_test_data(self, bucket_name, bucket_token):
-        write_client = InfluxDBClient(url=self.url, token=bucket_token, org=self.org_id).write_api(write_options=SYNCHRONOUS)  # noqa
-        point = Point('UltimateQuestion').tag('Computer', 'DeepThought').field('Answer', 42)  # Just a sample
-        write_client.write(bucket=bucket_name, org=self.org_id, record=point)
+        with InfluxDBClient(url=self.url, token=bucket_token, org=self.org_id) as bucket_client:
+            write_client = bucket_client.write_api(write_options=SYNCHRONOUS)
+            point = Point('UltimateQuestion').tag('Computer', 'DeepThought').field('Answer', 42)  # Just a sample
+            write_client.write(bucket=bucket_name, org=self.org_id, record=point)
 
 
     def create_new_influx_user_resources(self) -> bool:
@@ -116,32 +120,23 @@ class InfluxUserManager:
         logger.info(f"create_new_influx_user_resources returns '{success}'")
         return success
 
-    def delete_influx_user_resources(self) -> bool:
+    def delete_bucket_and_token(self, bucket_id, bucket_token_id) -> bool:
         """
-        Deletes the InfluxDB resources (bucket and token) associated with the user.
+        Deletes a bucket and its token in InfluxDB. A bucket or token that does not exist (anymore)
+        counts as deleted, so the call can be repeated after a partial failure.
 
         Returns:
-            True if all resources were successfully deleted; False otherwise.
+            True if both are gone afterwards; False otherwise.
         """
         token_deleted = False
         bucket_deleted = False
-        model_instance_deleted = False
-
-        try:
-            # get bucket_id and bucket_token_id from self.user's user_models.InfluxUserData
-            influx_user_data = user_models.InfluxUserData.objects.get(user=self.user)
-            bucket_id = influx_user_data.bucket_id
-            bucket_token_id = influx_user_data.bucket_token_id
-        except user_models.InfluxUserData.DoesNotExist:
-            print('Influx user data not found.')
-            return False  # No resources to delete if the user data is not found.
 
         # Delete the Token in InfluxDB
         delete_token_url = f'{self.auth_url}/{bucket_token_id}'
-        delete_token_response = requests.delete(
+        delete_token_response = self.http.delete(
             delete_token_url, headers={'Authorization': f'Token {INFLUX_ALL_ACCESS_TOKEN}'}
         )
-        if delete_token_response.status_code in [204, 200]:
+        if delete_token_response.status_code in [204, 200, 404]:
             print(f"Bucket-token with ID '{bucket_token_id}' deleted.")
             token_deleted = True
         else:
@@ -154,14 +149,36 @@ class InfluxUserManager:
             print(f"Bucket with ID '{bucket_id}' deleted.")
             bucket_deleted = True
         except Exception as e:
-            if e.status == 404:  # Bucket not found
+            if getattr(e, 'status', None) == 404:  # Bucket not found
                 print("Bucket already deleted or not found.")
                 bucket_deleted = True
             else:
                 print(f"Failed to delete bucket: {e}")
                 bucket_deleted = False
 
-        if bucket_deleted:
+        return token_deleted and bucket_deleted
+
+    def delete_influx_user_resources(self) -> bool:
+        """
+        Deletes the InfluxDB resources (bucket and token) associated with the user.
+
+        Returns:
+            True if all resources were successfully deleted; False otherwise.
+        """
+        model_instance_deleted = False
+
+        try:
+            # get bucket_id and bucket_token_id from self.user's user_models.InfluxUserData
+            influx_user_data = user_models.InfluxUserData.objects.get(user=self.user)
+            bucket_id = influx_user_data.bucket_id
+            bucket_token_id = influx_user_data.bucket_token_id
+        except user_models.InfluxUserData.DoesNotExist:
+            print('Influx user data not found.')
+            return False  # No resources to delete if the user data is not found.
+
+        resources_deleted = self.delete_bucket_and_token(bucket_id, bucket_token_id)
+
+        if resources_deleted:
             try:
                 # Delete the user_models.InfluxUserData model instance
                 influx_user_data.delete()
@@ -169,4 +186,4 @@ class InfluxUserManager:
             except Exception as e:
                 print(f'Exception occurred while deleting user_models.InfluxUserData model instance: {e}')
 
-        return all([token_deleted, bucket_deleted, model_instance_deleted])
+        return resources_deleted and model_instance_deleted
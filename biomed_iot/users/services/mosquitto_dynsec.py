@@ -1,169 +1,38 @@
+import os
+import time
+import asyncio
+import weakref
+import copy
+import uuid
 import threading
 import json
+from contextlib import contextmanager, asynccontextmanager
 import paho.mqtt.client as mqtt
 from paho.mqtt.client import MQTT_ERR_SUCCESS
 
 
-class MosquittoDynSec:
+class DynSecCommands:
 	"""
-	Based on commands at https://github.com/eclipse/mosquitto/blob/master/plugins/dynamic-security/README.md
-	About Mosquitto Dynamic Security Plugin (DSP): https://mosquitto.org/documentation/dynamic-security/
-
-	A Python wrapper for interacting with the Mosquitto MQTT broker's Dynamic Security Plugin (DSP).
-	This class abstracts the MQTT communication and command sending to the Dynamic Security Plugin,
-	facilitating the management of ACLs, clients, groups, and roles within the broker.
-
-	The class provides setter and getter functions for various configurations supported by the
-	Dynamic Security Plugin. Setter functions are used to configure or modify settings, while
-	getter functions are used to retrieve current configurations from the broker.
-
-	SETTER functions return a tuple of (success, response, send_code), where 'success' is a boolean indicating
-	the operation's success, 'response' is a dictionary containing the broker's response and send_code is the code
-	returned by the paho-mqtt package.
-
-	GETTER functions similarly return a tuple of (success, response, send_code) where 'response' in this case
-	contains the requested configuration data.
-
-	Example usage:
-	    mosquitto_dyn_sec = MosquittoDynSec(dynsec_user, dynsec_user_password)
-	    success, response, send_code = mosquitto_dyn_sec.set_default_acl_access(False, True, False, True)
+	Builders for the commands of the Mosquitto Dynamic Security Plugin (DSP).
 
-	Attributes:
-	    username (str): Admin Username used to control with the Mosquitto Dynamic Security Plugin.
-	    password (str): Password used for above user.
-	    host (str): Hostname or IP address of the MQTT broker.
-	    port (int): Network port of the MQTT broker.
+	Each method builds one command and passes it to '_execute_command', which is implemented by the
+	subclasses: MosquittoDynSec sends it and waits for the reply, AsyncMosquittoDynSec returns a coroutine
+	doing the same on the asyncio event loop and DynSecBatch collects it for a multi-command payload.
+	The return values of the SETTER and GETTER functions are described in MosquittoDynSec.
 	"""
 
-	def __init__(self, username, password, host="localhost", port=1884):
-		"""
-		Initializes a new instance of the MosquittoDynSec class.
-
-		Establishes an MQTT client with the specified credentials and connects to the MQTT broker.
-		Sets up necessary MQTT topics for sending commands to and receiving responses from the
-		Dynamic Security Plugin. Starts the MQTT client loop to listen for responses.
-
-		Parameters:
-		    username (str): The username of the client that writes to the '$CONTROL/dynamic-security/v1' topic.
-		    password (str): The password of the client that writes to the '$CONTROL/dynamic-security/v1' topic.
-		    host (str): The hostname or IP address of the MQTT broker.
-		    port (int): The network port of the MQTT server.
-		"""
-		self.username = username
-		self.password = password
-		self.host = host
-		self.port = port
-
-		# MQTT topics
-		self.send_command_topic = '$CONTROL/dynamic-security/v1'
-		self.response_topic = '$CONTROL/dynamic-security/v1/response'
-		self.response_msg = None
-
-		# Create MQTT client instance
-		# Changes since paho-mqtt 2.0: https://eclipse.dev/paho/files/paho.mqtt.python/html/migrations.html
-		# TODO: Change callbacks to new paho-mqtt 2.0 standard.
-		# Old callback structure still supported for CallbackAPIVersion.VERSION1
-		self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-
-		# Set username and password
-		self.client.username_pw_set(self.username, self.password)
-		self.client.reconnect_delay_set(min_delay=1, max_delay=2)
-
-		# Events and timeouts
-		self.subscription_event = threading.Event()
-		self.message_received_event = threading.Event()
-		self.sub_event_timeout_seconds = 5
-		self.msg_received_timeout_seconds = 10
-
-		# Assign callback functions
-		self.client.on_connect = self.on_connect
-		self.client.on_subscribe = self.on_subscribe
-		self.client.on_message = self.on_message
-		self.client.on_publish = self.on_publish
-
-		# Connect and start MQTT client
-		self.client.connect(self.host, self.port, 60)
-		self.client.loop_start()
-
-	def disconnect(self):
-		self.client.loop_stop()
-		self.client.disconnect()
-		# print("Disconnected MQTT client.")
-
-	"""
-    Internal-use functions and callbacks (only used by the class itself)
-    """
-
-	def on_publish(self, client, userdata, mid):
-		# print(f"Message published with message-id {mid}")
-		pass
-
-	def on_message(self, client, userdata, msg):
-		# print(f"Topic: `{msg.topic}`\nPayload: `{json.loads(msg.payload.decode('utf-8'))}`")
-		self.response_msg = json.loads(msg.payload.decode('utf-8'))
-		# print(f"on_message: self.response_msg = {self.response_msg}")
-		self.message_received_event.set()  # must be last line to make sure, the message is stored in self.response_msg
-
-	def on_connect(self, client, userdata, flags, rc):
-		self.client.subscribe(self.response_topic, qos=2)
-		if rc == 0:
-			# print("Connected with result code " + str(rc))
-			pass
-		else:
-			# print(f"Failed to connect, return code: {rc}\n")
-			pass
-
-	def on_subscribe(self, client, userdata, mid, granted_qos):
-		# print("Subscribed to topic")
-		# Signal successful subscription
-		self.subscription_event.set()
-
-	def _send_command(self, command):
-		# print("_send_command called")
-		# Construct and send a command to the control topic
-		payload = json.dumps(command)
-		# Wait for the subscription to be successful
-		self.subscription_event.wait(self.sub_event_timeout_seconds)
-		# print("Now publishing after successful subscription")
-		send_code = self.client.publish(self.send_command_topic, payload, qos=2)
-		# print(f'in _send_command: published". send_code = {send_code}')
-
-		return send_code
-
-	def _get_response(self):
-		response = self.response_msg
-		# warte bis response message gekommen
-		event_set = self.message_received_event.wait(self.msg_received_timeout_seconds)
-		if event_set:
-			response = self.response_msg
-			# print(f"Message received: self.response_msg = {self.response_msg}")
-			# After processing the message, clear the event and reset self.reply_message
-			self.message_received_event.clear()
-			self.response_msg = None  # reset the variable for next request to the Dynamic Security Plugin
-		else:
-			# print(f"No message received: self.response_msg = {self.response_msg}")
-			self.response_msg = None
-			response = self.response_msg
-
-		return response
+	def _execute_command(self, command):
+		raise NotImplementedError
 
-	def _is_response_successful(self, command, response, send_code):
-		# print(f"In '_is_response_successful'. command: {command}, response: {response}")
+	def _is_entry_successful(self, command_name, response_entry):
 		# Response codes for Mosquitto on GitHub:
 		# https://github.com/search?q=repo%3Aeclipse%2Fmosquitto++%7B%27responses%27&type=code
 		successful = False
-		if response is not None and send_code.rc == MQTT_ERR_SUCCESS:
-			# Get command name of the command sent and command in response
-			command_name = command['commands'][0]['command']  # only one command is expected per function call
-			response_command_name = response['responses'][0]['command']
-
-			if command_name == response_command_name:  # Check if the expected command is present in the response
-				successful = True
-			if 'error' in response['responses'][0]:
-				# print(f"In 'error' in response['responses'][0]'. Response: {response['responses'][0]}")
+		if response_entry is not None and response_entry.get('command') == command_name:
+			successful = True
+			if 'error' in response_entry:
 				successful = False
-				if 'already' in response['responses'][0]['error']:
-					# print('"already" in response["responses"][0]["error"]')
+				if 'already' in response_entry['error']:
 					# caveat: prone to minterpretation if response messages change in the future
 					# Known responses containing 'already' on April 16., 2024:
 					# 'Role already exists'
@@ -175,20 +44,6 @@ class MosquittoDynSec:
 
 		return successful
 
-	def _execute_command(self, command):
-		# print(f"In '_execute_command'. command: {command}")
-		send_code = self._send_command(command)  # send_code for debugging
-		# print(f"In '_execute_command'. send_code: {send_code}")
-		response = self._get_response()
-		# print(f"In '_execute_command'. response: {response}")
-		success = self._is_response_successful(command, response, send_code)
-		# print(f"In '_execute_command'. success: {success}")
-		return success, response, send_code
-
-	"""
-    External-use getter- and setter-functions (use these to interact with the Mosquitto Dynamic Security Plugin)
-    """
-
 	def set_default_acl_access(
 		self,
 		publish_client_send_allow,
@@ -885,3 +740,1128 @@ class MosquittoDynSec:
 		}
 
 		return self._execute_command(command)
+
+
+class DynSecUnavailable(ConnectionError):
+	"""
+	Raised instead of contacting the broker while the circuit breaker is open, or if no session could be set up.
+	"""
+
+
+class DynSecCircuitBreaker:
+	"""
+	Health state of the broker shared by the connection managers of a process.
+
+	After 'failure_threshold' consecutive failures (no connection, no subscription or no reply at all to a
+	payload) the breaker opens: allow() returns False and callers fail fast with DynSecUnavailable instead of
+	waiting for the subscription and reply timeouts. After 'cooldown_seconds' the breaker becomes half-open
+	and runs 'probe' once in a background thread; it closes if the probe returns True and opens again otherwise.
+	Without a probe, the first request after the cool-down is let through as the probe.
+	"""
+
+	CLOSED = 'closed'
+	OPEN = 'open'
+	HALF_OPEN = 'half_open'
+
+	def __init__(self, failure_threshold=3, cooldown_seconds=30, probe=None):
+		self.failure_threshold = failure_threshold
+		self.cooldown_seconds = cooldown_seconds
+		self.probe = probe
+		self._lock = threading.Lock()
+		self._state = self.CLOSED
+		self._failures = 0
+		self._opened_at = None
+
+	@property
+	def state(self):
+		with self._lock:
+			return self._state
+
+	def allow(self):
+		"""
+		Returns True if a request may be sent to the broker now.
+		"""
+		with self._lock:
+			if self._state == self.CLOSED:
+				return True
+			if self._state == self.HALF_OPEN or time.monotonic() - self._opened_at < self.cooldown_seconds:
+				return False
+			self._state = self.HALF_OPEN
+			if self.probe is None:
+				return True  # this request is the probe
+		threading.Thread(target=self._run_probe, name='dynsec-breaker-probe', daemon=True).start()
+		return False
+
+	def _run_probe(self):
+		try:
+			healthy = self.probe()
+		except Exception:
+			healthy = False
+		if healthy:
+			self.record_success()
+		else:
+			self.record_failure()
+
+	def record_success(self):
+		with self._lock:
+			self._state = self.CLOSED
+			self._failures = 0
+			self._opened_at = None
+
+	def record_failure(self):
+		with self._lock:
+			self._failures += 1
+			if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+				self._state = self.OPEN
+				self._opened_at = time.monotonic()
+
+	def snapshot(self):
+		with self._lock:
+			return {'state': self._state, 'consecutive_failures': self._failures}
+
+
+class DynSecStats:
+	"""
+	Per-command-type counters and round-trip latency histograms of the DSP commands sent by a client.
+
+	Every command entry is counted once as 'ok', 'error', 'already_exists' (error replies containing 'already')
+	or 'timeout' (no reply within msg_received_timeout_seconds). 'send_failed' counts entries whose payload
+	could not be published. Round-trip times of the received replies go into cumulative buckets (seconds).
+	"""
+
+	LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._commands = {}
+
+	def _entry(self, command_name):
+		entry = self._commands.get(command_name)
+		if entry is None:
+			entry = {
+				'count': 0, 'ok': 0, 'error': 0, 'already_exists': 0, 'timeout': 0, 'send_failed': 0,
+				'latency_sum_seconds': 0.0, 'latency_max_seconds': 0.0,
+				'latency_buckets': [0] * (len(self.LATENCY_BUCKETS) + 1),  # last one is +Inf
+			}
+			self._commands[command_name] = entry
+		return entry
+
+	def record(self, command_name, response_entry, latency_seconds):
+		with self._lock:
+			entry = self._entry(command_name)
+			entry['count'] += 1
+			if response_entry is None:
+				entry['timeout'] += 1
+				return
+			error = response_entry.get('error')
+			if error is None:
+				entry['ok'] += 1
+			elif 'already' in error:
+				entry['already_exists'] += 1
+			else:
+				entry['error'] += 1
+			entry['latency_sum_seconds'] += latency_seconds
+			entry['latency_max_seconds'] = max(entry['latency_max_seconds'], latency_seconds)
+			for index, bound in enumerate(self.LATENCY_BUCKETS):
+				if latency_seconds <= bound:
+					entry['latency_buckets'][index] += 1
+					break
+			else:
+				entry['latency_buckets'][-1] += 1
+
+	def record_send_failed(self, command_name):
+		with self._lock:
+			entry = self._entry(command_name)
+			entry['count'] += 1
+			entry['send_failed'] += 1
+
+	def snapshot(self):
+		"""
+		Returns {command_name: counters} with the histogram as {'le': [bounds..., 'inf'], 'counts': [...]}.
+		"""
+		with self._lock:
+			snapshot = {}
+			for command_name, entry in self._commands.items():
+				snapshot[command_name] = dict(entry)
+				snapshot[command_name]['latency_buckets'] = {
+					'le': list(self.LATENCY_BUCKETS) + ['inf'],
+					'counts': list(entry['latency_buckets']),
+				}
+			return snapshot
+
+	def reset(self):
+		with self._lock:
+			self._commands = {}
+
+
+class DynSecStateCache:
+	"""
+	Optional in-memory mirror of the clients, roles and groups of the Dynamic Security Plugin.
+
+	It is filled by one verbose listClients/listRoles/listGroups sweep and kept up to date by the successful
+	setter commands sent through the MosquittoDynSec instance it is attached to (write-through). Changes made
+	by other processes are only picked up by the next sweep, which is due after 'max_age_seconds'.
+	Commands whose effect cannot be mirrored exactly drop the affected entries, so the next read of those
+	entries goes to the broker again (read-through).
+	"""
+
+	KINDS = {'clients': 'username', 'roles': 'rolename', 'groups': 'groupname'}
+
+	def __init__(self, max_age_seconds=60):
+		self.max_age_seconds = max_age_seconds
+		self._lock = threading.Lock()
+		self._entries = {kind: {} for kind in self.KINDS}
+		self._loaded_at = None
+
+	def is_fresh(self):
+		with self._lock:
+			return self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.max_age_seconds
+
+	def invalidate(self):
+		with self._lock:
+			self._loaded_at = None
+
+	def load(self, clients, roles, groups):
+		with self._lock:
+			self._entries = {
+				'clients': {client['username']: client for client in clients},
+				'roles': {role['rolename']: role for role in roles},
+				'groups': {group['groupname']: group for group in groups},
+			}
+			self._loaded_at = time.monotonic()
+
+	def get(self, kind, name):
+		with self._lock:
+			entry = self._entries[kind].get(name)
+			return copy.deepcopy(entry) if entry is not None else None
+
+	def put(self, kind, entry):
+		with self._lock:
+			self._entries[kind][entry[self.KINDS[kind]]] = entry
+
+	def list(self, kind):
+		with self._lock:
+			entries = sorted(self._entries[kind].items(), key=lambda item: item[0])
+			return [copy.deepcopy(entry) for _, entry in entries]
+
+	def apply(self, command, response_entry):
+		"""
+		Mirrors a successful setter command. Getters are ignored.
+		"""
+		name = command['command']
+		if name.startswith(('get', 'list')):
+			return
+		with self._lock:
+			# e.g. 'Role already exists': the broker state is unknown here, so read it again next time
+			mirror = self._MIRRORS.get(name) if 'error' not in response_entry else None
+			if mirror is None or not mirror(self, command):
+				self._drop(command)
+
+	"""
+    Mirrors of the setter commands (called with the lock held), False if the command cannot be mirrored
+    """
+
+	def _create_client(self, command):
+		self._entries['clients'][command['username']] = {
+			'username': command['username'],
+			'textname': command.get('textname', ''),
+			'textdescription': command.get('textdescription', ''),
+			'roles': command.get('roles', []),
+			'groups': command.get('groups', []),
+		}
+		return True
+
+	def _create_role(self, command):
+		self._entries['roles'][command['rolename']] = {
+			'rolename': command['rolename'],
+			'textname': command.get('textname', ''),
+			'textdescription': command.get('textdescription', ''),
+			'acls': command.get('acls', []),
+		}
+		return True
+
+	def _delete_client(self, command):
+		self._entries['clients'].pop(command['username'], None)
+		return True
+
+	def _delete_role(self, command):
+		self._entries['roles'].pop(command['rolename'], None)
+		for entry in list(self._entries['clients'].values()) + list(self._entries['groups'].values()):
+			entry['roles'] = [role for role in entry.get('roles', []) if role['rolename'] != command['rolename']]
+		return True
+
+	def _modify_client(self, command):
+		client = self._entries['clients'].get(command['username'])
+		if client is None:
+			return False
+		for field in ('textname', 'textdescription', 'roles', 'groups'):
+			if field in command:
+				client[field] = command[field]
+		return True
+
+	def _add_client_role(self, command):
+		if not self._remove_client_role(command):
+			return False
+		client = self._entries['clients'][command['username']]
+		client['roles'].append({'rolename': command['rolename'], 'priority': command.get('priority', -1)})
+		return True
+
+	def _remove_client_role(self, command):
+		client = self._entries['clients'].get(command['username'])
+		if client is None:
+			return False
+		client['roles'] = [role for role in client.get('roles', []) if role['rolename'] != command['rolename']]
+		return True
+
+	def _add_role_acl(self, command):
+		role = self._entries['roles'].get(command['rolename'])
+		if role is None:
+			return False
+		role['acls'] = role.get('acls', []) + [
+			{field: command[field] for field in ('acltype', 'topic', 'priority', 'allow') if field in command}
+		]
+		return True
+
+	def _remove_role_acl(self, command):
+		role = self._entries['roles'].get(command['rolename'])
+		if role is None:
+			return False
+		role['acls'] = [
+			acl for acl in role.get('acls', [])
+			if (acl['acltype'], acl['topic']) != (command['acltype'], command['topic'])
+		]
+		return True
+
+	_MIRRORS = {
+		'createClient': _create_client,
+		'createRole': _create_role,
+		'deleteClient': _delete_client,
+		'deleteRole': _delete_role,
+		'modifyClient': _modify_client,
+		'addClientRole': _add_client_role,
+		'removeClientRole': _remove_client_role,
+		'addRoleACL': _add_role_acl,
+		'removeRoleACL': _remove_role_acl,
+	}
+
+	def _drop(self, command):
+		for kind, key in self.KINDS.items():
+			if key in command:
+				self._entries[kind].pop(command[key], None)
+		if 'groupname' in command or command['command'].endswith('DefaultACLAccess'):
+			# Group changes affect the group and its clients, which are not all known here
+			self._loaded_at = None
+
+
+def _listing_page(kind, offset, page_size, success, response):
+	"""
+	Checks one page of a paginated listing (used by MosquittoDynSec and AsyncMosquittoDynSec).
+
+	:return: Tuple of (entries of the page, offset of the next page or None after the last page).
+	"""
+	if not success:
+		raise RuntimeError(f'Listing {kind} failed at offset {offset}: {response}')
+	data = response['responses'][0]['data']
+	page = data[kind]
+	next_offset = offset + len(page)
+	if len(page) < page_size or next_offset >= data.get('totalCount', next_offset + 1):
+		next_offset = None
+	return page, next_offset
+
+
+class MosquittoDynSec(DynSecCommands):
+	"""
+	Based on commands at https://github.com/eclipse/mosquitto/blob/master/plugins/dynamic-security/README.md
+	About Mosquitto Dynamic Security Plugin (DSP): https://mosquitto.org/documentation/dynamic-security/
+
+	A Python wrapper for interacting with the Mosquitto MQTT broker's Dynamic Security Plugin (DSP).
+	This class abstracts the MQTT communication and command sending to the Dynamic Security Plugin,
+	facilitating the management of ACLs, clients, groups, and roles within the broker.
+
+	The class provides setter and getter functions for various configurations supported by the
+	Dynamic Security Plugin. Setter functions are used to configure or modify settings, while
+	getter functions are used to retrieve current configurations from the broker.
+
+	SETTER functions return a tuple of (success, response, send_code), where 'success' is a boolean indicating
+	the operation's success, 'response' is a dictionary containing the broker's response and send_code is the code
+	returned by the paho-mqtt package.
+
+	GETTER functions similarly return a tuple of (success, response, send_code) where 'response' in this case
+	contains the requested configuration data.
+
+	This is the blocking interface to AsyncMosquittoDynSec, which implements the protocol: the instance runs an
+	event loop in one background thread (instead of paho's loop_start() thread) and every command waits for
+	its coroutine on that loop. Every command is tagged with a unique 'correlationData' string which the plugin
+	copies into its reply, so one instance can be shared by many threads with several commands in flight.
+
+	Example usage:
+	    mosquitto_dyn_sec = MosquittoDynSec(dynsec_user, dynsec_user_password)
+	    success, response, send_code = mosquitto_dyn_sec.set_default_acl_access(False, True, False, True)
+
+	Attributes:
+	    username (str): Admin Username used to control with the Mosquitto Dynamic Security Plugin.
+	    password (str): Password used for above user.
+	    host (str): Hostname or IP address of the MQTT broker.
+	    port (int): Network port of the MQTT broker.
+	"""
+
+	def __init__(self, username, password, host="localhost", port=1884, cache=None, stats=None, breaker=None):
+		"""
+		Initializes a new instance of the MosquittoDynSec class.
+
+		Starts the event loop thread, connects to the MQTT broker and waits (up to 'sub_event_timeout_seconds')
+		until the response topic of the Dynamic Security Plugin is subscribed.
+
+		Parameters:
+		    username (str): The username of the client that writes to the '$CONTROL/dynamic-security/v1' topic.
+		    password (str): The password of the client that writes to the '$CONTROL/dynamic-security/v1' topic.
+		    host (str): The hostname or IP address of the MQTT broker.
+		    port (int): The network port of the MQTT server.
+		    cache (DynSecStateCache): Optional mirror of the DSP state used by the getter functions.
+		    stats (DynSecStats): Where to record the command counters and latencies (a new one if None).
+		    breaker (DynSecCircuitBreaker): Optional breaker told whether the payloads got any reply.
+		"""
+		self.username = username
+		self.password = password
+		self.host = host
+		self.port = port
+		self.cache = cache
+		self._async = AsyncMosquittoDynSec(
+			username, password, host=host, port=port, cache=cache, stats=stats, breaker=breaker
+		)
+		self.sub_event_timeout_seconds = self._async.sub_event_timeout_seconds
+		# Longest a command may take: waiting for the subscription and then for the reply
+		self.call_timeout_seconds = self._async.sub_event_timeout_seconds + self._async.msg_received_timeout_seconds
+
+		self._loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self._loop.run_forever, name='dynsec-loop', daemon=True)
+		self._thread.start()
+		try:
+			self._call(self._async.connect())
+		except Exception:
+			self._stop_loop()
+			raise
+
+	def _call(self, coroutine):
+		# Runs the coroutine on the instance's event loop and blocks the calling thread until it is done.
+		# Raises TimeoutError if it takes longer than a command may, and CancelledError if the loop was stopped
+		# under it (another thread reconnecting the session).
+		future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+		try:
+			return future.result(timeout=self.call_timeout_seconds)
+		except TimeoutError:
+			future.cancel()
+			raise
+
+	async def _shutdown(self):
+		# Cancels the coroutines other threads still wait for, so their _call() does not block forever
+		tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+		for task in tasks:
+			task.cancel()
+		await asyncio.gather(*tasks, return_exceptions=True)
+		asyncio.get_running_loop().stop()
+
+	def _stop_loop(self):
+		asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+		self._thread.join(timeout=5)
+		if not self._thread.is_alive():
+			self._loop.close()
+
+	def disconnect(self):
+		if self._loop.is_closed():
+			return
+		try:
+			self._call(self._async.disconnect())
+		except TimeoutError:
+			pass  # the loop is stopped anyway
+		finally:
+			self._stop_loop()
+		# print("Disconnected MQTT client.")
+
+	def is_connected(self):
+		return self._async.is_connected()
+
+	def is_subscribed(self):
+		return self._async.is_subscribed()
+
+	def _execute_command(self, command):
+		results, response, send_code = self._execute_batch(command['commands'])
+		success = results[0][0]  # only one command is expected per function call
+		return success, response, send_code
+
+	def _execute_batch(self, commands):
+		"""
+		Sends several commands in one payload and maps each entry of the 'responses' array back to its command
+		by its 'correlationData'.
+
+		:param commands: List of command dictionaries (the entries of the 'commands' array).
+		:return: Tuple of (results, response, send_code) where 'results' holds one (success, response_entry)
+		    tuple per command, in the order of 'commands'. 'response' is None if no reply was received at all.
+		"""
+		try:
+			return self._call(self._async._execute_batch(commands))
+		except TimeoutError:
+			# Counted and reported like commands that got no reply
+			for entry in commands:
+				self._async._stats.record(entry['command'], None, 0.0)
+			send_code = mqtt.MQTTMessageInfo(0)
+			send_code.rc = mqtt.MQTT_ERR_UNKNOWN
+			return self._async._finish_batch(commands, [None] * len(commands), send_code)
+
+	def stats(self):
+		"""
+		Returns the per-command counters and latency histograms, see DynSecStats.snapshot().
+		"""
+		return self._async.stats()
+
+	"""
+    Cached getter functions (answered from the DynSecStateCache if one is attached, otherwise like DynSecCommands)
+    """
+
+	def refresh_cache(self):
+		"""
+		Reloads the attached cache with one verbose listClients/listRoles/listGroups sweep (one round trip).
+
+		:return: True if all three listings were received.
+		"""
+		with self.batch() as batch:
+			DynSecCommands.list_clients(batch, verbose=True)
+			DynSecCommands.list_roles(batch, verbose=True)
+			DynSecCommands.list_groups(batch, verbose=True)
+		if not batch.successful:
+			return False
+		clients, roles, groups = (response_entry['data'][kind] for (_, response_entry), kind in zip(
+			batch.results, ('clients', 'roles', 'groups')
+		))
+		self.cache.load(clients, roles, groups)
+		return True
+
+	def _cache_usable(self, refresh):
+		if self.cache is None:
+			return False
+		if refresh or not self.cache.is_fresh():
+			return self.refresh_cache()
+		return True
+
+	def _cached_get(self, kind, name, command_name, refresh, fetch):
+		if self._cache_usable(refresh):
+			entry = self.cache.get(kind, name)
+			if entry is not None:
+				data_key = kind[:-1]  # 'clients' -> 'client'
+				return True, {'responses': [{'command': command_name, 'data': {data_key: entry}}]}, None
+		success, response, send_code = fetch()
+		if success and self.cache is not None:
+			self.cache.put(kind, response['responses'][0]['data'][kind[:-1]])
+		return success, response, send_code
+
+	def _cached_list(self, kind, command_name, verbose, count, offset, refresh, fetch):
+		if self._cache_usable(refresh):
+			entries = self.cache.list(kind)
+			page = entries[offset:] if count == -1 else entries[offset:offset + count]
+			if not verbose:
+				page = [entry[DynSecStateCache.KINDS[kind]] for entry in page]
+			data = {'totalCount': len(entries), kind: page}
+			return True, {'responses': [{'command': command_name, 'data': data}]}, None
+		return fetch()
+
+	def get_client(self, username, refresh=False):
+		"""
+		See DynSecCommands.get_client(). With a cache attached, the client is returned from memory
+		(send_code is None then); 'refresh' forces a new sweep first.
+		"""
+		return self._cached_get(
+			'clients', username, 'getClient', refresh, lambda: DynSecCommands.get_client(self, username)
+		)
+
+	def get_role(self, rolename, refresh=False):
+		"""
+		See DynSecCommands.get_role() and get_client() for the cache.
+		"""
+		return self._cached_get('roles', rolename, 'getRole', refresh, lambda: DynSecCommands.get_role(self, rolename))
+
+	def get_group(self, groupname, refresh=False):
+		"""
+		See DynSecCommands.get_group() and get_client() for the cache.
+		"""
+		return self._cached_get(
+			'groups', groupname, 'getGroup', refresh, lambda: DynSecCommands.get_group(self, groupname)
+		)
+
+	def list_clients(self, verbose=False, count=-1, offset=0, refresh=False):
+		"""
+		See DynSecCommands.list_clients() and get_client() for the cache.
+		"""
+		return self._cached_list(
+			'clients', 'listClients', verbose, count, offset, refresh,
+			lambda: DynSecCommands.list_clients(self, verbose, count, offset),
+		)
+
+	def list_roles(self, verbose=False, count=-1, offset=0, refresh=False):
+		"""
+		See DynSecCommands.list_roles() and get_client() for the cache.
+		"""
+		return self._cached_list(
+			'roles', 'listRoles', verbose, count, offset, refresh,
+			lambda: DynSecCommands.list_roles(self, verbose, count, offset),
+		)
+
+	def list_groups(self, verbose=False, count=-1, offset=0, refresh=False):
+		"""
+		See DynSecCommands.list_groups() and get_client() for the cache.
+		"""
+		return self._cached_list(
+			'groups', 'listGroups', verbose, count, offset, refresh,
+			lambda: DynSecCommands.list_groups(self, verbose, count, offset),
+		)
+
+	"""
+    Paginated getter functions (walk a listing in pages of 'page_size' entries instead of one payload with all)
+    """
+
+	def _iter_listing(self, list_function, kind, verbose, page_size):
+		offset = 0
+		while offset is not None:
+			success, response, _ = list_function(verbose=verbose, count=page_size, offset=offset)
+			page, offset = _listing_page(kind, offset, page_size, success, response)
+			yield from page
+
+	def iter_clients(self, verbose=False, page_size=100):
+		"""
+		Yields all clients (usernames, or client dicts if 'verbose'), fetching them 'page_size' at a time.
+		Raises RuntimeError if a page could not be fetched.
+
+		Example:
+		    for client in dynsec.iter_clients(verbose=True, page_size=500):
+		        print(client['username'], client['roles'])
+		"""
+		return self._iter_listing(self.list_clients, 'clients', verbose, page_size)
+
+	def iter_roles(self, verbose=False, page_size=100):
+		"""
+		Yields all roles, see iter_clients().
+		"""
+		return self._iter_listing(self.list_roles, 'roles', verbose, page_size)
+
+	def iter_groups(self, verbose=False, page_size=100):
+		"""
+		Yields all groups, see iter_clients().
+		"""
+		return self._iter_listing(self.list_groups, 'groups', verbose, page_size)
+
+	def batch(self):
+		"""
+		Returns a DynSecBatch that collects commands and sends them to the broker in a single round trip
+		when the 'with' block is left.
+
+		Example usage:
+		    with mosquitto_dyn_sec.batch() as batch:
+		        role_index = batch.create_role('BasicSubscriber')
+		        client_index = batch.create_client('john_doe', 'password')
+		    success, response_entry = batch.results[client_index]
+		"""
+		return DynSecBatch(self)
+
+
+class DynSecBatch(DynSecCommands):
+	"""
+	Collects DSP commands and sends them as one payload to the broker (one round trip for all commands).
+
+	The command methods return the position of the command in the batch instead of a result. After the
+	batch was executed, 'results' holds one (success, response_entry) tuple per command in that order.
+	The batch is executed when the 'with' block is left without an exception or by calling execute().
+	"""
+
+	def __init__(self, dynsec):
+		self.dynsec = dynsec
+		self.commands = []
+		self.results = []
+		self.response = None
+		self.send_code = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			self.execute()
+		return False
+
+	def _execute_command(self, command):
+		self.commands.extend(command['commands'])
+		return len(self.commands) - 1
+
+	@property
+	def successful(self):
+		return bool(self.results) and all(success for success, _ in self.results)
+
+	def execute(self):
+		if self.commands:
+			self.results, self.response, self.send_code = self.dynsec._execute_batch(self.commands)
+		return self.results
+
+
+
+class AsyncDynSecBatch(DynSecBatch):
+	"""
+	DynSecBatch for AsyncMosquittoDynSec. Use it with 'async with' or await execute().
+	"""
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		if exc_type is None:
+			await self.execute()
+		return False
+
+	async def execute(self):
+		if self.commands:
+			self.results, self.response, self.send_code = await self.dynsec._execute_batch(self.commands)
+		return self.results
+
+
+class AsyncMosquittoDynSec(DynSecCommands):
+	"""
+	Implementation of the DSP protocol on asyncio, used directly by async views (ASGI) and through the blocking
+	MosquittoDynSec wrapper everywhere else. All getter and setter functions are coroutines returning the same
+	(success, response, send_code) tuples as MosquittoDynSec.
+
+	The paho client is driven by the event loop through its socket callbacks (no loop_start() thread) and
+	replies are awaited as asyncio futures matched by correlationData (no blocking Event.wait()).
+	An instance is bound to the event loop it was connected on.
+
+	Example usage:
+	    async with AsyncMosquittoDynSec(dynsec_user, dynsec_user_password) as dynsec:
+	        success, response, send_code = await dynsec.get_client('john_doe')
+	"""
+
+	def __init__(self, username, password, host="localhost", port=1884, cache=None, stats=None, breaker=None):
+		self.username = username
+		self.password = password
+		self.host = host
+		self.port = port
+		self.cache = cache
+		self._stats = stats if stats is not None else DynSecStats()
+		self.breaker = breaker
+
+		# MQTT topics
+		self.send_command_topic = '$CONTROL/dynamic-security/v1'
+		self.response_topic = '$CONTROL/dynamic-security/v1/response'
+
+		# Futures of the commands waiting for a reply, by correlationData.
+		# They resolve to (response_entry, time the reply was received).
+		self._pending = {}
+
+		self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+		self.client.username_pw_set(self.username, self.password)
+
+		# Event loop integration and timeouts
+		self._loop = None
+		self._misc_task = None
+		self._subscribed = None
+		self._socket_closed = None
+		self.sub_event_timeout_seconds = 5
+		self.msg_received_timeout_seconds = 10
+
+		self.client.on_connect = self.on_connect
+		self.client.on_subscribe = self.on_subscribe
+		self.client.on_message = self.on_message
+		self.client.on_disconnect = self.on_disconnect
+		self.client.on_socket_open = self.on_socket_open
+		self.client.on_socket_close = self.on_socket_close
+		self.client.on_socket_register_write = self.on_socket_register_write
+		self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+	async def __aenter__(self):
+		await self.connect()
+		return self
+
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		await self.disconnect()
+		return False
+
+	async def connect(self):
+		"""
+		Connects to the broker and waits (without blocking the event loop) until the response topic is subscribed.
+		"""
+		self._loop = asyncio.get_running_loop()
+		self._subscribed = self._loop.create_future()
+		self._socket_closed = self._loop.create_future()
+		# The TCP connect (and DNS lookup) blocks, so it runs in the default executor of the loop
+		await self._loop.run_in_executor(None, self.client.connect, self.host, self.port, 60)
+		self._misc_task = self._loop.create_task(self._misc_loop())
+		try:
+			await asyncio.wait_for(asyncio.shield(self._subscribed), self.sub_event_timeout_seconds)
+		except asyncio.TimeoutError:
+			pass  # commands are still sent, they wait for the subscription themselves
+
+	async def disconnect(self):
+		if self.client.socket() is not None:
+			self.client.disconnect()
+			try:
+				# Give the loop the chance to write the DISCONNECT packet and close the socket
+				await asyncio.wait_for(asyncio.shield(self._socket_closed), 1)
+			except asyncio.TimeoutError:
+				pass
+		if self._misc_task is not None:
+			self._misc_task.cancel()
+			self._misc_task = None
+		for future in self._pending.values():
+			future.cancel()
+		self._pending.clear()
+
+	def is_connected(self):
+		return self.client.is_connected()
+
+	def is_subscribed(self):
+		return self._subscribed is not None and self._subscribed.done()
+
+	"""
+    Internal-use functions and callbacks (only used by the class itself)
+    """
+
+	def _call_in_loop(self, callback, *args):
+		# paho calls the socket callbacks from the thread that runs client.connect() (an executor thread)
+		# as well as from the event loop itself, but the loop may only be changed from its own thread
+		if self._loop is None or self._loop.is_closed():
+			return  # nothing is registered on a loop that is gone (e.g. paho closing the socket in __del__)
+		try:
+			running_loop = asyncio.get_running_loop()
+		except RuntimeError:
+			running_loop = None
+		if running_loop is self._loop:
+			callback(*args)
+		else:
+			self._loop.call_soon_threadsafe(callback, *args)
+
+	def on_socket_open(self, client, userdata, sock):
+		self._call_in_loop(self._loop.add_reader, sock, client.loop_read)
+
+	def on_socket_close(self, client, userdata, sock):
+		self._call_in_loop(self._socket_was_closed, sock)
+
+	def _socket_was_closed(self, sock):
+		self._loop.remove_reader(sock)
+		self._loop.remove_writer(sock)
+		if not self._socket_closed.done():
+			self._socket_closed.set_result(True)
+
+	def on_socket_register_write(self, client, userdata, sock):
+		self._call_in_loop(self._loop.add_writer, sock, client.loop_write)
+
+	def on_socket_unregister_write(self, client, userdata, sock):
+		self._call_in_loop(self._loop.remove_writer, sock)
+
+	async def _misc_loop(self):
+		# Keepalive pings and retries, normally done by the loop_start() thread
+		while self.client.loop_misc() == MQTT_ERR_SUCCESS:
+			await asyncio.sleep(1)
+
+	def on_connect(self, client, userdata, flags, rc):
+		self.client.subscribe(self.response_topic, qos=2)
+
+	def on_subscribe(self, client, userdata, mid, granted_qos):
+		if self._subscribed is not None and not self._subscribed.done():
+			self._subscribed.set_result(True)
+
+	def on_disconnect(self, client, userdata, rc):
+		self._subscribed = self._loop.create_future()
+
+	def on_message(self, client, userdata, msg):
+		received_at = time.monotonic()
+		try:
+			response_msg = json.loads(msg.payload.decode('utf-8'))
+		except ValueError:
+			return
+		for response_entry in response_msg.get('responses', []):
+			future = self._pending.pop(response_entry.get('correlationData'), None)
+			if future is not None and not future.done():
+				future.set_result((response_entry, received_at))
+
+	async def _execute_command(self, command):
+		results, response, send_code = await self._execute_batch(command['commands'])
+		success = results[0][0]  # only one command is expected per function call
+		return success, response, send_code
+
+	async def _execute_batch(self, commands):
+		"""
+		Sends several commands in one payload and maps each entry of the 'responses' array back to its command
+		by its 'correlationData'.
+
+		:param commands: List of command dictionaries (the entries of the 'commands' array).
+		:return: Tuple of (results, response, send_code) where 'results' holds one (success, response_entry)
+		    tuple per command, in the order of 'commands'. 'response' is None if no reply was received at all.
+		"""
+		response_entries, send_code = await self._send_and_wait(commands)
+		return self._finish_batch(commands, response_entries, send_code)
+
+	async def _send_and_wait(self, commands):
+		# Publishes the commands and collects one response entry (None if there was no reply) per command
+		futures = []
+		for entry in commands:
+			correlation_data = uuid.uuid4().hex
+			entry['correlationData'] = correlation_data
+			future = self._loop.create_future()
+			self._pending[correlation_data] = future
+			futures.append(future)
+
+		if not self._subscribed.done():
+			try:
+				await asyncio.wait_for(asyncio.shield(self._subscribed), self.sub_event_timeout_seconds)
+			except asyncio.TimeoutError:
+				pass
+		sent_at = time.monotonic()
+		send_code = self.client.publish(self.send_command_topic, json.dumps({'commands': commands}), qos=2)
+
+		if send_code.rc == MQTT_ERR_SUCCESS:
+			await asyncio.wait(futures, timeout=self.msg_received_timeout_seconds)
+		response_entries = []
+		for entry, future in zip(commands, futures):
+			self._pending.pop(entry['correlationData'], None)
+			if future.done() and not future.cancelled():
+				response_entry, received_at = future.result()
+				response_entries.append(response_entry)
+				self._stats.record(entry['command'], response_entry, received_at - sent_at)
+			else:
+				future.cancel()
+				response_entries.append(None)
+				if send_code.rc == MQTT_ERR_SUCCESS:
+					self._stats.record(entry['command'], None, 0.0)
+				else:
+					self._stats.record_send_failed(entry['command'])
+		return response_entries, send_code
+
+	def _finish_batch(self, commands, response_entries, send_code):
+		# Reports to the breaker, applies successful commands to the cache and builds the return value
+		if self.breaker is not None:
+			if any(response_entry is not None for response_entry in response_entries):
+				self.breaker.record_success()
+			else:
+				self.breaker.record_failure()
+
+		results = [
+			(self._is_entry_successful(entry['command'], response_entry), response_entry)
+			for entry, response_entry in zip(commands, response_entries)
+		]
+		if self.cache is not None:
+			for entry, (success, response_entry) in zip(commands, results):
+				if success:
+					self.cache.apply(entry, response_entry)
+		received_entries = [response_entry for response_entry in response_entries if response_entry is not None]
+		response = {'responses': received_entries} if received_entries else None
+		return results, response, send_code
+
+	async def _iter_listing(self, list_function, kind, verbose, page_size):
+		offset = 0
+		while offset is not None:
+			success, response, _ = await list_function(verbose=verbose, count=page_size, offset=offset)
+			page, offset = _listing_page(kind, offset, page_size, success, response)
+			for entry in page:
+				yield entry
+
+	def iter_clients(self, verbose=False, page_size=100):
+		"""
+		Async generator version of MosquittoDynSec.iter_clients().
+
+		Example:
+		    async for username in dynsec.iter_clients(page_size=500):
+		        ...
+		"""
+		return self._iter_listing(self.list_clients, 'clients', verbose, page_size)
+
+	def iter_roles(self, verbose=False, page_size=100):
+		return self._iter_listing(self.list_roles, 'roles', verbose, page_size)
+
+	def iter_groups(self, verbose=False, page_size=100):
+		return self._iter_listing(self.list_groups, 'groups', verbose, page_size)
+
+	def stats(self):
+		"""
+		See MosquittoDynSec.stats().
+		"""
+		return self._stats.snapshot()
+
+	def batch(self):
+		"""
+		Returns an AsyncDynSecBatch, see MosquittoDynSec.batch().
+
+		Example usage:
+		    async with dynsec.batch() as batch:
+		        batch.create_role('BasicSubscriber')
+		"""
+		return AsyncDynSecBatch(self)
+
+
+class DynSecConnectionManager:
+	"""
+	Keeps one authenticated MosquittoDynSec session per process (e.g. per gunicorn worker) instead of
+	connecting, subscribing and disconnecting for every single command.
+
+	The session is created lazily on first use and replaced transparently if the connection was lost
+	or the process was forked after the session had been created. The lock only guards (re)connecting;
+	commands of different threads run concurrently on the shared session since MosquittoDynSec matches
+	replies to commands by their correlationData.
+
+	With a DynSecCircuitBreaker, session() raises DynSecUnavailable right away while the broker is
+	considered down, and the breaker probes the broker by reconnecting this manager in the background.
+
+	Example usage:
+	    dynsec_manager = DynSecConnectionManager(dynsec_user, dynsec_user_password)
+	    with dynsec_manager.session() as dynsec:
+	        success, response, send_code = dynsec.get_client('john_doe')
+	"""
+
+	def __init__(
+		self, username, password, host='localhost', port=1884, cache_max_age_seconds=None, breaker=None
+	):
+		self.username = username
+		self.password = password
+		self.host = host
+		self.port = port
+		self.breaker = breaker
+		if breaker is not None and breaker.probe is None:
+			breaker.probe = self._probe
+		# The cache outlives reconnects, but not forks (see _connect())
+		self.cache_max_age_seconds = cache_max_age_seconds
+		self.cache = DynSecStateCache(cache_max_age_seconds) if cache_max_age_seconds is not None else None
+		self._stats = DynSecStats()  # shared by all sessions of this process
+		self._dynsec = None
+		self._pid = None
+		self._lock = threading.RLock()
+
+	def _is_usable(self):
+		return self._dynsec is not None and self._pid == os.getpid() and self._dynsec.is_connected()
+
+	def _connect(self):
+		if self._dynsec is not None and self._pid == os.getpid():
+			try:
+				self._dynsec.disconnect()
+			except Exception:
+				pass  # the old session is discarded anyway
+		else:
+			# New process: start with an empty mirror and fresh counters
+			if self.cache is not None:
+				self.cache = DynSecStateCache(self.cache_max_age_seconds)
+			self._stats = DynSecStats()
+		self._dynsec = None
+		try:
+			self._dynsec = MosquittoDynSec(
+				self.username, self.password, host=self.host, port=self.port,
+				cache=self.cache, stats=self._stats, breaker=self.breaker,
+			)
+		except Exception:
+			if self.breaker is not None:
+				self.breaker.record_failure()
+			raise
+		self._pid = os.getpid()
+		# Wait for connection and subscription so the first command is not published into the void
+		if not self._dynsec.is_subscribed():
+			if self.breaker is not None:
+				self.breaker.record_failure()
+			raise DynSecUnavailable(f'No Dynamic Security session to {self.host}:{self.port}')
+
+	def _probe(self):
+		# Run by the circuit breaker in a background thread while it is half-open
+		with self._lock:
+			if not self._is_usable():
+				self._connect()
+			return self._dynsec.is_subscribed()
+
+	@contextmanager
+	def session(self):
+		"""
+		Yields the connected MosquittoDynSec instance of this process.
+		Raises the underlying exception or DynSecUnavailable if the broker cannot be reached.
+		"""
+		if self.breaker is not None and not self.breaker.allow():
+			raise DynSecUnavailable(f'Dynamic Security circuit breaker is {self.breaker.state}')
+		with self._lock:
+			if not self._is_usable():
+				self._connect()
+			dynsec = self._dynsec
+		yield dynsec
+
+	def stats(self):
+		"""
+		Returns the counters and latency histograms of all sessions of this process, see DynSecStats.snapshot().
+		"""
+		if self._pid is not None and self._pid != os.getpid():
+			return {}  # inherited from the parent process
+		return self._stats.snapshot()
+
+	def close(self):
+		with self._lock:
+			if self._dynsec is not None and self._pid == os.getpid():
+				self._dynsec.disconnect()
+			self._dynsec = None
+			self._pid = None
+
+
+class AsyncDynSecConnectionManager:
+	"""
+	Async counterpart of DynSecConnectionManager: keeps one AsyncMosquittoDynSec session per event loop.
+
+	Sessions of event loops that were closed in the meantime (e.g. the short-lived loops of async views
+	served by a WSGI worker) are discarded on the next call.
+
+	Example usage:
+	    async with async_dynsec_manager.session() as dynsec:
+	        success, response, send_code = await dynsec.get_client('john_doe')
+	"""
+
+	def __init__(self, username, password, host='localhost', port=1884, breaker=None):
+		self.username = username
+		self.password = password
+		self.host = host
+		self.port = port
+		self.breaker = breaker  # usually shared with the DynSecConnectionManager, which provides the probe
+		self._sessions = weakref.WeakKeyDictionary()  # event loop -> [AsyncMosquittoDynSec or None, asyncio.Lock]
+		self._stats = DynSecStats()  # shared by the sessions of all event loops
+
+	def _discard_closed_loops(self):
+		for loop in [loop for loop in self._sessions if loop.is_closed()]:
+			dynsec = self._sessions.pop(loop)[0]
+			sock = dynsec.client.socket() if dynsec is not None else None
+			if sock is not None:
+				sock.close()  # the loop that would have sent DISCONNECT is gone
+
+	@asynccontextmanager
+	async def session(self):
+		"""
+		Yields the connected AsyncMosquittoDynSec instance of the running event loop.
+		Raises the underlying exception or DynSecUnavailable if the broker cannot be reached.
+		"""
+		if self.breaker is not None and not self.breaker.allow():
+			raise DynSecUnavailable(f'Dynamic Security circuit breaker is {self.breaker.state}')
+		self._discard_closed_loops()
+		loop = asyncio.get_running_loop()
+		entry = self._sessions.setdefault(loop, [None, asyncio.Lock()])
+		async with entry[1]:
+			if entry[0] is None or not entry[0].is_connected():
+				if entry[0] is not None:
+					await entry[0].disconnect()
+				entry[0] = None
+				dynsec = AsyncMosquittoDynSec(
+					self.username, self.password, host=self.host, port=self.port,
+					stats=self._stats, breaker=self.breaker,
+				)
+				try:
+					await dynsec.connect()
+				except Exception:
+					if self.breaker is not None:
+						self.breaker.record_failure()
+					raise
+				if not dynsec.is_subscribed():
+					if self.breaker is not None:
+						self.breaker.record_failure()
+					await dynsec.disconnect()
+					raise DynSecUnavailable(f'No Dynamic Security session to {self.host}:{self.port}')
+				entry[0] = dynsec
+			dynsec = entry[0]
+		yield dynsec
+
+	def stats(self):
+		"""
+		Returns the counters and latency histograms of all sessions of this process, see DynSecStats.snapshot().
+		"""
+		return self._stats.snapshot()
@@ -0,0 +1,236 @@
+import re
+import time
+from django.db.models import Q
+import users.models
+from .mosquitto_dynsec import DynSecCommands, DynSecBatch
+from .dynsec_snapshot import DynSecSnapshot
+from .mosquitto_utils import dynsec_manager, nodered_role_acls, device_role_acls, inout_role_acls
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Roles created by MqttMetaDataManager. Clients and roles of the broker setup (admin, mqttInToDB, ...) never match.
+MANAGED_ROLE_PATTERN = re.compile(r'^(nodered|device|inout)-[A-Za-z0-9]{12}$')
+
+# Upper bound for the commands sent in one DSP payload while applying a diff
+APPLY_BATCH_SIZE = 500
+# Time given to registrations running meanwhile (broker entry created, row not committed yet) before the
+# orphans are checked against the database again and deleted
+ORPHAN_GRACE_SECONDS = 5
+
+
+class MqttReconcileDiff:
+    """
+    Differences between the MqttMetaData/MqttClient rows and the Dynamic Security Plugin.
+
+    missing_roles:      [(rolename, acls)]        role of a MqttMetaData row that the broker does not know
+    mismatched_roles:   [(rolename, acls)]        role with other ACLs than the user's topic id requires
+    orphaned_roles:     [rolename]                managed role without a MqttMetaData row
+    missing_clients:    [MqttClient]              MqttClient row that the broker does not know
+    mismatched_clients: [(MqttClient, changes)]   client with other roles or textname than its row
+    orphaned_clients:   [username]                broker client with only managed roles but no MqttClient row
+    """
+
+    def __init__(self):
+        self.missing_roles = []
+        self.mismatched_roles = []
+        self.orphaned_roles = []
+        self.missing_clients = []
+        self.mismatched_clients = []
+        self.orphaned_clients = []
+
+    def is_empty(self):
+        return not any(self.counts().values())
+
+    def counts(self):
+        return {
+            'missing_roles': len(self.missing_roles),
+            'mismatched_roles': len(self.mismatched_roles),
+            'orphaned_roles': len(self.orphaned_roles),
+            'missing_clients': len(self.missing_clients),
+            'mismatched_clients': len(self.mismatched_clients),
+            'orphaned_clients': len(self.orphaned_clients),
+        }
+
+
+def _acl_key(acl):
+    return (acl['acltype'], acl['topic'], acl.get('priority', -1), bool(acl.get('allow', False)))
+
+
+def fetch_broker_state(dynsec):
+    """
+    Fetches all clients and roles (verbose) from the broker in one round trip, bypassing any cache.
+    Returns ({username: client}, {rolename: role}) or raises RuntimeError if a listing failed.
+    """
+    with dynsec.batch() as batch:
+        DynSecCommands.list_clients(batch, verbose=True)
+        DynSecCommands.list_roles(batch, verbose=True)
+    if not batch.successful:
+        raise RuntimeError(f'Failed to list clients and roles of the dynamic security plugin: {batch.results}')
+    (_, clients_entry), (_, roles_entry) = batch.results
+    clients = {client['username']: client for client in clients_entry['data']['clients']}
+    roles = {role['rolename']: role for role in roles_entry['data']['roles']}
+    return clients, roles
+
+
+def snapshot_broker_state(snapshot):
+    """
+    Reads all clients and roles from the configuration file of the plugin (see DynSecSnapshot) without any MQTT
+    traffic, in the format of fetch_broker_state(). The broker writes the file shortly after each change.
+    """
+    state = snapshot.current()
+    return dict(state.clients), dict(state.roles)
+
+
+def load_expected_state():
+    """
+    Reads the MqttMetaData and MqttClient rows. Returns ({rolename: acls}, [MqttClient]).
+    Read them before the broker state, so that nothing created in between is taken for an orphan.
+    """
+    expected_roles = {}
+    for metadata in users.models.MqttMetaData.objects.all().iterator():
+        expected_roles[metadata.nodered_role_name] = nodered_role_acls(metadata.user_topic_id)
+        expected_roles[metadata.device_role_name] = device_role_acls(metadata.user_topic_id)
+        expected_roles[metadata.inout_role_name] = inout_role_acls(metadata.user_topic_id)
+    return expected_roles, list(users.models.MqttClient.objects.all())
+
+
+def compute_diff(broker_clients, broker_roles, expected_state=None):
+    """
+    Compares the MqttMetaData and MqttClient rows (see load_expected_state(), read now if not given)
+    with the given broker state (see fetch_broker_state()).
+    """
+    expected_roles, mqtt_clients = expected_state if expected_state is not None else load_expected_state()
+    diff = MqttReconcileDiff()
+    _diff_roles(diff, expected_roles, broker_roles)
+    _diff_clients(diff, mqtt_clients, broker_clients)
+    return diff
+
+
+def _diff_roles(diff, expected_roles, broker_roles):
+    for rolename, acls in expected_roles.items():
+        role = broker_roles.get(rolename)
+        if role is None:
+            diff.missing_roles.append((rolename, acls))
+        elif {_acl_key(acl) for acl in role.get('acls', [])} != {_acl_key(acl) for acl in acls}:
+            diff.mismatched_roles.append((rolename, acls))
+
+    for rolename in broker_roles:
+        if MANAGED_ROLE_PATTERN.match(rolename) and rolename not in expected_roles:
+            diff.orphaned_roles.append(rolename)
+
+
+def _client_changes(mqtt_client, client):
+    changes = {}
+    broker_rolenames = [role['rolename'] for role in client.get('roles', [])]
+    if mqtt_client.rolename and broker_rolenames != [mqtt_client.rolename]:
+        changes['roles'] = [{'rolename': mqtt_client.rolename, 'priority': -1}]
+    if (client.get('textname') or '') != mqtt_client.textname:
+        changes['textname'] = mqtt_client.textname
+    return changes
+
+
+def _diff_clients(diff, mqtt_clients, broker_clients):
+    known_usernames = set()
+    for mqtt_client in mqtt_clients:
+        known_usernames.add(mqtt_client.username)
+        client = broker_clients.get(mqtt_client.username)
+        if client is None:
+            diff.missing_clients.append(mqtt_client)
+            continue
+        changes = _client_changes(mqtt_client, client)
+        if changes:
+            diff.mismatched_clients.append((mqtt_client, changes))
+
+    for username, client in broker_clients.items():
+        rolenames = [role['rolename'] for role in client.get('roles', [])]
+        if (
+            username not in known_usernames
+            and rolenames
+            and all(MANAGED_ROLE_PATTERN.match(rolename) for rolename in rolenames)
+        ):
+            diff.orphaned_clients.append(username)
+
+
+def drop_new_orphans(diff):
+    """
+    Removes the orphans whose row was committed after load_expected_state() (e.g. by a registration running
+    meanwhile) from 'diff'.
+    """
+    if diff.orphaned_clients:
+        known = set(
+            users.models.MqttClient.objects.filter(username__in=diff.orphaned_clients)
+            .values_list('username', flat=True)
+        )
+        diff.orphaned_clients = [username for username in diff.orphaned_clients if username not in known]
+    if diff.orphaned_roles:
+        rows = users.models.MqttMetaData.objects.filter(
+            Q(nodered_role_name__in=diff.orphaned_roles)
+            | Q(device_role_name__in=diff.orphaned_roles)
+            | Q(inout_role_name__in=diff.orphaned_roles)
+        ).values_list('nodered_role_name', 'device_role_name', 'inout_role_name')
+        known = {rolename for row in rows for rolename in row}
+        diff.orphaned_roles = [rolename for rolename in diff.orphaned_roles if rolename not in known]
+
+
+def _diff_commands(diff, delete_orphans=True):
+    # Roles before the clients that reference them, orphaned clients before their roles.
+    # The batch only collects the commands here, apply_diff() sends them in chunks.
+    commands = DynSecBatch(None)
+    for rolename, acls in diff.missing_roles:
+        commands.create_role(rolename, acls=acls)
+    for rolename, acls in diff.mismatched_roles:
+        commands.modify_role(rolename, acls=acls)
+    for mqtt_client in diff.missing_clients:
+        roles = [{'rolename': mqtt_client.rolename, 'priority': -1}] if mqtt_client.rolename else None
+        commands.create_client(mqtt_client.username, mqtt_client.password, textname=mqtt_client.textname, roles=roles)
+    for mqtt_client, changes in diff.mismatched_clients:
+        commands.modify_client(mqtt_client.username, **changes)
+    if delete_orphans:
+        for username in diff.orphaned_clients:
+            commands.delete_client(username)
+        for rolename in diff.orphaned_roles:
+            commands.delete_role(rolename)
+    return commands.commands
+
+
+def apply_diff(dynsec, diff, delete_orphans=True, batch_size=APPLY_BATCH_SIZE):
+    """
+    Sends the commands that resolve 'diff' to the broker in batches of 'batch_size' commands.
+    Returns the list of (command, response_entry) that failed.
+    """
+    commands = _diff_commands(diff, delete_orphans=delete_orphans)
+    failed = []
+    for start in range(0, len(commands), batch_size):
+        batch = dynsec.batch()
+        batch.commands = commands[start:start + batch_size]
+        batch.execute()
+        for command, (success, response_entry) in zip(batch.commands, batch.results):
+            if not success:
+                logger.error(f"DSP command '{command['command']}' failed during reconcile: {response_entry}")
+                failed.append((command, response_entry))
+    return failed
+
+
+def reconcile_mqtt(apply=True, delete_orphans=True, batch_size=APPLY_BATCH_SIZE, snapshot_path=None):
+    """
+    Brings the Dynamic Security Plugin in line with the MqttMetaData and MqttClient rows
+    (the database is the source of truth). Returns (diff, failed commands).
+
+    With 'snapshot_path' the broker state is read from that configuration file of the plugin instead and
+    the diff is only reported.
+    """
+    expected_state = load_expected_state()
+    if snapshot_path is not None:
+        broker_clients, broker_roles = snapshot_broker_state(DynSecSnapshot(snapshot_path))
+        return compute_diff(broker_clients, broker_roles, expected_state), []
+    with dynsec_manager.session() as dynsec:
+        broker_clients, broker_roles = fetch_broker_state(dynsec)
+        diff = compute_diff(broker_clients, broker_roles, expected_state)
+        failed = []
+        if apply and not diff.is_empty():
+            if delete_orphans and (diff.orphaned_clients or diff.orphaned_roles):
+                time.sleep(ORPHAN_GRACE_SECONDS)
+                drop_new_orphans(diff)
+            failed = apply_diff(dynsec, diff, delete_orphans=delete_orphans, batch_size=batch_size)
+    return diff, failed
@@ -1,5 +1,7 @@
 import users.models
-from .mosquitto_dynsec import MosquittoDynSec
+from asgiref.sync import sync_to_async
+from .mosquitto_dynsec import DynSecConnectionManager, AsyncDynSecConnectionManager, DynSecCircuitBreaker
+from .identifier_allocator import create_with_unique_retry
 from django.db import transaction, IntegrityError
 from enum import Enum, unique
 from biomed_iot.config_loader import config
@@ -7,158 +9,176 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Broker health shared by the sync and async sessions: fail fast for 30 s after 3 consecutive failures
+dynsec_breaker = DynSecCircuitBreaker(failure_threshold=3, cooldown_seconds=30)
+# One Dynamic Security session per process, shared by all managers below
+# Optional in-memory mirror of the DSP state, e.g. DYNSEC_CACHE_MAX_AGE_SECONDS = "60" in the [mosquitto] section
+_cache_max_age = getattr(config.mosquitto, 'DYNSEC_CACHE_MAX_AGE_SECONDS', None)
+dynsec_manager = DynSecConnectionManager(
+    config.mosquitto.DYNSEC_ADMIN_USER,
+    config.mosquitto.DYNSEC_ADMIN_PW,
+    cache_max_age_seconds=int(_cache_max_age) if _cache_max_age else None,
+    breaker=dynsec_breaker,
+)
+# and one per event loop for async views
+async_dynsec_manager = AsyncDynSecConnectionManager(
+    config.mosquitto.DYNSEC_ADMIN_USER, config.mosquitto.DYNSEC_ADMIN_PW, breaker=dynsec_breaker
+)
+
 @unique
 class RoleType(Enum):
     DEVICE = 'device'
     NODERED = 'nodered'
     INOUT = 'inout'
 
+
+def nodered_role_acls(user_topic_id):
+    # Node-RED receives the messages of the user's devices and publishes to them
+    return [
+        {'acltype': 'subscribePattern', 'topic': f'in/{user_topic_id}/#', 'priority': -1, 'allow': True},
+        {'acltype': 'publishClientSend', 'topic': f'out/{user_topic_id}/#', 'priority': -1, 'allow': True},
+    ]
+
+
+def device_role_acls(user_topic_id):
+    return [
+        {'acltype': 'subscribePattern', 'topic': f'out/{user_topic_id}/#', 'priority': -1, 'allow': True},
+        {'acltype': 'publishClientSend', 'topic': f'in/{user_topic_id}/#', 'priority': -1, 'allow': True},
+    ]
+
+
+def inout_role_acls(user_topic_id):
+    return [
+        {'acltype': 'publishClientSend', 'topic': f'inout/{user_topic_id}/#', 'priority': -1, 'allow': True},
+        {'acltype': 'subscribePattern', 'topic': f'inout/{user_topic_id}/#', 'priority': -1, 'allow': True},
+    ]
+
+
+def role_for_type(mqtt_meta_data, role_type):
+    """Returns (rolename, acls) of the user's role for a RoleType value; anything else is the Node-RED role."""
+    user_topic_id = mqtt_meta_data.user_topic_id
+    if role_type == RoleType.INOUT.value:
+        return mqtt_meta_data.inout_role_name, inout_role_acls(user_topic_id)
+    if role_type == RoleType.DEVICE.value:
+        return mqtt_meta_data.device_role_name, device_role_acls(user_topic_id)
+    return mqtt_meta_data.nodered_role_name, nodered_role_acls(user_topic_id)
+
+
+def role_not_found(response_entry):
+    """True if a DSP reply says that a referenced role does not exist (e.g. createClient with a deleted role)."""
+    return bool(response_entry) and 'Role not found' in response_entry.get('error', '')
+
+
 class MqttMetaDataManager:
     def __init__(self, user):
         self.user = user
         self.metadata = self._get_or_create_mqtt_meta_data()
-        self.dynsec_username = config.mosquitto.DYNSEC_ADMIN_USER
-        self.dynsec_password = config.mosquitto.DYNSEC_ADMIN_PW
 
     def _get_or_create_mqtt_meta_data(self):
-        meta_data = None
-        with transaction.atomic():
-            try:
-                user_topic_id, nodered_role_name, device_role_name, inout_role_name = (
-                    users.models.MqttMetaData.generate_unique_mqtt_metadata()
-                )
-                meta_data, created = users.models.MqttMetaData.objects.get_or_create(
-                    user=self.user,
-                    defaults={
-                        'user_topic_id': user_topic_id,
-                        'nodered_role_name': nodered_role_name,
-                        'device_role_name': device_role_name,
-                        'inout_role_name': inout_role_name,
-                    },
-                )
-            except IntegrityError:
-                logger.error('IntegrityError while creating MqttMetaData. Check if it already exists.')
-        return meta_data
+        # Most calls find existing metadata, so identifiers are only allocated for new users
+        meta_data = users.models.MqttMetaData.objects.filter(user=self.user).first()
+        if meta_data is not None:
+            return meta_data
+
+        def create():
+            user_topic_id, nodered_role_name, device_role_name, inout_role_name = (
+                users.models.MqttMetaData.generate_unique_mqtt_metadata()
+            )
+            meta_data, created = users.models.MqttMetaData.objects.get_or_create(
+                user=self.user,
+                defaults={
+                    'user_topic_id': user_topic_id,
+                    'nodered_role_name': nodered_role_name,
+                    'device_role_name': device_role_name,
+                    'inout_role_name': inout_role_name,
+                },
+            )
+            return meta_data
+
+        try:
+            return create_with_unique_retry(create)
+        except IntegrityError:
+            logger.error('IntegrityError while creating MqttMetaData. Check if it already exists.')
+        return None
+
+    def role_definitions(self):
+        """Returns (rolename, acls) for the Node-RED, device and in/out role of the user."""
+        return self.role_definitions_for(self.metadata)
+
+    @staticmethod
+    def role_definitions_for(metadata):
+        user_topic_id = metadata.user_topic_id
+        return [
+            (metadata.nodered_role_name, nodered_role_acls(user_topic_id)),
+            (metadata.device_role_name, device_role_acls(user_topic_id)),
+            (metadata.inout_role_name, inout_role_acls(user_topic_id)),
+        ]
+
+    def mark_roles_created(self, rolenames, created=True):
+        """Persists whether the given roles of the user exist at the broker."""
+        fields = [self.metadata.role_created_field(rolename) for rolename in rolenames]
+        fields = [field for field in fields if field and getattr(self.metadata, field) != created]
+        for field in fields:
+            setattr(self.metadata, field, created)
+        if fields:
+            self.metadata.save(update_fields=fields)
+
+    def _create_role(self, rolename, acls, description, force=False):
+        # Roles known to exist are not created again unless 'force' is set (e.g. after 'Role not found')
+        if not force and self.metadata.is_role_created(rolename):
+            return True
+        success = False
+        try:
+            with dynsec_manager.session() as dynsec:
+                success, _, _ = dynsec.create_role(rolename, acls=acls)
+            if success:
+                self.mark_roles_created([rolename])
+            else:
+                logger.error(f"Failed to create {description} role: {rolename}")
+        except Exception as e:
+            logger.error(f"Exception during {description} role creation: {e}")
+        return success
+
+    def recreate_role(self, rolename):
+        """Creates one of the user's roles at the broker even if it is marked as created."""
+        for known_rolename, acls in self.role_definitions():
+            if known_rolename == rolename:
+                return self._create_role(rolename, acls, 'missing', force=True)
+        return False
 
     def create_nodered_role(self):
         success = False
         if self.metadata:
-            nodered_sub_topic = f'in/{self.metadata.user_topic_id}/#'
-            nodered_pub_topic = f'out/{self.metadata.user_topic_id}/#'
-            try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.create_role(
-                        self.metadata.nodered_role_name,
-                        acls=[
-                            {
-                                'acltype': 'subscribePattern',
-                                'topic': nodered_sub_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                            {
-                                'acltype': 'publishClientSend',
-                                'topic': nodered_pub_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                        ],
-                    )
-                    if not success:
-                        logger.error(f"Failed to create Node-RED role: {self.metadata.nodered_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during Node-RED role creation: {e}")
-                finally:
-                    dynsec.disconnect()
-            except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for Node-RED role creation: {e}")
+            acls = nodered_role_acls(self.metadata.user_topic_id)
+            success = self._create_role(self.metadata.nodered_role_name, acls, 'Node-RED')
         return success
 
     def create_device_role(self):
         success = False
         if self.metadata:
-            device_sub_topic = f'out/{self.metadata.user_topic_id}/#'
-            device_pub_topic = f'in/{self.metadata.user_topic_id}/#'
-            try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.create_role(
-                        self.metadata.device_role_name,
-                        acls=[
-                            {
-                                'acltype': 'subscribePattern',
-                                'topic': device_sub_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                            {
-                                'acltype': 'publishClientSend',
-                                'topic': device_pub_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                        ],
-                    )
-                    if not success:
-                        logger.error(f"Failed to create device role: {self.metadata.device_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during device role creation: {e}")
-                finally:
-                    dynsec.disconnect()
-            except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for device role creation: {e}")
+            acls = device_role_acls(self.metadata.user_topic_id)
+            success = self._create_role(self.metadata.device_role_name, acls, 'device')
         return success
 
     def create_inout_role(self):
         success = False
         if self.metadata:
-            inout_topic = f'inout/{self.metadata.user_topic_id}/#'
-            try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.create_role(
-                        self.metadata.inout_role_name,
-                        acls=[
-                            {
-                                'acltype': 'publishClientSend',
-                                'topic': inout_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                            {
-                                'acltype': 'subscribePattern',
-                                'topic': inout_topic,
-                                'priority': -1,
-                                'allow': True,
-                            },
-                        ],
-                    )
-                    if not success:
-                        logger.error(f"Failed to create in/out role: {self.metadata.inout_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during in/out role creation: {e}")
-                finally:
-                    dynsec.disconnect()
-            except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for in/out role creation: {e}")
+            acls = inout_role_acls(self.metadata.user_topic_id)
+            success = self._create_role(self.metadata.inout_role_name, acls, 'in/out')
         return success
 
     def delete_inout_role(self):
         success = False
         if self.metadata:
             try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.delete_role(self.metadata.inout_role_name)
-                    if not success:
-                        logger.error(f"Failed to delete in/out role: {self.metadata.inout_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during delete_role for in/out: {e}")
-                finally:
-                    dynsec.disconnect()
+                with dynsec_manager.session() as dynsec:
+                    success, _, _ = dynsec.delete_role(self.metadata.inout_role_name)
+                if success:
+                    self.mark_roles_created([self.metadata.inout_role_name], created=False)
+                else:
+                    logger.error(f"Failed to delete in/out role: {self.metadata.inout_role_name}")
             except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for in/out role deletion: {e}")
+                logger.error(f"Exception during delete_role for in/out: {e}")
         return success
 
 
@@ -167,17 +187,14 @@ class MqttMetaDataManager:
         if self.metadata:
             nodered_role_name = self.metadata.nodered_role_name
             try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.delete_role(nodered_role_name)
-                    if not success:
-                        logger.error(f"Failed to delete Node-RED role: {nodered_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during delete_role for Node-RED: {e}")
-                finally:
-                    dynsec.disconnect()
+                with dynsec_manager.session() as dynsec:
+                    success, _, _ = dynsec.delete_role(nodered_role_name)
+                if success:
+                    self.mark_roles_created([nodered_role_name], created=False)
+                else:
+                    logger.error(f"Failed to delete Node-RED role: {nodered_role_name}")
             except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for Node-RED role deletion: {e}")
+                logger.error(f"Exception during delete_role for Node-RED: {e}")
         return success
 
     def delete_device_role(self):
@@ -185,71 +202,81 @@ class MqttMetaDataManager:
         if self.metadata:
             device_role_name = self.metadata.device_role_name
             try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.delete_role(device_role_name)
-                    if not success:
-                        logger.error(f"Failed to delete device role: {device_role_name}")
-                except Exception as e:
-                    logger.error(f"Exception during delete_role for device: {e}")
-                finally:
-                    dynsec.disconnect()
+                with dynsec_manager.session() as dynsec:
+                    success, _, _ = dynsec.delete_role(device_role_name)
+                if success:
+                    self.mark_roles_created([device_role_name], created=False)
+                else:
+                    logger.error(f"Failed to delete device role: {device_role_name}")
             except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for device role deletion: {e}")
+                logger.error(f"Exception during delete_role for device: {e}")
         return success
 
 class MqttClientManager:
     def __init__(self, user):
         self.user = user
-        self.dynsec_username = config.mosquitto.DYNSEC_ADMIN_USER
-        self.dynsec_password = config.mosquitto.DYNSEC_ADMIN_PW
 
     def create_client(self, textname='New Device', role_type=None):
+        """
+        Creates a MQTT client of the given RoleType at the broker (and its role unless it is marked as created,
+        in the same batch) and stores its row. Returns True on success.
+        """
         new_username = users.models.MqttClient.generate_unique_username()
         new_password = users.models.MqttClient.generate_password()
         success = False
 
         try:
             mqtt_meta_data = users.models.MqttMetaData.objects.get(user=self.user)
-            meta_manager = MqttMetaDataManager(self.user)
-
-            if role_type == RoleType.INOUT.value:
-                meta_manager.create_inout_role()
-                rolename = mqtt_meta_data.inout_role_name
-            elif role_type == RoleType.DEVICE.value:
-                meta_manager.create_device_role()
-                rolename = mqtt_meta_data.device_role_name
-            else:
+            if role_type not in (RoleType.INOUT.value, RoleType.DEVICE.value):
                 textname = 'Node-RED MQTT Credentials'
-                meta_manager.create_nodered_role()
-                rolename = mqtt_meta_data.nodered_role_name
-
-            dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
+            rolename, acls = role_for_type(mqtt_meta_data, role_type)
             try:
-                success = dynsec.create_client(
-                    new_username,
-                    new_password,
-                    textname=textname,
-                    roles=[{'rolename': rolename, 'priority': -1}]
-                )
+                success = self._create_at_broker(mqtt_meta_data, rolename, acls, new_username, new_password, textname)
             except Exception as e:
                 logger.error(f"Exception during create_client in MosquittoDynSec: {e}")
-            finally:
-                dynsec.disconnect()
 
         except users.models.MqttMetaData.DoesNotExist:
             logger.error('MqttMetaData does not exist for the user.')
-        except IntegrityError as e:
-            logger.error(f'Database error when creating MQTT client: {e}')
 
         if success:
-            users.models.MqttClient.objects.create(
-                user=self.user,
-                username=new_username,
-                password=new_password,
-                textname=textname,
-                rolename=rolename,
-            )
+            try:
+                users.models.MqttClient.objects.create(
+                    user=self.user,
+                    username=new_username,
+                    password=new_password,
+                    textname=textname,
+                    rolename=rolename,
+                )
+            except IntegrityError as e:
+                logger.error(f'Database error when creating MQTT client: {e}')
+                success = False
+        return success
+
+    def _create_at_broker(self, mqtt_meta_data, rolename, acls, username, password, textname):
+        # Creates the client (and its role unless it is marked as created) in one batch
+        role_created = mqtt_meta_data.is_role_created(rolename)
+        with dynsec_manager.session() as dynsec:
+            for attempt in range(2):
+                with dynsec.batch() as batch:
+                    if not role_created:
+                        role_index = batch.create_role(rolename, acls=acls)
+                    client_index = batch.create_client(
+                        username,
+                        password,
+                        textname=textname,
+                        roles=[{'rolename': rolename, 'priority': -1}]
+                    )
+                success, response_entry = batch.results[client_index]
+                if not role_created and batch.results[role_index][0]:
+                    role_created = True
+                    users.models.MqttMetaData.objects.filter(pk=mqtt_meta_data.pk).update(
+                        **{mqtt_meta_data.role_created_field(rolename): True}
+                    )
+                # The role was marked as created but is gone at the broker: create it and retry once
+                if success or attempt or not role_not_found(response_entry):
+                    break
+                role_created = False
+        return success
 
     # def create_client(self, textname='New Device', role_type=None):
     #     new_username = users.models.MqttClient.generate_unique_username()
@@ -292,20 +319,206 @@ class MqttClientManager:
     #     except IntegrityError as e:
     #         logger.error(f'Database error when creating MQTT client: {e}')
 
+    async def acreate_client(self, textname='New Device', role_type=None):
+        """
+        Async version of create_client() for async views. The role and the client are created in one
+        batch on the event loop (used by adevices() when the app is served over ASGI).
+        """
+        new_username = await sync_to_async(users.models.MqttClient.generate_unique_username)()
+        new_password = users.models.MqttClient.generate_password()
+        success = False
+
+        try:
+            mqtt_meta_data = await users.models.MqttMetaData.objects.aget(user=self.user)
+            if role_type not in (RoleType.INOUT.value, RoleType.DEVICE.value):
+                textname = 'Node-RED MQTT Credentials'
+            rolename, acls = role_for_type(mqtt_meta_data, role_type)
+            try:
+                success = await self._acreate_at_broker(
+                    mqtt_meta_data, rolename, acls, new_username, new_password, textname
+                )
+            except Exception as e:
+                logger.error(f"Exception during create_client in AsyncMosquittoDynSec: {e}")
+
+        except users.models.MqttMetaData.DoesNotExist:
+            logger.error('MqttMetaData does not exist for the user.')
+
+        if success:
+            try:
+                await users.models.MqttClient.objects.acreate(
+                    user=self.user,
+                    username=new_username,
+                    password=new_password,
+                    textname=textname,
+                    rolename=rolename,
+                )
+            except IntegrityError as e:
+                logger.error(f'Database error when creating MQTT client: {e}')
+                success = False
+        return success
+
+    async def _acreate_at_broker(self, mqtt_meta_data, rolename, acls, username, password, textname):
+        # Creates the client (and its role unless it is marked as created) in one batch
+        role_created = mqtt_meta_data.is_role_created(rolename)
+        async with async_dynsec_manager.session() as dynsec:
+            for attempt in range(2):
+                async with dynsec.batch() as batch:
+                    if not role_created:
+                        role_index = batch.create_role(rolename, acls=acls)
+                    client_index = batch.create_client(
+                        username,
+                        password,
+                        textname=textname,
+                        roles=[{'rolename': rolename, 'priority': -1}]
+                    )
+                success, response_entry = batch.results[client_index]
+                if not role_created and batch.results[role_index][0]:
+                    role_created = True
+                    await users.models.MqttMetaData.objects.filter(pk=mqtt_meta_data.pk).aupdate(
+                        **{mqtt_meta_data.role_created_field(rolename): True}
+                    )
+                # The role was marked as created but is gone at the broker: create it and retry once
+                if success or attempt or not role_not_found(response_entry):
+                    break
+                role_created = False
+        return success
+
+    def create_clients(self, specs):
+        """
+        Bulk version of create_client() for many devices at once (e.g. a CSV upload).
+
+        'specs' is a list of (textname, role_type) tuples. Usernames are allocated in bulk, the needed roles
+        and all clients are created in one DSP batch and the rows are inserted with one bulk_create.
+        Returns one dict per spec with 'textname', 'username' (None on failure), 'success' and 'error'.
+        """
+        results = [{'textname': textname, 'username': None, 'success': False, 'error': ''} for textname, _ in specs]
+        if not specs:
+            return results
+        try:
+            mqtt_meta_data = users.models.MqttMetaData.objects.get(user=self.user)
+        except users.models.MqttMetaData.DoesNotExist:
+            logger.error('MqttMetaData does not exist for the user.')
+            return self._fail_all(results, 'MQTT metadata missing')
+
+        usernames = users.models.MqttClient.generate_unique_usernames(len(specs))
+        if usernames is None:
+            return self._fail_all(results, 'No free usernames')
+        new_clients = self._new_client_rows(mqtt_meta_data, specs, usernames)
+
+        try:
+            client_results = self._create_clients_at_broker(mqtt_meta_data, new_clients)
+        except Exception as e:
+            logger.error(f"Exception during create_clients in MosquittoDynSec: {e}")
+            return self._fail_all(results, 'Broker not reachable')
+
+        created = []
+        for result, client in zip(results, new_clients):
+            success, response_entry = client_results[client.username]
+            if success:
+                created.append((result, client))
+            else:
+                result['error'] = (response_entry or {}).get('error', 'No response from broker')
+                logger.error(f'Failed to create MQTT client {client.username}: {response_entry}')
+
+        if not self._insert_created_clients([client for _, client in created]):
+            self._fail_all([result for result, _ in created], 'Database error')
+            return results
+
+        for result, client in created:
+            result['username'] = client.username
+            result['success'] = True
+        return results
+
+    @staticmethod
+    def _fail_all(results, error):
+        for result in results:
+            result['error'] = error
+        return results
+
+    def _new_client_rows(self, mqtt_meta_data, specs, usernames):
+        # Unsaved MqttClient rows for the specs; unknown role types get the device role
+        known_role_types = (RoleType.DEVICE.value, RoleType.INOUT.value, RoleType.NODERED.value)
+        new_clients = []
+        for (textname, role_type), username in zip(specs, usernames):
+            role_type = role_type if role_type in known_role_types else RoleType.DEVICE.value
+            new_clients.append(users.models.MqttClient(
+                user=self.user,
+                username=username,
+                password=users.models.MqttClient.generate_password(),
+                textname=textname,
+                rolename=role_for_type(mqtt_meta_data, role_type)[0],
+            ))
+        return new_clients
+
+    def _create_clients_at_broker(self, mqtt_meta_data, new_clients):
+        # Returns {username: (success, response_entry)}, raises if the broker cannot be reached
+        meta_manager = MqttMetaDataManager(self.user)
+        role_acls = dict(meta_manager.role_definitions_for(mqtt_meta_data))
+        client_results = {}
+        pending_clients = new_clients
+        with dynsec_manager.session() as dynsec:
+            for attempt in range(2):
+                # Roles that are not known to exist are created in the same batch, before the clients
+                missing_roles = {
+                    client.rolename for client in pending_clients
+                    if not meta_manager.metadata.is_role_created(client.rolename)
+                }
+                with dynsec.batch() as batch:
+                    role_indexes = {
+                        rolename: batch.create_role(rolename, acls=role_acls[rolename])
+                        for rolename in missing_roles
+                    }
+                    client_indexes = [
+                        batch.create_client(
+                            client.username,
+                            client.password,
+                            textname=client.textname,
+                            roles=[{'rolename': client.rolename, 'priority': -1}],
+                        )
+                        for client in pending_clients
+                    ]
+                meta_manager.mark_roles_created(
+                    [rolename for rolename, index in role_indexes.items() if batch.results[index][0]]
+                )
+                for client, index in zip(pending_clients, client_indexes):
+                    client_results[client.username] = batch.results[index]
+
+                # Roles marked as created but gone at the broker: create them and retry their clients once
+                pending_clients = [
+                    client for client in pending_clients if role_not_found(client_results[client.username][1])
+                ]
+                if attempt or not pending_clients:
+                    break
+                meta_manager.mark_roles_created({client.rolename for client in pending_clients}, created=False)
+        return client_results
+
+    @staticmethod
+    def _insert_created_clients(clients):
+        # Inserts the rows of the clients created at the broker, or deletes them there again if that fails
+        try:
+            with transaction.atomic():
+                users.models.MqttClient.objects.bulk_create(clients)
+            return True
+        except IntegrityError as e:
+            logger.error(f'Database error when creating MQTT clients: {e}')
+        # Do not leave clients at the broker that have no row (and thus no visible credentials)
+        try:
+            with dynsec_manager.session() as dynsec:
+                with dynsec.batch() as batch:
+                    for client in clients:
+                        batch.delete_client(client.username)
+        except Exception as e:
+            logger.error(f"Exception during cleanup of MQTT clients in MosquittoDynSec: {e}")
+        return False
+
     def modify_client(self, client_username, textname='New MQTT Device'):
         try:
             mqtt_client = users.models.MqttClient.objects.get(username=client_username, user=self.user)
             try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.modify_client(client_username, textname=textname)
-                except Exception as e:
-                    logger.error(f"Exception during modify_client in MosquittoDynSec: {e}")
-                    success = False
-                finally:
-                    dynsec.disconnect()
+                with dynsec_manager.session() as dynsec:
+                    success, _, _ = dynsec.modify_client(client_username, textname=textname)
             except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for modifying client: {e}")
+                logger.error(f"Exception during modify_client in MosquittoDynSec: {e}")
                 success = False
 
             if success:
@@ -321,16 +534,10 @@ class MqttClientManager:
         try:
             mqtt_client = users.models.MqttClient.objects.get(username=client_username, user=self.user)
             try:
-                dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-                try:
-                    success = dynsec.delete_client(client_username)
-                except Exception as e:
-                    logger.error(f"Exception during delete_client in MosquittoDynSec: {e}")
-                    success = False
-                finally:
-                    dynsec.disconnect()
+                with dynsec_manager.session() as dynsec:
+                    success, _, _ = dynsec.delete_client(client_username)
             except Exception as e:
-                logger.error(f"Error initializing MosquittoDynSec for client deletion: {e}")
+                logger.error(f"Exception during delete_client in MosquittoDynSec: {e}")
                 success = False
 
             if success:
@@ -343,22 +550,57 @@ class MqttClientManager:
             logger.error(f'MQTT client {client_username} not found for the user.')
         return False
 
-    def delete_all_clients_for_user(self):
-        all_clients = users.models.MqttClient.objects.filter(user=self.user)
+    async def adelete_client(self, client_username):
+        """Async version of delete_client() for async views."""
         try:
-            dynsec = MosquittoDynSec(self.dynsec_username, self.dynsec_password)
-            for client in all_clients:
-                try:
-                    success = dynsec.delete_client(client.username)
-                    if success:
-                        logger.info(f'MQTT client {client.username} deleted from dynamic security system successfully.')
-                    else:
-                        logger.error(f'Failed to delete MQTT client {client.username} from dynamic security system.')
-                except Exception as e:
-                    logger.error(f"Exception during deletion of client {client.username}: {e}")
-            dynsec.disconnect()
-        except Exception as e:
-            logger.error(f"Error initializing MosquittoDynSec for deleting all clients: {e}")
+            mqtt_client = await users.models.MqttClient.objects.aget(username=client_username, user=self.user)
+            try:
+                async with async_dynsec_manager.session() as dynsec:
+                    success, _, _ = await dynsec.delete_client(client_username)
+            except Exception as e:
+                logger.error(f"Exception during delete_client in AsyncMosquittoDynSec: {e}")
+                success = False
+
+            if success:
+                await mqtt_client.adelete()
+                logger.info(f'MQTT client {client_username} deleted successfully.')
+                return True
+            else:
+                logger.error(f'Failed to delete MQTT client {client_username} from dynamic security system.')
+        except users.models.MqttClient.DoesNotExist:
+            logger.error(f'MQTT client {client_username} not found for the user.')
+        return False
+
+    def delete_all_clients_for_user(self, delete_roles=True):
+        """
+        Deletes all MQTT clients of the user (and the user's three roles if 'delete_roles') from the Dynamic
+        Security Plugin in one batch, then removes the rows of the deleted clients with one queryset delete.
+        Clients and roles the broker does not know (anymore) count as deleted.
+
+        Returns a report dict: 'deleted_clients' and 'deleted_roles' (lists of names), 'failed_clients' and
+        'failed_roles' ({name: error}). Rows of failed clients are kept so the teardown can be repeated.
+        """
+        report = {'deleted_clients': [], 'failed_clients': {}, 'deleted_roles': [], 'failed_roles': {}}
+        client_usernames = list(
+            users.models.MqttClient.objects.filter(user=self.user).values_list('username', flat=True)
+        )
+        metadata = users.models.MqttMetaData.objects.filter(user=self.user).first() if delete_roles else None
+        rolenames = (
+            [metadata.nodered_role_name, metadata.device_role_name, metadata.inout_role_name] if metadata else []
+        )
+        if not client_usernames and not rolenames:
+            return report
+
+        report = delete_dynsec_clients_and_roles(client_usernames, rolenames)
+        if report['deleted_clients']:
+            users.models.MqttClient.objects.filter(
+                user=self.user, username__in=report['deleted_clients']
+            ).delete()
+        if metadata and report['deleted_roles']:
+            users.models.MqttMetaData.objects.filter(pk=metadata.pk).update(
+                **{metadata.role_created_field(rolename): False for rolename in report['deleted_roles']}
+            )
+        return report
 
     def get_device_clients(self):
         try:
@@ -381,3 +623,228 @@ class MqttClientManager:
         except users.models.MqttMetaData.DoesNotExist:
             logger.error('MqttMetaData not found for the user.')
             return None
+
+
+def create_mqtt_user_resources(user):
+    """
+    Creates the Node-RED, device and in/out role of a new user together with the Node-RED client and an
+    example device client in a single Dynamic Security round trip.
+
+    Can be called again after a partial failure: roles flagged as created and clients that already have a row
+    are skipped, so only the missing ones are created. Returns True if all of them exist afterwards.
+    """
+    meta_manager = MqttMetaDataManager(user)
+    if not meta_manager.metadata:
+        logger.error('MqttMetaData could not be created for the user.')
+        return False
+    metadata = meta_manager.metadata
+
+    existing_clients = set(users.models.MqttClient.objects.filter(user=user).values_list('textname', 'rolename'))
+    new_clients = [client for client in _user_client_specs(metadata) if client not in existing_clients]
+    if not new_clients and all(metadata.is_role_created(rolename) for rolename, _ in meta_manager.role_definitions()):
+        return True
+    usernames = users.models.MqttClient.generate_unique_usernames(len(new_clients)) if new_clients else []
+    if usernames is None:
+        logger.error('Could not allocate the MQTT client usernames for the user.')
+        return False
+    client_data = [
+        (username, users.models.MqttClient.generate_password(), textname, rolename)
+        for username, (textname, rolename) in zip(usernames, new_clients)
+    ]
+
+    with dynsec_manager.session() as dynsec:
+        with dynsec.batch() as batch:
+            role_indexes, client_indexes = _queue_user_resources(batch, metadata, client_data)
+    created_clients = []
+    success = _collect_user_results(batch, metadata, role_indexes, client_indexes, client_data, created_clients)
+    metadata.save(update_fields=['nodered_role_created', 'device_role_created', 'inout_role_created'])
+    if created_clients and not MqttClientManager._insert_created_clients(created_clients):
+        success = False
+    return success
+
+
+def delete_dynsec_clients_and_roles(client_usernames, rolenames):
+    """
+    Deletes the given clients and roles from the Dynamic Security Plugin in one batch (database rows are not
+    touched). Clients and roles the broker does not know (anymore) count as deleted.
+
+    Returns a report dict: 'deleted_clients' and 'deleted_roles' (lists of names), 'failed_clients' and
+    'failed_roles' ({name: error}).
+    """
+    report = {'deleted_clients': [], 'failed_clients': {}, 'deleted_roles': [], 'failed_roles': {}}
+    if not client_usernames and not rolenames:
+        return report
+    try:
+        with dynsec_manager.session() as dynsec:
+            with dynsec.batch() as batch:
+                # Clients first: a role can only be deleted cleanly once no client references it
+                for username in client_usernames:
+                    batch.delete_client(username)
+                for rolename in rolenames:
+                    batch.delete_role(rolename)
+        results = batch.results
+    except Exception as e:
+        logger.error(f"Error connecting to MosquittoDynSec for deleting clients and roles: {e}")
+        results = [(False, {'error': f'Broker not reachable: {e}'})] * (len(client_usernames) + len(rolenames))
+
+    names = [('clients', username) for username in client_usernames] + [('roles', name) for name in rolenames]
+    for (kind, name), (success, response_entry) in zip(names, results):
+        error = (response_entry or {}).get('error', 'No response from broker')
+        if success or 'not found' in error:
+            report[f'deleted_{kind}'].append(name)
+        else:
+            report[f'failed_{kind}'][name] = error
+            logger.error(f'Failed to delete MQTT {kind[:-1]} {name} from dynamic security system: {error}')
+    return report
+
+
+# Users whose roles and clients are created in one DSP round trip by create_mqtt_resources_for_users()
+# (5 commands per user)
+BULK_USERS_PER_BATCH = 100
+
+
+def create_mqtt_resources_for_users(user_list, users_per_batch=BULK_USERS_PER_BATCH):
+    """
+    Bulk version of create_mqtt_user_resources() for many users at once (e.g. manage.py import_users).
+
+    MqttMetaData rows and client usernames are allocated and inserted in bulk, and the roles and clients of
+    'users_per_batch' users are created per DSP round trip. Can be called again for the same users: roles
+    flagged as created and clients that already have a row are skipped, so only the missing ones are created.
+    Returns the ids of the users whose resources all exist afterwards.
+    """
+    MqttMetaData = users.models.MqttMetaData
+    MqttClient = users.models.MqttClient
+    user_list = list(user_list)
+    existing = set(MqttMetaData.objects.filter(user__in=user_list).values_list('user_id', flat=True))
+    new_users = [user for user in user_list if user.pk not in existing]
+
+    def create_metadata():
+        metadata_values = MqttMetaData.generate_unique_mqtt_metadata_bulk(len(new_users))
+        if metadata_values is None:
+            raise RuntimeError(f'Could not allocate {len(new_users)} unique MQTT topic ids')
+        MqttMetaData.objects.bulk_create([
+            MqttMetaData(
+                user=user,
+                user_topic_id=user_topic_id,
+                nodered_role_name=nodered_role_name,
+                device_role_name=device_role_name,
+                inout_role_name=inout_role_name,
+            )
+            for user, (user_topic_id, nodered_role_name, device_role_name, inout_role_name)
+            in zip(new_users, metadata_values)
+        ])
+
+    if new_users:
+        create_with_unique_retry(create_metadata)
+
+    metadata_list = list(MqttMetaData.objects.filter(user__in=user_list))
+    existing_clients = set(
+        MqttClient.objects.filter(user__in=user_list).values_list('user_id', 'textname', 'rolename')
+    )
+    missing_clients = {
+        metadata.user_id: [
+            (textname, rolename)
+            for textname, rolename in _user_client_specs(metadata)
+            if (metadata.user_id, textname, rolename) not in existing_clients
+        ]
+        for metadata in metadata_list
+    }
+    missing_count = sum(len(clients) for clients in missing_clients.values())
+    usernames = iter((MqttClient.generate_unique_usernames(missing_count) or []) if missing_count else [])
+    client_data = {
+        user_id: [
+            (next(usernames, None), MqttClient.generate_password(), textname, rolename)
+            for textname, rolename in clients
+        ]
+        for user_id, clients in missing_clients.items()
+        if clients
+    }
+    if any(username is None for clients in client_data.values() for username, _, _, _ in clients):
+        logger.error(f'Could not allocate the MQTT client usernames for {len(client_data)} users')
+        return set()
+
+    succeeded = set()
+    role_fields = ['nodered_role_created', 'device_role_created', 'inout_role_created']
+    with dynsec_manager.session() as dynsec:
+        for start in range(0, len(metadata_list), users_per_batch):
+            chunk = metadata_list[start:start + users_per_batch]
+            indexes = {}
+            with dynsec.batch() as batch:
+                for metadata in chunk:
+                    indexes[metadata.user_id] = _queue_user_resources(
+                        batch, metadata, client_data.get(metadata.user_id, [])
+                    )
+
+            new_clients = []
+            for metadata in chunk:
+                role_indexes, client_indexes = indexes[metadata.user_id]
+                if _collect_user_results(
+                    batch, metadata, role_indexes, client_indexes, client_data.get(metadata.user_id, []), new_clients
+                ):
+                    succeeded.add(metadata.user_id)
+
+            MqttMetaData.objects.bulk_update(chunk, role_fields)
+            if new_clients and not MqttClientManager._insert_created_clients(new_clients):
+                succeeded.difference_update(client.user_id for client in new_clients)
+    return succeeded
+
+
+def _user_client_specs(metadata):
+    # (textname, rolename) of the clients every user gets: Node-RED and an example device
+    return [
+        ('Node-RED MQTT Credentials', metadata.nodered_role_name),
+        ('Example Device', metadata.device_role_name),
+    ]
+
+
+def _queue_user_resources(batch, metadata, clients):
+    # Adds the roles not flagged as created and the given (username, password, textname, rolename) clients
+    # of one user to the batch. Returns ({rolename: index}, [index]).
+    role_indexes = {
+        rolename: batch.create_role(rolename, acls=acls)
+        for rolename, acls in MqttMetaDataManager.role_definitions_for(metadata)
+        if not metadata.is_role_created(rolename)
+    }
+    client_indexes = [
+        batch.create_client(username, password, textname=textname, roles=[{'rolename': rolename, 'priority': -1}])
+        for username, password, textname, rolename in clients
+    ]
+    return role_indexes, client_indexes
+
+
+def _collect_user_results(batch, metadata, role_indexes, client_indexes, clients, new_clients):
+    # Sets the role flags of 'metadata' and appends the rows of the created clients to 'new_clients'.
+    # Returns True if all roles and clients of the user exist.
+    success = True
+    for rolename, index in role_indexes.items():
+        created, response_entry = batch.results[index] if batch.results else (False, None)
+        # A role of an earlier, interrupted run may exist without its flag
+        if created or (response_entry and 'already exists' in response_entry.get('error', '')):
+            setattr(metadata, metadata.role_created_field(rolename), True)
+        else:
+            logger.error(f'Creating role {rolename} failed: {response_entry}')
+            success = False
+    for index, (username, password, textname, rolename) in zip(client_indexes, clients):
+        created, response_entry = batch.results[index] if batch.results else (False, None)
+        if created:
+            new_clients.append(users.models.MqttClient(
+                user_id=metadata.user_id,
+                username=username,
+                password=password,
+                textname=textname,
+                rolename=rolename,
+            ))
+        else:
+            logger.error(f'Creating MQTT client {username} failed: {response_entry}')
+            success = False
+    return success
+
+
+def delete_mqtt_user_resources(user):
+    """
+    Deletes all MQTT clients and the three roles of a user from the Dynamic Security Plugin in a single
+    round trip, together with the client rows (see MqttClientManager.delete_all_clients_for_user()).
+    Returns True if everything was deleted.
+    """
+    report = MqttClientManager(user).delete_all_clients_for_user()
+    return not report['failed_clients'] and not report['failed_roles']
@@ -1,5 +1,6 @@
 # Utility functions for Nodered
 import os
+import re
 import subprocess
 import logging
 import bcrypt
@@ -14,6 +15,13 @@ import jwt
 
 logger = logging.getLogger(__name__)
 
+# Image of the per-user containers and directory of their nginx location blocks (one <container_name>.conf each)
+NODERED_IMAGE = 'custom-node-red'
+NODERED_LOCATIONS_DIR = '/etc/nginx/conf.d/nodered_locations'
+# Data volumes of the containers: '<container_name>-volume', labelled with the container name since the label exists
+NODERED_VOLUME_LABEL = 'biomed-iot.nodered-container'
+NODERED_VOLUME_PATTERN = re.compile(r'^(?P<container_name>[A-Za-z0-9]{20})-volume$')
+
 
 class NoderedContainer:
     def __init__(self, nodered_user_data):
@@ -26,6 +34,10 @@ class NoderedContainer:
         self.docker_client = docker.from_env()
         self.container = self.get_existing_container()
 
+    @property
+    def volume_name(self):
+        return f'{self.name}-volume'
+
     def get_existing_container(self):
         try:
             return self.docker_client.containers.get(self.name)
@@ -98,12 +110,13 @@ class NoderedContainer:
             }
 
             try:
+                self._ensure_volume()
                 self.container = self.docker_client.containers.run(
-                    'custom-node-red',
+                    NODERED_IMAGE,
                     detach=True,
                     restart_policy={'Name': 'unless-stopped'},
                     ports={'1880/tcp': None},  # Node-RED port dynamically assigned by Docker
-                    volumes={f'{self.name}-volume': {'bind': '/data', 'mode': 'rw'}},
+                    volumes={self.volume_name: {'bind': '/data', 'mode': 'rw'}},
                     name=self.name,
                     environment=env,
                     network="bridge"  # Attach the container to the default network
@@ -135,6 +148,24 @@ class NoderedContainer:
             except Exception as e:
                 print(f'An error occurred while trying to delete the nodered container: {e}')
 
+    def _ensure_volume(self):
+        # Created explicitly (not implicitly by containers.run()) to carry the label the orphan audit looks for
+        try:
+            self.docker_client.volumes.get(self.volume_name)
+        except docker.errors.NotFound:
+            self.docker_client.volumes.create(name=self.volume_name, labels={NODERED_VOLUME_LABEL: self.name})
+
+    def delete_volume(self):
+        """Removes the data volume, which is not removed together with the container. True if it is gone."""
+        try:
+            self.docker_client.volumes.get(self.volume_name).remove()
+        except docker.errors.NotFound:
+            pass
+        except Exception as e:
+            logger.error(f'Removing the Node-RED volume {self.volume_name} failed: {e}')
+            return False
+        return True
+
     # Deprecated
     def copy_json_to_container(self, container, src_path, dest_path):
         # Create a tar archive of the file
@@ -279,16 +310,17 @@ def update_nodered_nginx_conf(nodered_user_data):
 def del_nodered_nginx_conf(nodered_user_data):
     """
     Run this function when django user is deleted or if
-    delete container is implemented on the nodered dashboard page
+    delete container is implemented on the nodered dashboard page.
+    Returns True if the location block is gone (also if it did not exist).
     """
     container_name = nodered_user_data.container_name
 
     # Path to the server block create script.
     # Could be replaced by a python script
-    script_path = "/etc/nginx/conf.d/nodered_locations"  # config.nodered.SERVERBLOCK_CREATE_SCRIPT_PATH
+    script_path = NODERED_LOCATIONS_DIR  # config.nodered.SERVERBLOCK_CREATE_SCRIPT_PATH
     config_file_path = os.path.join(script_path, f"{container_name}.conf")
 
-    command = ['sudo', 'rm', config_file_path]
+    command = ['sudo', 'rm', '-f', config_file_path]
     result = subprocess.run(
         command,
         check=False,  # change to False to handle errors manually
@@ -298,4 +330,5 @@ def del_nodered_nginx_conf(nodered_user_data):
     server_utils.reload_nginx()
 
     if result.returncode != 0:
-        print('Error:', result.stderr.decode())  # TODO: Später entfernen bzw durch log ersetzen
+        logger.error("del_nodered_nginx_conf failed: %s", result.stderr.decode(errors="replace"))
+    return result.returncode == 0
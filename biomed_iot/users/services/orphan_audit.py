@@ -0,0 +1,297 @@
+import os
+import glob
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import docker
+from django.db import connections
+from biomed_iot.config_loader import config
+import users.models
+from . import server_utils
+from .nodered_utils import NODERED_IMAGE, NODERED_LOCATIONS_DIR, NODERED_VOLUME_LABEL, NODERED_VOLUME_PATTERN
+from .influx_utils import INFLUX_ALL_ACCESS_TOKEN
+from .influx_pool import influx_pool
+from .grafana_utils import grafana_client, GRAFANA_MAIN_ORG_ID
+from .mosquitto_utils import dynsec_manager, delete_dynsec_clients_and_roles
+from .mosquitto_reconcile import load_expected_state, fetch_broker_state, compute_diff
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('docker', 'nginx', 'influx', 'grafana', 'mqtt')
+# Orphans removed at the same time by cleanup_orphans()
+DEFAULT_CLEANUP_PARALLEL = 8
+
+
+class OrphanAuditReport:
+    """
+    Backend resources without an owner in the Django tables.
+
+    orphans: [{'backend', 'kind', 'id', 'name', 'details'}], 'details' describes what the resource consumes
+             (state, size, ...) or why it leaked
+    errors:  {backend: error} for backends whose inventory could not be fetched
+    """
+
+    def __init__(self):
+        self.orphans = []
+        self.errors = {}
+
+    def add(self, backend, kind, resource_id, name, **details):
+        self.orphans.append({'backend': backend, 'kind': kind, 'id': resource_id, 'name': name, 'details': details})
+
+    def counts(self):
+        counts = {}
+        for orphan in self.orphans:
+            counts[orphan['kind']] = counts.get(orphan['kind'], 0) + 1
+        return counts
+
+
+def _known_resources():
+    # Everything the audit joins against, read once
+    return {
+        'usernames': set(users.models.CustomUser.objects.values_list('username', flat=True)),
+        'container_names': set(users.models.NodeRedUserData.objects.values_list('container_name', flat=True)),
+        'bucket_ids': set(users.models.InfluxUserData.objects.values_list('bucket_id', flat=True)),
+        'bucket_token_ids': set(users.models.InfluxUserData.objects.values_list('bucket_token_id', flat=True)),
+    }
+
+
+def _get_grafana_json(path, **kwargs):
+    response = grafana_client.get(path, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+
+"""
+Inventories (one bulk listing per resource type, joined in memory)
+"""
+
+
+def _nodered_volume_container(volume):
+    # Name of the Node-RED container a volume belongs to, None for all other volumes of the host
+    labels = volume.get('Labels') or {}
+    if NODERED_VOLUME_LABEL in labels:
+        return labels[NODERED_VOLUME_LABEL]
+    match = NODERED_VOLUME_PATTERN.match(volume['Name'])  # volumes created before the label was set
+    return match.group('container_name') if match else None
+
+
+def audit_docker(known):
+    report = OrphanAuditReport()
+    docker_client = docker.from_env()
+    try:
+        for container in docker_client.containers.list(all=True, filters={'ancestor': NODERED_IMAGE}):
+            if container.name not in known['container_names']:
+                report.add(
+                    'docker', 'container', container.id, container.name,
+                    status=container.status, created=container.attrs.get('Created'),
+                )
+        # The volumes are not removed together with the containers, so they also leak for deleted users.
+        # df() returns all volumes with their size in one call.
+        for volume in docker_client.df().get('Volumes') or []:
+            container_name = _nodered_volume_container(volume)
+            usage = volume.get('UsageData') or {}
+            # Volumes still mounted by any container are never orphans
+            if container_name and container_name not in known['container_names'] and usage.get('RefCount', 0) <= 0:
+                report.add('docker', 'volume', volume['Name'], volume['Name'], size_bytes=usage.get('Size'))
+    finally:
+        docker_client.close()
+    return report
+
+
+def audit_nginx(known):
+    report = OrphanAuditReport()
+    for path in glob.glob(os.path.join(NODERED_LOCATIONS_DIR, '*.conf')):
+        container_name = os.path.basename(path)[:-len('.conf')]
+        if container_name not in known['container_names']:
+            report.add('nginx', 'nginx_conf', path, container_name, size_bytes=os.path.getsize(path))
+    return report
+
+
+def audit_influx(known):
+    report = OrphanAuditReport()
+    org_id = config.influxdb.INFLUX_ORG_ID
+    buckets = list(influx_pool.client(INFLUX_ALL_ACCESS_TOKEN).buckets_api().find_buckets_iter(org_id=org_id))
+    bucket_ids = {bucket.id for bucket in buckets}
+    for bucket in buckets:
+        if bucket.type == 'system' or bucket.name == config.influxdb.INFLUX_ADMIN_BUCKET:
+            continue
+        if bucket.id not in known['bucket_ids']:
+            retention = [rule.every_seconds for rule in bucket.retention_rules or []]
+            report.add('influx', 'bucket', bucket.id, bucket.name, retention_seconds=retention[0] if retention else 0)
+
+    response = influx_pool.session(INFLUX_ALL_ACCESS_TOKEN).get(
+        f'{influx_pool.url}/api/v2/authorizations', params={'orgID': org_id}
+    )
+    response.raise_for_status()
+    authorizations = response.json().get('authorizations', [])
+    for authorization in authorizations:
+        resources = [permission['resource'] for permission in authorization.get('permissions', [])]
+        # Only tokens shaped like the per-user bucket tokens (every permission on one specific bucket)
+        if not resources or any(r.get('type') != 'buckets' or not r.get('id') for r in resources):
+            continue
+        if authorization['id'] not in known['bucket_token_ids']:
+            token_bucket_ids = sorted({resource['id'] for resource in resources})
+            report.add(
+                'influx', 'token', authorization['id'], authorization.get('description') or authorization['id'],
+                buckets=token_bucket_ids,
+                bucket_exists=all(bucket_id in bucket_ids for bucket_id in token_bucket_ids),
+                status=authorization.get('status'),
+            )
+    return report
+
+
+def audit_grafana(known):
+    report = OrphanAuditReport()
+    # Every user has an org and a login named like the Django username
+    for org in _get_grafana_json('/api/orgs', params={'perpage': 100000}):
+        if org['id'] != GRAFANA_MAIN_ORG_ID and org['name'] not in known['usernames']:
+            report.add('grafana', 'org', org['id'], org['name'])
+    for user in _get_grafana_json('/api/users', params={'perpage': 100000}):
+        login = user.get('login')
+        if user.get('isAdmin') or login == config.grafana.GRAFANA_ADMIN_USERNAME:
+            continue
+        if login not in known['usernames']:
+            report.add('grafana', 'user', user['id'], login, last_seen=user.get('lastSeenAtAge'))
+    return report
+
+
+def audit_mqtt(known):
+    report = OrphanAuditReport()
+    expected_state = load_expected_state()
+    with dynsec_manager.session() as dynsec:
+        broker_clients, broker_roles = fetch_broker_state(dynsec)
+    diff = compute_diff(broker_clients, broker_roles, expected_state)
+    for username in diff.orphaned_clients:
+        roles = [role['rolename'] for role in broker_clients[username].get('roles', [])]
+        report.add('mqtt', 'mqtt_client', username, username, roles=roles)
+    for rolename in diff.orphaned_roles:
+        report.add('mqtt', 'mqtt_role', rolename, rolename, acls=len(broker_roles[rolename].get('acls', [])))
+    return report
+
+
+AUDITS = {
+    'docker': audit_docker,
+    'nginx': audit_nginx,
+    'influx': audit_influx,
+    'grafana': audit_grafana,
+    'mqtt': audit_mqtt,
+}
+
+
+def audit_orphans(backends=BACKENDS):
+    """
+    Lists the resources of the given backends and returns an OrphanAuditReport with those that belong to no
+    Django user. The backends are queried concurrently; a backend that fails is recorded in report.errors.
+    """
+    known = _known_resources()
+    report = OrphanAuditReport()
+
+    def audit(backend):
+        try:
+            return AUDITS[backend](known)
+        finally:
+            # The thread opened its own database connection, which Django only closes for request threads
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(backends), thread_name_prefix='audit') as executor:
+        futures = {backend: executor.submit(audit, backend) for backend in backends}
+    for backend, future in futures.items():
+        try:
+            report.orphans.extend(future.result().orphans)
+        except Exception as e:
+            logger.error(f'Orphan audit of {backend} failed: {e}')
+            report.errors[backend] = str(e)
+    return report
+
+
+"""
+Cleanup
+"""
+
+
+def _remove_container(orphan):
+    docker_client = docker.from_env()
+    try:
+        docker_client.containers.get(orphan['id']).remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    finally:
+        docker_client.close()
+
+
+def _remove_volume(orphan):
+    docker_client = docker.from_env()
+    try:
+        docker_client.volumes.get(orphan['id']).remove()
+    except docker.errors.NotFound:
+        pass
+    finally:
+        docker_client.close()
+
+
+def _remove_nginx_conf(orphan):
+    command = ['sudo', 'rm', '-f', orphan['id']]
+    result = subprocess.run(command, check=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors='replace'))
+
+
+def _delete_influx(path):
+    response = influx_pool.session(INFLUX_ALL_ACCESS_TOKEN).delete(f'{influx_pool.url}{path}')
+    if response.status_code not in (200, 204, 404):
+        raise RuntimeError(f'{response.status_code} {response.text}')
+
+
+def _delete_grafana(path):
+    response = grafana_client.delete(path)
+    if response.status_code not in (200, 204, 404):
+        raise RuntimeError(f'{response.status_code} {response.text}')
+
+
+CLEANUP_FUNCTIONS = {
+    'container': _remove_container,
+    'volume': _remove_volume,
+    'nginx_conf': _remove_nginx_conf,
+    'bucket': lambda orphan: _delete_influx(f"/api/v2/buckets/{orphan['id']}"),
+    'token': lambda orphan: _delete_influx(f"/api/v2/authorizations/{orphan['id']}"),
+    'org': lambda orphan: _delete_grafana(f"/api/orgs/{orphan['id']}"),
+    'user': lambda orphan: _delete_grafana(f"/api/admin/users/{orphan['id']}"),
+}
+
+
+def cleanup_orphans(report, parallel=DEFAULT_CLEANUP_PARALLEL):
+    """
+    Removes the orphans of an OrphanAuditReport, up to 'parallel' at a time.
+    Returns [(orphan, error)] for the orphans that could not be removed.
+    """
+    failed = []
+
+    def remove(orphan):
+        try:
+            CLEANUP_FUNCTIONS[orphan['kind']](orphan)
+            return None
+        except Exception as e:
+            logger.error(f"Removing orphaned {orphan['kind']} {orphan['name']} failed: {e}")
+            return orphan, str(e)
+
+    # All MQTT orphans in one DSP round trip
+    mqtt_clients = [orphan['id'] for orphan in report.orphans if orphan['kind'] == 'mqtt_client']
+    mqtt_roles = [orphan['id'] for orphan in report.orphans if orphan['kind'] == 'mqtt_role']
+    if mqtt_clients or mqtt_roles:
+        result = delete_dynsec_clients_and_roles(mqtt_clients, mqtt_roles)
+        errors = {**result['failed_clients'], **result['failed_roles']}
+        failed += [(orphan, errors[orphan['id']]) for orphan in report.orphans if orphan['id'] in errors]
+
+    # Volumes can only be removed after the containers that use them
+    first = [orphan for orphan in report.orphans if orphan['kind'] in CLEANUP_FUNCTIONS and orphan['kind'] != 'volume']
+    volumes = [orphan for orphan in report.orphans if orphan['kind'] == 'volume']
+    with ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='cleanup') as executor:
+        failed += [result for result in executor.map(remove, first) if result]
+        failed += [result for result in executor.map(remove, volumes) if result]
+
+    if any(orphan['kind'] == 'nginx_conf' for orphan in report.orphans):
+        try:
+            server_utils.reload_nginx()
+        except Exception as e:
+            logger.error(f'Reloading nginx after the cleanup failed: {e}')
+    return failed
@@ -0,0 +1,224 @@
+import os
+import time
+import socket
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import timedelta
+from django.db import connections, transaction
+from django.utils import timezone
+import users.models
+from .mosquitto_utils import create_mqtt_user_resources
+from .influx_utils import InfluxUserManager
+from .grafana_utils import GrafanaUserManager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Retry delays: 30 s, 1 min, 2 min, ... at most 1 h
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+# Jobs of a worker that died while running them are picked up again after this time
+STALE_JOB_SECONDS = 15 * 60
+# Threads that run independent provisioning steps at the same time
+PROVISIONING_MAX_WORKERS = 3
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def provision_mqtt(user):
+    # Safe to retry: only the roles and clients that do not exist yet are created
+    return create_mqtt_user_resources(user)
+
+
+def provision_influx(user):
+    if users.models.InfluxUserData.objects.filter(user=user).exists():
+        return True
+    return InfluxUserManager(user=user).create_new_influx_user_resources()
+
+
+def provision_grafana(user):
+    return GrafanaUserManager(user=user).create_user()
+
+
+# (name, function, ProvisioningStatus flag, names of the steps it depends on)
+PROVISIONING_STEPS = [
+    ('mqtt', provision_mqtt, 'mqtt_done', ()),
+    ('influx', provision_influx, 'influx_done', ()),
+    # The Grafana datasources are created with the bucket token of the InfluxDB step
+    ('grafana', provision_grafana, 'grafana_done', ('influx',)),
+]
+
+
+class ProvisioningOrchestrator:
+    """
+    Runs provisioning steps on a thread pool in the order given by their dependencies.
+
+    A step is started as soon as all steps it depends on succeeded (in this run or in an earlier attempt),
+    so independent branches (MQTT vs. InfluxDB -> Grafana) run at the same time and a run takes as long as
+    its slowest branch instead of the sum of all steps. Steps whose dependency failed are skipped.
+    """
+
+    label = 'Provisioning'
+
+    def __init__(self, steps=None, max_workers=PROVISIONING_MAX_WORKERS):
+        self.steps = PROVISIONING_STEPS if steps is None else steps
+        self.max_workers = max_workers
+        names = {name for name, _, _, _ in self.steps}
+        for name, _, _, depends_on in self.steps:
+            unknown = set(depends_on) - names
+            if unknown:
+                raise ValueError(f"{self.label} step {name} depends on unknown steps: {', '.join(sorted(unknown))}")
+
+    def run(self, user, status):
+        """
+        Runs the steps that are not marked as done in 'status' and stores each result in it (the flag on
+        success, the duration in status.step_timings). Returns {step name: seconds} of the steps that ran.
+        Raises ProvisioningError naming the failed and skipped steps.
+        """
+        done = {name for name, _, flag, _ in self.steps if getattr(status, flag)}
+        pending = {step[0]: step for step in self.steps if step[0] not in done}
+        failed, skipped, timings = [], [], {}
+        running = {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='provisioning') as executor:
+            while pending or running:
+                self._skip_blocked(pending, failed, skipped)
+                for name, step in list(pending.items()):
+                    if all(dependency in done for dependency in step[3]):
+                        running[executor.submit(self._run_step, user, step)] = step
+                        del pending[name]
+                if not running:
+                    if pending:
+                        raise ProvisioningError(f"Circular step dependencies: {', '.join(pending)}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, _, flag, _ = running.pop(future)
+                    success, seconds = future.result()
+                    timings[name] = round(seconds, 3)
+                    update_fields = ['step_timings', 'updated_at']
+                    if success:
+                        done.add(name)
+                        setattr(status, flag, True)
+                        update_fields.append(flag)
+                    else:
+                        failed.append(name)
+                    # Saved here and not in the step threads, so 'status' is only touched by one thread
+                    status.step_timings = {**status.step_timings, name: timings[name]}
+                    status.save(update_fields=update_fields)
+        logger.info(f'{self.label} of {user} took {time.monotonic() - started:.3f}s (steps: {timings})')
+        if failed or skipped:
+            message = f"Failed steps: {', '.join(failed)}"
+            if skipped:
+                message += f" (skipped: {', '.join(skipped)})"
+            raise ProvisioningError(message)
+        return timings
+
+    @staticmethod
+    def _skip_blocked(pending, failed, skipped):
+        # Also skips steps that depend on a step skipped in the same pass
+        blocked = True
+        while blocked:
+            blocked = [
+                name for name, step in pending.items()
+                if any(dependency in failed or dependency in skipped for dependency in step[3])
+            ]
+            for name in blocked:
+                skipped.append(name)
+                del pending[name]
+
+    def _thread_subject(self, user):
+        # Each thread works on its own instance, model instances cache related objects (user.influxuserdata)
+        return users.models.CustomUser.objects.get(pk=user.pk)
+
+    def _run_step(self, user, step):
+        name, function, _, _ = step
+        started = time.monotonic()
+        try:
+            success = function(self._thread_subject(user))
+        except Exception as e:
+            logger.error(f'{self.label} step {name} for {user} raised: {e}')
+            success = False
+        finally:
+            # The thread opened its own database connection, which Django only closes for request threads
+            connections.close_all()
+        return bool(success), time.monotonic() - started
+
+
+def enqueue_user_provisioning(user):
+    """Records a pending provisioning status and queues a job for the worker. Returns the job."""
+    users.models.ProvisioningStatus.objects.get_or_create(user=user)
+    return users.models.ProvisioningJob.objects.create(user=user)
+
+
+def run_provisioning_steps(user, status):
+    """
+    Runs the steps that are not marked as done yet (see ProvisioningOrchestrator.run()).
+    Raises ProvisioningError naming the failed steps.
+    """
+    return ProvisioningOrchestrator().run(user, status)
+
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SECONDS)
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def requeue_stale_jobs():
+    """Returns jobs locked by workers that did not finish them in time to the queue."""
+    stale_before = timezone.now() - timedelta(seconds=STALE_JOB_SECONDS)
+    return users.models.ProvisioningJob.objects.filter(
+        status=users.models.ProvisioningJob.RUNNING, locked_at__lt=stale_before
+    ).update(status=users.models.ProvisioningJob.PENDING, locked_by='', locked_at=None)
+
+
+def claim_next_job(locked_by):
+    """
+    Returns the next due job after marking it as running for 'locked_by', or None if no job is due.
+    The claim is a conditional UPDATE, so concurrent workers never get the same job (works without
+    SELECT ... FOR UPDATE SKIP LOCKED, i.e. also on SQLite).
+    """
+    Job = users.models.ProvisioningJob
+    due = Job.objects.filter(status=Job.PENDING, run_after__lte=timezone.now()).order_by('run_after', 'pk')
+    for job_id in due.values_list('pk', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, locked_by=locked_by, locked_at=timezone.now()
+        )
+        if claimed:
+            return Job.objects.select_related('user').get(pk=job_id)
+    return None
+
+
+def run_job(job):
+    """Runs a claimed job and records the result (done, retry with backoff, or failed). Returns True on success."""
+    Job = users.models.ProvisioningJob
+    Status = users.models.ProvisioningStatus
+    status, _ = Status.objects.get_or_create(user=job.user)
+    status.state = Status.RUNNING
+    status.attempts += 1
+    status.save(update_fields=['state', 'attempts', 'updated_at'])
+
+    job.attempts += 1
+    try:
+        run_provisioning_steps(job.user, status)
+    except Exception as e:
+        job.last_error = status.last_error = str(e)
+        if job.attempts >= job.max_attempts:
+            job.status, status.state = Job.FAILED, Status.FAILED
+            logger.error(f'Provisioning of {job.user} failed after {job.attempts} attempts: {e}')
+        else:
+            job.status, status.state = Job.PENDING, Status.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=backoff_seconds(job.attempts))
+            logger.warning(f'Provisioning of {job.user} failed (attempt {job.attempts}), retrying: {e}')
+    else:
+        job.status, status.state = Job.DONE, Status.DONE
+        job.last_error = status.last_error = ''
+    job.locked_by, job.locked_at = '', None
+    with transaction.atomic():
+        job.save()
+        status.save(update_fields=['state', 'last_error', 'updated_at'])
+    return job.status == Job.DONE
@@ -0,0 +1,290 @@
+import csv
+import json
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+from django.utils import timezone
+import users.models
+from .mosquitto_utils import create_mqtt_resources_for_users, BULK_USERS_PER_BATCH
+from .influx_utils import InfluxUserManager
+from .grafana_utils import GrafanaUserManager
+from .provisioning import PROVISIONING_STEPS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Threads for password hashing and the InfluxDB requests of an import
+DEFAULT_CONCURRENCY = 8
+CSV_COLUMNS = ('username', 'email', 'password', 'first_name', 'last_name')
+CREATED = 'created'
+
+
+def read_user_csv(path):
+    """
+    Reads the users to import from a CSV file with a header row. 'username' and 'email' are required,
+    'password', 'first_name' and 'last_name' are optional (users without password get an unusable one
+    and set theirs with the password reset). Raises ValueError for missing columns or duplicates.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        missing = {'username', 'email'} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Missing CSV columns: {', '.join(sorted(missing))}")
+        rows = []
+        usernames, emails = set(), set()
+        for line, row in enumerate(reader, start=2):
+            row = {column: (row.get(column) or '').strip() for column in CSV_COLUMNS}
+            if not row['username'] or not row['email']:
+                raise ValueError(f'Line {line}: username and email are required')
+            if row['username'] in usernames or row['email'].lower() in emails:
+                raise ValueError(f"Line {line}: duplicate user {row['username']} / {row['email']}")
+            usernames.add(row['username'])
+            emails.add(row['email'].lower())
+            rows.append(row)
+    return rows
+
+
+class ImportProgress:
+    """
+    Append-only progress file of an import (one JSON line per finished step of a user), so an interrupted
+    import continues where it stopped when it is started again with the same file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._done = set()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._done.add((entry['username'], entry['step']))
+
+    def done(self, username, step):
+        return (username, step) in self._done
+
+    def mark(self, username, step):
+        self.mark_all([username], step)
+
+    def mark_all(self, usernames, step, sync=False):
+        """Marks the step as finished for all usernames with one write ('sync' also flushes it to disk)."""
+        with self._lock:
+            usernames = [username for username in usernames if (username, step) not in self._done]
+            if not usernames:
+                return
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps({'username': username, 'step': step}) + '\n' for username in usernames))
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._done.update((username, step) for username in usernames)
+
+
+class UserImport:
+    """
+    Creates many users at once and provisions their MQTT, InfluxDB and Grafana resources in bulk.
+
+    The users, profiles and provisioning statuses are inserted with bulk_create (no post_save signals, so
+    no provisioning jobs are queued). Then the MQTT resources of all users are created in batched DSP
+    round trips while the buckets and tokens are created concurrently over the pooled InfluxDB client (see
+    influx_pool.InfluxClientPool). Each user's Grafana setup starts as soon as its InfluxDB step finished and
+    runs on the same thread pool (over the shared Grafana client, see grafana_utils.GrafanaClient).
+
+    Users with a failed step get a provisioning job, so the provisioning worker retries the missing steps.
+    """
+
+    def __init__(self, rows, progress, concurrency=DEFAULT_CONCURRENCY, users_per_batch=BULK_USERS_PER_BATCH):
+        self.rows = rows
+        self.progress = progress
+        self.concurrency = concurrency
+        self.users_per_batch = users_per_batch
+        self.timings = {}
+        self.skipped = []
+        self.failed = {}
+
+    def run(self):
+        """Runs the import and returns a report dict (counts, failures, per-stage seconds, users per second)."""
+        started = time.monotonic()
+        user_list, created = self._timed('create', self._create_users)
+        self._merge_status_flags(user_list)
+        self._provision(user_list)
+        self._finish(user_list)
+        self.timings['total'] = time.monotonic() - started
+        return {
+            'rows': len(self.rows),
+            'created': created,
+            'resumed': len(user_list) - created,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'provisioned': len(user_list) - len(self.failed),
+            'timings': {stage: round(seconds, 3) for stage, seconds in self.timings.items()},
+            'users_per_second': round(len(user_list) / self.timings['total'], 2) if self.timings['total'] else 0,
+        }
+
+    def _timed(self, stage, function, *args):
+        started = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            self.timings[stage] = time.monotonic() - started
+
+    def _create_users(self):
+        CustomUser = users.models.CustomUser
+        usernames = [row['username'] for row in self.rows]
+        emails = [CustomUser.objects.normalize_email(row['email']) for row in self.rows]
+        existing = {user.username: user for user in CustomUser.objects.filter(username__in=usernames)}
+        taken_emails = set(CustomUser.objects.filter(email__in=emails).values_list('email', flat=True))
+
+        resumed, new_rows = [], []
+        for row, email in zip(self.rows, emails):
+            user = existing.get(row['username'])
+            if user is not None and self.progress.done(user.username, CREATED):
+                resumed.append(user)
+            elif user is not None or email in taken_emails:
+                # Users that were not created by this import are never touched
+                self.skipped.append(row['username'])
+            else:
+                new_rows.append((row, email))
+
+        # PBKDF2 releases the GIL, so the (deliberately slow) hashing runs in parallel
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            password_hashes = list(executor.map(lambda item: make_password(item[0]['password'] or None), new_rows))
+
+        new_users = [
+            CustomUser(
+                username=row['username'],
+                email=email,
+                password=password_hash,
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+            )
+            for (row, email), password_hash in zip(new_rows, password_hashes)
+        ]
+        with transaction.atomic():
+            new_users = CustomUser.objects.bulk_create(new_users)
+            users.models.Profile.objects.bulk_create([users.models.Profile(user=user) for user in new_users])
+            users.models.ProvisioningStatus.objects.bulk_create(
+                [users.models.ProvisioningStatus(user=user) for user in new_users]
+            )
+            # Marked before the commit: if the process dies in between, the users do not exist and are created
+            # on resume despite the mark, while committed users are always marked (and resumed, not skipped)
+            self.progress.mark_all([user.username for user in new_users], CREATED, sync=True)
+        return resumed + new_users, len(new_users)
+
+    def _merge_status_flags(self, user_list):
+        # Steps the provisioning worker finished after an earlier import count as done as well
+        statuses = users.models.ProvisioningStatus.objects.filter(user__in=user_list)
+        usernames = {user.pk: user.username for user in user_list}
+        for status in statuses:
+            for name, _, flag, _ in PROVISIONING_STEPS:
+                if getattr(status, flag):
+                    self.progress.mark(usernames[status.user_id], name)
+
+    def _provision(self, user_list):
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='import') as executor:
+            stage_started = time.monotonic()
+            mqtt_users = [user for user in user_list if not self.progress.done(user.username, 'mqtt')]
+            mqtt_future = executor.submit(self._in_thread, self._provision_mqtt, mqtt_users)
+
+            influx_futures = {
+                executor.submit(self._in_thread, self._provision_influx, user): user
+                for user in user_list
+                if not self.progress.done(user.username, 'influx')
+            }
+            grafana_futures = [
+                executor.submit(self._in_thread, self._provision_grafana, user)
+                for user in user_list
+                if self.progress.done(user.username, 'influx') and not self.progress.done(user.username, 'grafana')
+            ]
+            for future in as_completed(influx_futures):
+                user = influx_futures[future]
+                if future.result():
+                    grafana_futures.append(executor.submit(self._in_thread, self._provision_grafana, user))
+            self.timings['influx'] = time.monotonic() - stage_started
+            self.timings['mqtt'] = mqtt_future.result()
+            for future in grafana_futures:
+                future.result()
+            self.timings['grafana'] = time.monotonic() - stage_started
+
+    @staticmethod
+    def _in_thread(function, *args):
+        try:
+            return function(*args)
+        finally:
+            # Pool threads open their own database connections, Django only closes those of request threads
+            connections.close_all()
+
+    def _provision_mqtt(self, user_list):
+        started = time.monotonic()
+        if not user_list:
+            return 0.0
+        try:
+            succeeded = create_mqtt_resources_for_users(user_list, users_per_batch=self.users_per_batch)
+        except Exception as e:
+            logger.error(f'Bulk MQTT provisioning failed: {e}')
+            succeeded = set()
+        for user in user_list:
+            if user.pk in succeeded:
+                self.progress.mark(user.username, 'mqtt')
+        return time.monotonic() - started
+
+    def _provision_influx(self, user):
+        try:
+            if not users.models.InfluxUserData.objects.filter(user=user).exists():
+                if not InfluxUserManager(user).create_new_influx_user_resources():
+                    return False
+        except Exception as e:
+            logger.error(f'InfluxDB provisioning of {user} failed: {e}')
+            return False
+        self.progress.mark(user.username, 'influx')
+        return True
+
+    def _provision_grafana(self, user):
+        try:
+            # Fresh instance with the bucket token the InfluxDB step stored
+            user = users.models.CustomUser.objects.select_related('influxuserdata').get(pk=user.pk)
+            if not GrafanaUserManager(user).create_user():
+                return False
+        except Exception as e:
+            logger.error(f'Grafana provisioning of {user} failed: {e}')
+            return False
+        self.progress.mark(user.username, 'grafana')
+        return True
+
+    def _finish(self, user_list):
+        Status = users.models.ProvisioningStatus
+        Job = users.models.ProvisioningJob
+        statuses = {status.user_id: status for status in Status.objects.filter(user__in=user_list)}
+        new_statuses, retry = [], []
+        now = timezone.now()
+        for user in user_list:
+            status = statuses.get(user.pk)
+            if status is None:
+                status = Status(user=user)
+                new_statuses.append(status)
+            missing = []
+            for name, _, flag, _ in PROVISIONING_STEPS:
+                setattr(status, flag, self.progress.done(user.username, name))
+                if not getattr(status, flag):
+                    missing.append(name)
+            status.state = Status.PENDING if missing else Status.DONE
+            status.last_error = f"Failed steps: {', '.join(missing)}" if missing else ''
+            status.updated_at = now
+            if missing:
+                self.failed[user.username] = missing
+                retry.append(user)
+        with transaction.atomic():
+            Status.objects.bulk_create(new_statuses)
+            Status.objects.bulk_update(
+                list(statuses.values()),
+                ['state', 'mqtt_done', 'influx_done', 'grafana_done', 'last_error', 'updated_at'],
+            )
+            queued = set(
+                Job.objects.filter(user__in=retry, status__in=[Job.PENDING, Job.RUNNING])
+                .values_list('user_id', flat=True)
+            )
+            Job.objects.bulk_create([Job(user=user) for user in retry if user.pk not in queued])
@@ -2,28 +2,34 @@ import os
 import jwt
 import secrets
 import json
+import hashlib
 import logging
 import mimetypes
 from datetime import datetime, timedelta, timezone
 from itertools import chain
+from asgiref.sync import sync_to_async
 from influxdb_client import InfluxDBClient
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth import login
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, Http404, StreamingHttpResponse
 from django.http import HttpResponseBadRequest
-from django.db import IntegrityError
 from django.db import transaction
 from .models import NodeRedUserData, CustomUser, Profile  # noqa: F401
 from .forms import UserRegisterForm, UserUpdateForm, UserLoginForm, MqttClientForm, SelectDataForm
+from .forms import MqttClientCSVUploadForm
 from .services.mosquitto_utils import MqttMetaDataManager, MqttClientManager, RoleType
+from .services.mosquitto_utils import dynsec_manager, async_dynsec_manager, dynsec_breaker
 from .services.nodered_utils import NoderedContainer, update_nodered_nginx_conf
 from .services.code_loader import load_code_examples, load_nodered_flow_examples
 from .services.email_templates import registration_confirmation_email
 from .services.influx_data_utils import InfluxDataManager, to_rfc3339
+from .services.identifier_allocator import create_with_unique_retry
 from biomed_iot.config_loader import config
 from revproxy.views import ProxyView
 # For classed based login view, remove comment after tests
@@ -74,10 +80,15 @@ def register(request):
                 if config.mail.EMAIL_VERIFICATION == "true":
                     send_verification_email(user, request)
                     msg = ('Your account has been created! '
-                           'Click the link in the confirmation email that was sent to you.')
+                           'Click the link in the confirmation email that was sent to you. '
+                           'Your devices, data storage and dashboards are being set up (provisioning…).')
                     messages.success(request, msg)
                     return redirect('login')
-                messages.success(request, 'Your account has been created! You are now able to log in')
+                messages.success(
+                    request,
+                    'Your account has been created! You are now able to log in. '
+                    'Your devices, data storage and dashboards are being set up (provisioning…).'
+                )
                 return redirect('login')
             except Exception:
                 if user:
@@ -157,37 +168,85 @@ def profile(request):
     return render(request, 'users/profile.html', context)
 
 
+def _new_device_spec(request):
+    '''A helper function returning (textname, role_type) of the device posted with the "create" action'''
+    new_device_form = MqttClientForm(request.POST)
+    if not new_device_form.is_valid():
+        messages.error(request, 'Device name is not valid. Max. 30 characters!')
+        return None
+    new_textname = new_device_form.cleaned_data['textname']
+    same = new_device_form.cleaned_data.get('same_topic', False)
+    role = RoleType.INOUT.value if same else RoleType.DEVICE.value
+    if same:
+        new_textname = f"{new_textname} [inout/]"
+    return new_textname, role
+
+
+def _uploaded_device_specs(request):
+    '''A helper function returning the (textname, role_type) list of the uploaded CSV file'''
+    upload_form = MqttClientCSVUploadForm(request.POST, request.FILES)
+    if not upload_form.is_valid():
+        for error in upload_form.errors.get('csv_file', []):
+            messages.error(request, error)
+        return None
+
+    inout_enabled = config.mosquitto.INOUT_TOPIC_ENABLED == "true"
+    specs = []
+    for textname, inout in upload_form.cleaned_data['devices']:
+        if inout and inout_enabled:
+            specs.append((f"{textname[:21]} [inout/]", RoleType.INOUT.value))  # textname max. 30 characters
+        else:
+            specs.append((textname, RoleType.DEVICE.value))
+    return specs
+
+
+def _report_created_devices(request, results):
+    '''A helper function adding the messages for the result of MqttClientManager.create_clients()'''
+    created = sum(1 for result in results if result['success'])
+    failed = [result for result in results if not result['success']]
+    if created:
+        messages.success(request, f'{created} devices successfully created.')
+    if failed:
+        failed_names = ', '.join(f"{result['textname']} ({result['error']})" for result in failed[:10])
+        more = f' and {len(failed) - 10} more' if len(failed) > 10 else ''
+        messages.error(request, f'{len(failed)} devices could not be created: {failed_names}{more}')
+
+
+def _report_deleted_device(request, client_username, success):
+    if success:
+        messages.success(
+            request,
+            f'Device with username "{client_username}" successfully deleted.',
+        )
+    else:
+        messages.error(request, 'Failed to delete the device. Please try again.')
+
+
 @login_required
 def devices(request):
     """
     For inexperienced user, MQTT-Clients are called devices since each client is usually linked to a device
     although theoretically, one could use more than one client on one device.
     For technical correctness, the term client is used here.
+
+    Served under WSGI; adevices() is the same view for ASGI deployments (see urls.py).
     """
     mqtt_client_manager = MqttClientManager(request.user)
 
     if request.method == 'POST':
-        new_device_form = MqttClientForm(request.POST)
         if request.POST.get('action') == 'create':
             print('in "create"')
-            if new_device_form.is_valid():
-                # print('form is valid')
-                # new_textname = new_device_form.cleaned_data['textname']
-                # print(f'New Textname from form = {new_textname}')
-                # mqtt_client_manager.create_client(textname=new_textname, role_type=RoleType.DEVICE.value)
-                # print('after create client')
-                new_textname = new_device_form.cleaned_data['textname']
-                same = new_device_form.cleaned_data.get('same_topic', False)
-                role = RoleType.INOUT.value if same else RoleType.DEVICE.value
-                if same:
-                    new_textname = f"{new_textname} [inout/]"
-                mqtt_client_manager.create_client(textname=new_textname, role_type=role)
-
-                messages.success(request, f'Device with name "{new_textname}" successfully created.')
-                return redirect('devices')
-            else:
-                messages.error(request, 'Device name is not valid. Max. 30 characters!')
-                return redirect('devices')
+            spec = _new_device_spec(request)
+            if spec is not None:
+                mqtt_client_manager.create_client(textname=spec[0], role_type=spec[1])
+                messages.success(request, f'Device with name "{spec[0]}" successfully created.')
+            return redirect('devices')
+
+        elif request.POST.get('action') == 'upload_csv':
+            specs = _uploaded_device_specs(request)
+            if specs is not None:
+                _report_created_devices(request, mqtt_client_manager.create_clients(specs))
+            return redirect('devices')
 
         elif 'modify' in request.POST:
             # see MqttClientManager.modify_client()
@@ -198,17 +257,49 @@ def devices(request):
             print(f'delete device ({client_username}) case')
             success = mqtt_client_manager.delete_client(client_username)
             print(success)
-            if success:
-                messages.success(
-                    request,
-                    f'Device with username "{client_username}" successfully deleted.',
-                )
-                return redirect('devices')
-            else:
-                messages.error(request, 'Failed to delete the device. Please try again.')
-                return redirect('devices')
+            _report_deleted_device(request, client_username, success)
+            return redirect('devices')
 
-    mqtt_meta_data_manager = MqttMetaDataManager(request.user)
+    return render_devices_page(request, request.user, mqtt_client_manager)
+
+
+@login_required
+async def adevices(request):
+    """
+    Async version of devices() for ASGI deployments: creating and deleting a device awaits the broker on the
+    event loop instead of occupying a thread while the Dynamic Security Plugin answers.
+    Under WSGI every async view runs in a new event loop of its own, so devices() is used there (see urls.py).
+    """
+    user = await request.auser()
+    mqtt_client_manager = MqttClientManager(user)
+
+    if request.method == 'POST':
+        if request.POST.get('action') == 'create':
+            spec = _new_device_spec(request)
+            if spec is not None:
+                await mqtt_client_manager.acreate_client(textname=spec[0], role_type=spec[1])
+                messages.success(request, f'Device with name "{spec[0]}" successfully created.')
+            return redirect('devices')
+
+        elif request.POST.get('action') == 'upload_csv':
+            specs = _uploaded_device_specs(request)
+            if specs is not None:
+                results = await sync_to_async(mqtt_client_manager.create_clients)(specs)
+                _report_created_devices(request, results)
+            return redirect('devices')
+
+        elif request.POST.get('device_username'):
+            client_username = request.POST.get('device_username')
+            success = await mqtt_client_manager.adelete_client(client_username)
+            _report_deleted_device(request, client_username, success)
+            return redirect('devices')
+
+    return await sync_to_async(render_devices_page)(request, user, mqtt_client_manager)
+
+
+def render_devices_page(request, user, mqtt_client_manager):
+    '''A helper function to render the devices page (database access is synchronous)'''
+    mqtt_meta_data_manager = MqttMetaDataManager(user)
     topic_id = mqtt_meta_data_manager.metadata.user_topic_id
     in_topic = f'in/{topic_id}/your/subtopic'
     out_topic = f'out/{topic_id}/your/subtopic'
@@ -328,18 +419,22 @@ def restricted_download(request, filename):
 
 def get_or_create_nodered_user_data(request):
     '''A helper function to get NodeRedUserData  for current user or create new if no data is there'''
-    with transaction.atomic():
-        try:
-            nodered_data, created = NodeRedUserData.objects.get_or_create(
-                user=request.user,
-                defaults={
-                    'container_name': NodeRedUserData.generate_unique_container_name(),
-                    'access_token': secrets.token_urlsafe(50),
-                },
-            )
-        except IntegrityError:
-            pass
-    return nodered_data
+    # Only allocate a container name if the user has no NodeRedUserData yet
+    nodered_data = NodeRedUserData.objects.filter(user=request.user).first()
+    if nodered_data is not None:
+        return nodered_data
+
+    def create():
+        nodered_data, created = NodeRedUserData.objects.get_or_create(
+            user=request.user,
+            defaults={
+                'container_name': NodeRedUserData.generate_unique_container_name(),
+                'access_token': secrets.token_urlsafe(50),
+            },
+        )
+        return nodered_data
+
+    return create_with_unique_retry(create)
 
 
 @login_required
@@ -711,6 +806,7 @@ def download_data(request):
             tags=tags,
             start_iso=start_iso,
             stop_iso=stop_iso,
+            wide=form.cleaned_data["wide"],
         )
         # Peek at the first chunk so we can catch “no data” here
         first_chunk = next(csv_stream)
@@ -726,7 +822,18 @@ def download_data(request):
     return response
 
 
+def _tag_pairs_etag(request):
+    # The pairs come from the schema cache, so a 304 answer costs no InfluxDB query
+    measurement = request.GET.get("measurement")
+    if not measurement:
+        return None
+    pairs = InfluxDataManager(request.user).list_tag_pairs(measurement)
+    return hashlib.md5(json.dumps(pairs).encode("utf-8")).hexdigest()
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_tag_pairs_etag)
 def ajax_get_tags(request):
     measurement = request.GET.get("measurement")
     if not measurement:
@@ -774,6 +881,19 @@ def visualize(request):
 def get_grafana(request):
     return redirect('/grafana/')
 
+
+@login_required
+def metrics(request):
+    """Staff-only JSON with the service client metrics of the worker process that serves the request."""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse({
+        'pid': os.getpid(),
+        'dynsec': dynsec_manager.stats(),
+        'dynsec_async': async_dynsec_manager.stats(),
+        'dynsec_breaker': dynsec_breaker.snapshot(),
+    })
+
 # method for reverse proxy to grafana with auto login and user validation
 # https://gist.github.com/feroda/c6b8f37e9389753453ebf7658f0590aa
 @method_decorator(login_required, name='dispatch')
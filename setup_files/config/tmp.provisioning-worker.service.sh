@@ -0,0 +1,23 @@
+#!/bin/sh
+
+# Get passed parameter
+USERNAME=$1
+SETUP_DIR=$2
+
+# Define provisioning-worker.service template (creates the MQTT, InfluxDB and Grafana resources of new users)
+cat << EOF
+[Unit]
+Description=Biomed IoT provisioning worker
+After=network.target postgresql.service mosquitto.service
+
+[Service]
+User=$USERNAME
+Group=www-data
+WorkingDirectory=$SETUP_DIR/biomed_iot
+ExecStart=$SETUP_DIR/biomed_iot/venv/bin/python manage.py provisioning_worker
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
\ No newline at end of file
@@ -20,6 +20,10 @@ def install_gunicorn():
 		f'cp {setup_dir}/setup_files/tmp/gunicorn.service /etc/systemd/system/gunicorn.service',
 		'systemctl start gunicorn.socket',
 		'systemctl enable gunicorn.socket',
+		# Worker for the provisioning jobs queued on user registration
+		f'bash {conf_dir}/tmp.provisioning-worker.service.sh {linux_user} {setup_dir} > {setup_dir}/setup_files/tmp/provisioning-worker.service',  # noqa: E501
+		f'cp {setup_dir}/setup_files/tmp/provisioning-worker.service /etc/systemd/system/provisioning-worker.service',  # noqa: E501
+		'systemctl enable --now provisioning-worker.service',
 	]
 
 	for command in commands:
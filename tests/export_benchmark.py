@@ -0,0 +1,119 @@
+"""
+Benchmark of the CSV export writer (InfluxDataManager._row_generator) against the previous one-row-per-chunk writer.
+
+Feeds synthetic FluxRecords (250 Hz ECG: 4 fields, 3 tags) to both writers, checks that they produce the same CSV
+and prints rows/s and the number of chunks handed to the StreamingHttpResponse. No InfluxDB is needed.
+
+Run from the repository root with the Django config in place: python tests/export_benchmark.py --rows 1000000
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from pathlib import Path
+
+import django
+from django.utils import timezone
+from influxdb_client.client.flux_table import FluxRecord
+
+SAMPLE_RATE_HZ = 250
+FIELDS = ['ch1', 'ch2', 'ch3', 'ch4']
+TAGS = {'device': 'ecg-07', 'patient': 'p-0042', 'session': 's1'}
+
+
+def legacy_row_generator(record_stream):
+    """The writer before the chunked one, unchanged: one dict and one bytes object per row."""
+    buffer = io.StringIO()
+    csv_writer = None
+    header_fields = None
+    local_tz = timezone.get_current_timezone()
+
+    for record in record_stream:
+        local_time = timezone.localtime(record.get_time(), local_tz)
+        row = {
+            'time': local_time.isoformat(),
+            'field': record['_field'],
+            'value': record['_value'],
+        }
+        for key, value in record.values.items():
+            if key in {'result', 'table'} or key.startswith('_'):
+                continue
+            row[key] = value
+
+        if header_fields is None:
+            header_fields = sorted(row.keys())
+            csv_writer = csv.DictWriter(buffer, fieldnames=header_fields)
+            header_labels = {key: key if key in ('time', 'field', 'value') else f'{key} (tag)' for key in header_fields}
+            buffer.write('sep=,\n')
+            csv_writer.writerow(header_labels)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+
+        csv_writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+
+    if header_fields is None:
+        raise ValueError('No matching points')
+
+
+def make_records(row_count):
+    """Records as query_stream() yields them: one table per field, in time order."""
+    start = datetime(2025, 3, 30, 0, 30, tzinfo=dt_timezone.utc)  # crosses the DST change in Europe
+    step = timedelta(microseconds=1_000_000 // SAMPLE_RATE_HZ)
+    per_field = row_count // len(FIELDS)
+    records = []
+    for table, field in enumerate(FIELDS):
+        for i in range(per_field):
+            values = {
+                'result': '_result', 'table': table,
+                '_start': start, '_stop': start + per_field * step, '_time': start + i * step,
+                '_value': (i % 1000) / 7, '_field': field, '_measurement': 'ecg', **TAGS,
+            }
+            records.append(FluxRecord(table, values))
+    return records
+
+
+def run(name, writer, records):
+    started = time.perf_counter()
+    chunks = list(writer(iter(records)))
+    seconds = time.perf_counter() - started
+    size = sum(len(chunk) for chunk in chunks)
+    print(
+        f'{name:8} {len(records) / seconds:12,.0f} rows/s  {seconds:7.2f} s  '
+        f'{len(chunks):9,} chunks  {size / len(chunks):9,.0f} bytes/chunk'
+    )
+    return b''.join(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--tz', default='Europe/Berlin', help='Time zone the timestamps are converted to.')
+    args = parser.parse_args()
+
+    # Django project directory: biomed-iot/biomed_iot
+    sys.path.append(str(Path(__file__).resolve().parent.parent / 'biomed_iot'))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'biomed_iot.settings')
+    django.setup()
+    from users.services.influx_data_utils import InfluxDataManager
+
+    timezone.activate(args.tz)
+    records = make_records(args.rows)
+    # The writer only needs the class, not a user's bucket
+    manager = InfluxDataManager.__new__(InfluxDataManager)
+
+    legacy = run('legacy', legacy_row_generator, records)
+    chunked = run('chunked', manager._row_generator, records)
+    print('output identical' if legacy == chunked else 'OUTPUT DIFFERS')
+
+
+if __name__ == '__main__':
+    main()